@@ -74,11 +74,13 @@ def create_app():
         }), 500
     @app.route('/api/health', methods=['GET'])
     def health():
+        from services.face_recognition import FaceRecognitionService
         return jsonify({
             'status': 'healthy',
             'app': 'Drishyamitra',
             'timestamp': datetime.utcnow().isoformat(),
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'face_models_ready': FaceRecognitionService.is_ready()
         }), 200
     @app.errorhandler(404)
     def not_found(error):
@@ -93,6 +95,12 @@ def create_app():
     return app
 if __name__ == '__main__':
     app = create_app()
+    if Config.FACE_PRELOAD_MODELS:
+        from services.face_recognition import FaceRecognitionService
+        try:
+            FaceRecognitionService.instance().warm_up()
+        except Exception as e:
+            app.logger.error(f"Face model preload failed: {e}")
     socketio.run(app,
         host='0.0.0.0',
         port=5000,
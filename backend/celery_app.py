@@ -1,5 +1,23 @@
 from celery import Celery
+from celery.signals import celeryd_init
+from kombu import Queue
 from config import Config
+QUEUES = ('interactive', 'bulk', 'delivery', 'maintenance')
+INFERENCE_QUEUES = ('interactive', 'bulk')
+TASK_ROUTES = {
+    'services.tasks.process_photo_faces':      {'queue': 'interactive'},
+    'services.tasks.process_photo_batch':      {'queue': 'bulk'},
+    'services.tasks.reembed_user_faces':       {'queue': 'bulk'},
+    'services.tasks.send_whatsapp_photo_task': {'queue': 'delivery'},
+    'services.tasks.finish_bulk_upload':       {'queue': 'maintenance'},
+    'services.tasks.generate_derivatives':     {'queue': 'maintenance'},
+    'services.tasks.organize_all_photos':      {'queue': 'maintenance'},
+    'services.tasks.cluster_unknown_faces':    {'queue': 'maintenance'},
+    'services.tasks.compact_embedding_shards': {'queue': 'maintenance'},
+    'services.tasks.reembed_outdated_faces':   {'queue': 'maintenance'},
+    'services.tasks.backfill_photo_hashes':    {'queue': 'maintenance'},
+    'services.tasks.cleanup_temp_storage':     {'queue': 'maintenance'},
+}
 def make_celery(app_name=__name__):
     celery = Celery(
         app_name,
@@ -11,12 +29,45 @@ def make_celery(app_name=__name__):
         'task_serializer': 'json',
         'result_serializer': 'json',
         'accept_content': ['json'],
+        # interactive: single uploads; bulk: batch inference and re-embedding;
+        # delivery: WhatsApp/email sends; maintenance: organising, derivatives, sweeps.
+        'task_queues': [Queue(name) for name in QUEUES],
+        'task_default_queue': 'maintenance',
+        'task_routes': TASK_ROUTES,
+        # Redis transport: ten priority levels, 0 served first (see services/fair_scheduling.py)
+        'broker_transport_options': {'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'},
+        'worker_prefetch_multiplier': 1,
         'beat_schedule': {
             'cleanup-temp-storage-daily': {
                 'task': 'services.tasks.cleanup_temp_storage',
-                'schedule': 86400.0, 
+                'schedule': 86400.0,
+            },
+            'reembed-outdated-faces-hourly': {
+                'task': 'services.tasks.reembed_outdated_faces',
+                'schedule': 3600.0,
             },
         }
     })
     return celery
-celery = make_celery()
\ No newline at end of file
+celery = make_celery()
+@celeryd_init.connect
+def configure_worker(sender=None, conf=None, options=None, **kwargs):
+    """
+    Size a worker for the queues it consumes (-Q): concurrency and prefetch
+    come from CELERY_QUEUE_CONCURRENCY / CELERY_QUEUE_PREFETCH unless given
+    on the command line. A worker for several queues takes the largest
+    concurrency and the smallest prefetch; workers without inference
+    queues skip loading the face models.
+    """
+    options = options if options is not None else {}
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    queues = [q.strip() for q in queues if q.strip() in QUEUES]
+    if not queues:
+        return
+    if not options.get('concurrency'):
+        conf.worker_concurrency = max(Config.CELERY_QUEUE_CONCURRENCY.get(q, 1) for q in queues)
+    if not options.get('prefetch_multiplier'):
+        conf.worker_prefetch_multiplier = min(Config.CELERY_QUEUE_PREFETCH.get(q, 1) for q in queues)
+    conf.worker_face_models = any(q in INFERENCE_QUEUES for q in queues)
\ No newline at end of file
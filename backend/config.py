@@ -6,10 +6,26 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
+def _queue_sizes(name: str, default: str) -> dict:
+    """Parse a 'queue=n,queue=n' variable; empty items are skipped and malformed ones logged and ignored."""
+    sizes = {}
+    for item in os.environ.get(name, default).split(','):
+        item = item.strip()
+        if not item:
+            continue
+        queue, sep, value = (part.strip() for part in item.partition('='))
+        try:
+            if not sep or not queue:
+                raise ValueError
+            sizes[queue] = int(value)
+        except ValueError:
+            logger.error(f"{name}: ignoring malformed entry '{item}' (expected queue=number)")
+    return sizes
 class Config:
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://127.0.0.1:6379/0'
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or 'redis://127.0.0.1:6379/0'
     SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or 'redis://127.0.0.1:6379/1'
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or 'redis://127.0.0.1:6379/2'
     DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///database/drishyamitra.db'
     if DATABASE_URL.startswith('sqlite:///'):
         db_path = DATABASE_URL.split('sqlite:///')[1]
@@ -35,9 +51,86 @@ class Config:
     UPLOAD_FOLDER      = os.path.join(basedir, 'data', 'photos')
     EMBEDDINGS_FOLDER  = os.path.join(basedir, 'data', 'embeddings')
     ORGANIZED_FOLDER   = os.path.join(basedir, 'data', 'organized')
+    DERIVATIVES_FOLDER = os.path.join(basedir, 'data', 'derivatives')
+    FACE_CROPS_FOLDER  = os.path.join(basedir, 'data', 'face_crops')
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024  
+    # Suggested chunk size for resumable uploads (/api/photos/uploads); MAX_CONTENT_LENGTH caps the whole file
+    UPLOAD_CHUNK_SIZE  = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    # Gallery derivatives: long side in px per size, served by /api/dashboard/media?size=
+    # with immutable caching; missing ones are rendered on request under a file lock.
+    DERIVATIVE_SIZES        = tuple(int(v) for v in os.environ.get('DERIVATIVE_SIZES', '256,1024').split(','))
+    DERIVATIVE_FORMAT       = os.environ.get('DERIVATIVE_FORMAT', 'webp')
+    DERIVATIVE_QUALITY      = int(os.environ.get('DERIVATIVE_QUALITY', 80))
+    DERIVATIVE_LOCK_TIMEOUT = int(os.environ.get('DERIVATIVE_LOCK_TIMEOUT', 30))
+    MEDIA_MAX_AGE           = int(os.environ.get('MEDIA_MAX_AGE', 31536000))
+    # Aligned face crops kept per Face (JPEG, long side capped) for re-embedding and avatars
+    FACE_CROP_MAX_SIDE = int(os.environ.get('FACE_CROP_MAX_SIDE', 256))
+    FACE_CROP_QUALITY  = int(os.environ.get('FACE_CROP_QUALITY', 95))
+    # Quality gate between detection and embedding: faces that are too small, low-confidence,
+    # blurry (Laplacian variance at 112 px) or turned away are stored without an embedding.
+    FACE_QUALITY_GATE           = os.environ.get('FACE_QUALITY_GATE', 'true').lower() in ('1', 'true', 'yes')
+    FACE_QUALITY_MIN_SIZE       = int(os.environ.get('FACE_QUALITY_MIN_SIZE', 32))
+    FACE_QUALITY_MIN_CONFIDENCE = float(os.environ.get('FACE_QUALITY_MIN_CONFIDENCE', 0.95))
+    FACE_QUALITY_MIN_SHARPNESS  = float(os.environ.get('FACE_QUALITY_MIN_SHARPNESS', 20.0))
+    FACE_QUALITY_MAX_YAW        = float(os.environ.get('FACE_QUALITY_MAX_YAW', 0.5))
+    FACE_QUALITY_PITCH_RANGE    = tuple(float(v) for v in os.environ.get('FACE_QUALITY_PITCH_RANGE', '0.2,0.85').split(','))
+    # Exact re-uploads (same sha256 for the same user): 'link' reuses the stored
+    # faces without inference, 'reject' answers 409. PHASH_* flags near-duplicates.
+    DUPLICATE_UPLOADS  = os.environ.get('DUPLICATE_UPLOADS', 'link')
+    PHASH_ENABLED      = os.environ.get('PHASH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE', 6))
+    # Near-duplicates this close (bits) reuse the face results of a sibling photo instead of inference.
+    PHASH_REUSE_DISTANCE = int(os.environ.get('PHASH_REUSE_DISTANCE', 2))
     FACE_MODEL    = os.environ.get('FACE_MODEL', 'Facenet512')
     FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'retinaface')
+    # Uploads are decoded once at most FACE_DECODE_MAX_SIDE px on the long
+    # side; RetinaFace runs on a copy capped at FACE_DETECT_MAX_SIDE px.
+    FACE_DECODE_MAX_SIDE = int(os.environ.get('FACE_DECODE_MAX_SIDE', 4096))
+    FACE_DETECT_MAX_SIDE = int(os.environ.get('FACE_DETECT_MAX_SIDE', 1600))
+    # Storage precision of Face.embedding: 'float32' (exact) or 'float16' (half the size)
+    FACE_EMBEDDING_DTYPE = os.environ.get('FACE_EMBEDDING_DTYPE', 'float32')
+    FACE_EMBED_BATCH_SIZE = int(os.environ.get('FACE_EMBED_BATCH_SIZE', 32))
+    BULK_PHOTOS_PER_TASK  = int(os.environ.get('BULK_PHOTOS_PER_TASK', 8))
+    # Per-queue worker sizing (applied to workers started with -Q <queue>) and the number of
+    # queued bulk batches per user that keep top priority on the bulk queue
+    CELERY_QUEUE_CONCURRENCY = _queue_sizes('CELERY_QUEUE_CONCURRENCY', 'interactive=2,bulk=1,delivery=4,maintenance=1')
+    CELERY_QUEUE_PREFETCH    = _queue_sizes('CELERY_QUEUE_PREFETCH', 'interactive=1,bulk=1,delivery=4,maintenance=1')
+    BULK_FAIR_SHARE          = int(os.environ.get('BULK_FAIR_SHARE', 2))
+    FACE_INFERENCE_MODE      = os.environ.get('FACE_INFERENCE_MODE', 'inline')
+    FACE_INFERENCE_PROCESSES = int(os.environ.get('FACE_INFERENCE_PROCESSES', max(1, (os.cpu_count() or 2) // 2)))
+    TF_INTRA_OP_THREADS      = int(os.environ.get('TF_INTRA_OP_THREADS', 0))
+    TF_INTER_OP_THREADS      = int(os.environ.get('TF_INTER_OP_THREADS', 0))
+    FACE_PRELOAD_MODELS = os.environ.get('FACE_PRELOAD_MODELS', 'true').lower() in ('1', 'true', 'yes')
+    EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', 256))
+    EMBEDDING_CACHE_TTL    = int(os.environ.get('EMBEDDING_CACHE_TTL', 300))
+    # Serve galleries from mmapped per-user .npy shards under EMBEDDINGS_FOLDER
+    FACE_EMBEDDING_SHARDS = os.environ.get('FACE_EMBEDDING_SHARDS', 'false').lower() in ('1', 'true', 'yes')
+    # Match against per-person centroid + exemplars first; only ambiguous faces
+    # (within PROTOTYPE_MARGIN of the threshold or the runner-up) scan every face.
+    FACE_PROTOTYPE_MATCHING = os.environ.get('FACE_PROTOTYPE_MATCHING', 'true').lower() in ('1', 'true', 'yes')
+    PERSON_EXEMPLARS        = int(os.environ.get('PERSON_EXEMPLARS', 4))
+    PROTOTYPE_MARGIN        = float(os.environ.get('PROTOTYPE_MARGIN', 0.08))
+    # Unknown faces from bulk uploads are merged into clusters FACE_CLUSTER_DELAY s after the last batch
+    FACE_CLUSTER_THRESHOLD = float(os.environ.get('FACE_CLUSTER_THRESHOLD', 0.40))
+    FACE_CLUSTER_DELAY     = int(os.environ.get('FACE_CLUSTER_DELAY', 60))
+    # search_by_face query embeddings cached in Redis by image sha256 + MODEL_VERSION
+    SEARCH_CACHE_TTL         = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+    SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 5000))
+    # Faces from an older MODEL_VERSION are re-embedded REEMBED_BATCH_SIZE at a time,
+    # REEMBED_CHUNK_DELAY s apart; a chain idle for REEMBED_LEASE s is resumed by the hourly sweep.
+    REEMBED_BATCH_SIZE  = int(os.environ.get('REEMBED_BATCH_SIZE', 64))
+    REEMBED_CHUNK_DELAY = int(os.environ.get('REEMBED_CHUNK_DELAY', 2))
+    REEMBED_LEASE       = int(os.environ.get('REEMBED_LEASE', 900))
+    # A photo that fails re-embedding this many times is given up (its faces lose their old embedding)
+    REEMBED_MAX_DEFERRALS = int(os.environ.get('REEMBED_MAX_DEFERRALS', 3))
+    # 'int8' keeps cached galleries as int8 codes (~4x smaller); the QUANT_RESCORE_TOP
+    # closest rows per query are re-scored exactly before thresholding.
+    FACE_GALLERY_QUANTIZATION = os.environ.get('FACE_GALLERY_QUANTIZATION', 'none')
+    QUANT_RESCORE_TOP         = int(os.environ.get('QUANT_RESCORE_TOP', 64))
+    FACE_ANN_ENABLED     = os.environ.get('FACE_ANN_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    ANN_MIN_GALLERY_SIZE = int(os.environ.get('ANN_MIN_GALLERY_SIZE', 20000))
+    ANN_NLIST            = int(os.environ.get('ANN_NLIST', 0))
+    ANN_NPROBE           = int(os.environ.get('ANN_NPROBE', 16))
     GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
     GROQ_MODEL   = os.environ.get('GROQ_MODEL', 'llama-3.3-70b-versatile')
     GMAIL_CREDENTIALS_PATH = os.path.join(basedir, 'credentials.json')
@@ -48,6 +141,8 @@ class Config:
         os.makedirs(Config.UPLOAD_FOLDER,     exist_ok=True)
         os.makedirs(Config.EMBEDDINGS_FOLDER, exist_ok=True)
         os.makedirs(Config.ORGANIZED_FOLDER,  exist_ok=True)
+        os.makedirs(Config.DERIVATIVES_FOLDER, exist_ok=True)
+        os.makedirs(Config.FACE_CROPS_FOLDER,  exist_ok=True)
         db_uri = app.config.get('SQLALCHEMY_DATABASE_URI')
         if db_uri and db_uri.startswith('sqlite:///'):
             db_path = db_uri.split('sqlite:///')[1]
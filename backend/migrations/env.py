@@ -15,6 +15,9 @@ from models.user import User
 from models.photo import Photo
 from models.face import Face
 from models.person import Person
+from models.person_prototype import PersonPrototype
+from models.embedding_migration import EmbeddingMigration
+from models.upload_session import UploadSession
 from models.history import DeliveryHistory
 target_metadata = db.metadata
 def run_migrations_offline() -> None:
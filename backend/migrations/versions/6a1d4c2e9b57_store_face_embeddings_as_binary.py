@@ -0,0 +1,61 @@
+"""store face embeddings as binary
+Revision ID: 6a1d4c2e9b57
+Revises: 3ef0c8b87850
+Create Date: 2026-10-18 10:12:31.204517
+"""
+import json
+from typing import Sequence, Union
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+revision: str = '6a1d4c2e9b57'
+down_revision: Union[str, Sequence[str], None] = '3ef0c8b87850'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+BATCH_SIZE = 1000
+# Same layout as models.database.encode_embedding: one dtype tag byte
+# (1 = float32, 2 = float16) followed by raw little-endian floats.
+_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2')}
+def _convert(select_sql: str, update_sql: str, convert) -> None:
+    """Copy faces.embedding into faces.embedding_new in id-ordered batches."""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(select_sql), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            sa.text(update_sql),
+            [{"id": row[0], "value": convert(row[1])} for row in rows],
+        )
+        last_id = rows[-1][0]
+def _to_binary(value):
+    vector = json.loads(value) if isinstance(value, str) else value
+    if not vector:
+        return None
+    return b'\x01' + np.asarray(vector, dtype=_DTYPES[1]).tobytes()
+def _to_json(value):
+    blob = bytes(value)
+    return json.dumps(np.frombuffer(blob, dtype=_DTYPES[blob[0]], offset=1).astype(float).tolist())
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('embedding_new', sa.LargeBinary(), nullable=True))
+    _convert(
+        "SELECT id, embedding FROM faces WHERE embedding IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit",
+        "UPDATE faces SET embedding_new = :value WHERE id = :id",
+        _to_binary,
+    )
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('embedding')
+        batch_op.alter_column('embedding_new', new_column_name='embedding', existing_type=sa.LargeBinary())
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('faces', sa.Column('embedding_new', sa.JSON(), nullable=True))
+    _convert(
+        "SELECT id, embedding FROM faces WHERE embedding IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit",
+        "UPDATE faces SET embedding_new = :value WHERE id = :id",
+        _to_json,
+    )
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('embedding')
+        batch_op.alter_column('embedding_new', new_column_name='embedding', existing_type=sa.JSON())
@@ -0,0 +1,19 @@
+"""add faces.crop_path
+Revision ID: a6c3e1f09b42
+Revises: f4b92d07c6e1
+Create Date: 2026-10-18 17:48:12.604913
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'a6c3e1f09b42'
+down_revision: Union[str, Sequence[str], None] = 'f4b92d07c6e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('crop_path', sa.String(length=256), nullable=True))
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('crop_path')
@@ -0,0 +1,29 @@
+"""add person_prototypes table
+Revision ID: b47e0f3a91c2
+Revises: 6a1d4c2e9b57
+Create Date: 2026-10-18 11:40:07.518203
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'b47e0f3a91c2'
+down_revision: Union[str, Sequence[str], None] = '6a1d4c2e9b57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'person_prototypes',
+        sa.Column('person_id', sa.Integer(), nullable=False),
+        sa.Column('model_version', sa.String(length=64), nullable=False),
+        sa.Column('face_count', sa.Integer(), nullable=False),
+        sa.Column('centroid', sa.LargeBinary(), nullable=True),
+        sa.Column('exemplars', sa.LargeBinary(), nullable=True),
+        sa.Column('exemplar_ids', sa.JSON(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['person_id'], ['persons.id']),
+        sa.PrimaryKeyConstraint('person_id'),
+    )
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('person_prototypes')
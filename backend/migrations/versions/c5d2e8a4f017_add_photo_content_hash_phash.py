@@ -0,0 +1,27 @@
+"""add photo content_hash and phash
+Revision ID: c5d2e8a4f017
+Revises: b47e0f3a91c2
+Create Date: 2026-10-18 13:05:44.730912
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'c5d2e8a4f017'
+down_revision: Union[str, Sequence[str], None] = 'b47e0f3a91c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('photos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('photos', sa.Column('phash', sa.String(length=16), nullable=True))
+    op.create_index('ix_photos_content_hash', 'photos', ['content_hash'])
+    op.create_index('ix_photos_phash', 'photos', ['phash'])
+    op.create_index('ix_photos_user_content_hash', 'photos', ['user_id', 'content_hash'])
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_photos_user_content_hash', table_name='photos')
+    op.drop_index('ix_photos_phash', table_name='photos')
+    op.drop_index('ix_photos_content_hash', table_name='photos')
+    with op.batch_alter_table('photos') as batch_op:
+        batch_op.drop_column('phash')
+        batch_op.drop_column('content_hash')
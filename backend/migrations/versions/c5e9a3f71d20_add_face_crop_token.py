@@ -0,0 +1,35 @@
+"""add faces.crop_token
+Revision ID: c5e9a3f71d20
+Revises: b8d4f2a61c37
+Create Date: 2026-10-18 19:02:47.318406
+"""
+import secrets
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'c5e9a3f71d20'
+down_revision: Union[str, Sequence[str], None] = 'b8d4f2a61c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+BATCH_SIZE = 1000
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('crop_token', sa.String(length=32), nullable=True))
+    bind = op.get_bind()
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id FROM faces WHERE crop_token IS NULL ORDER BY id LIMIT :limit"),
+            {"limit": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            sa.text("UPDATE faces SET crop_token = :token WHERE id = :id"),
+            [{"id": row[0], "token": secrets.token_hex(16)} for row in rows],
+        )
+    op.create_index('ix_faces_crop_token', 'faces', ['crop_token'], unique=True)
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_faces_crop_token', table_name='faces')
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('crop_token')
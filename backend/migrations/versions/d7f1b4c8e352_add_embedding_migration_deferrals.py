@@ -0,0 +1,19 @@
+"""add embedding_migrations.deferrals
+Revision ID: d7f1b4c8e352
+Revises: c5e9a3f71d20
+Create Date: 2026-10-18 20:14:09.551372
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'd7f1b4c8e352'
+down_revision: Union[str, Sequence[str], None] = 'c5e9a3f71d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('embedding_migrations', sa.Column('deferrals', sa.JSON(), nullable=True))
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('embedding_migrations') as batch_op:
+        batch_op.drop_column('deferrals')
@@ -0,0 +1,41 @@
+"""add embedding migrations and staged face embeddings
+Revision ID: d81f3b6c2a94
+Revises: c5d2e8a4f017
+Create Date: 2026-10-18 15:42:10.318207
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'd81f3b6c2a94'
+down_revision: Union[str, Sequence[str], None] = 'c5d2e8a4f017'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('pending_embedding', sa.LargeBinary(), nullable=True))
+    op.add_column('faces', sa.Column('pending_model_version', sa.String(length=64), nullable=True))
+    op.create_table(
+        'embedding_migrations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('model_version', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('last_face_id', sa.Integer(), nullable=False),
+        sa.Column('faces_total', sa.Integer(), nullable=False),
+        sa.Column('faces_done', sa.Integer(), nullable=False),
+        sa.Column('faces_failed', sa.Integer(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'model_version', name='uq_embedding_migrations_user_version'),
+    )
+    op.create_index('ix_embedding_migrations_user_id', 'embedding_migrations', ['user_id'])
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_embedding_migrations_user_id', table_name='embedding_migrations')
+    op.drop_table('embedding_migrations')
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('pending_model_version')
+        batch_op.drop_column('pending_embedding')
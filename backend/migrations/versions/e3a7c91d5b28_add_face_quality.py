@@ -0,0 +1,21 @@
+"""add face quality and rejected_reason
+Revision ID: e3a7c91d5b28
+Revises: d81f3b6c2a94
+Create Date: 2026-10-18 16:27:53.104866
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'e3a7c91d5b28'
+down_revision: Union[str, Sequence[str], None] = 'd81f3b6c2a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('faces', sa.Column('rejected_reason', sa.String(length=32), nullable=True))
+    op.add_column('faces', sa.Column('quality', sa.JSON(), nullable=True))
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('faces') as batch_op:
+        batch_op.drop_column('quality')
+        batch_op.drop_column('rejected_reason')
@@ -0,0 +1,21 @@
+"""add photos.faces_processed_at
+Revision ID: e9a2c6d4f815
+Revises: d7f1b4c8e352
+Create Date: 2026-10-18 20:41:52.806113
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'e9a2c6d4f815'
+down_revision: Union[str, Sequence[str], None] = 'd7f1b4c8e352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('photos', sa.Column('faces_processed_at', sa.DateTime(), nullable=True))
+    # Photos stored before the column existed have been through face processing already.
+    op.execute("UPDATE photos SET faces_processed_at = upload_date")
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('photos') as batch_op:
+        batch_op.drop_column('faces_processed_at')
@@ -0,0 +1,18 @@
+"""add photos.filename index
+Revision ID: f4b92d07c6e1
+Revises: e3a7c91d5b28
+Create Date: 2026-10-18 17:05:41.382190
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+revision: str = 'f4b92d07c6e1'
+down_revision: Union[str, Sequence[str], None] = 'e3a7c91d5b28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_photos_filename', 'photos', ['filename'])
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_photos_filename', table_name='photos')
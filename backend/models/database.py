@@ -1,6 +1,47 @@
+import numpy as np
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.types import TypeDecorator, LargeBinary
 from config import Config, logger
 db = SQLAlchemy()
+EMBEDDING_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+EMBEDDING_TAGS   = {"float32": 1, "float16": 2}
+def encode_embedding(vector, dtype: str = None) -> bytes:
+    """Pack a vector as one dtype tag byte followed by raw little-endian floats."""
+    tag = EMBEDDING_TAGS[dtype or Config.FACE_EMBEDDING_DTYPE]
+    return bytes([tag]) + np.asarray(vector, dtype=EMBEDDING_DTYPES[tag]).tobytes()
+def decode_embedding(blob) -> np.ndarray:
+    """Read a packed vector back as a float32 array without per-element Python objects."""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPES[blob[0]], offset=1).astype(np.float32)
+def decode_embeddings(blobs: list) -> np.ndarray:
+    """
+    Decode many packed vectors into one (N, dim) float32 matrix. When every
+    blob shares a dtype and size (the normal case) this is a single
+    frombuffer over the joined bytes.
+    """
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+    first = blobs[0]
+    if all(len(b) == len(first) and b[0] == first[0] for b in blobs):
+        dtype = EMBEDDING_DTYPES[first[0]]
+        raw = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), len(first))
+        return np.ascontiguousarray(raw[:, 1:]).view(dtype).astype(np.float32)
+    return np.stack([decode_embedding(b) for b in blobs])
+class EmbeddingVector(TypeDecorator):
+    """
+    Binary face embedding column. Accepts lists or ndarrays and returns a
+    float32 ndarray; stored as tag byte + raw float32 (or float16, see
+    FACE_EMBEDDING_DTYPE) instead of ~10 KB of JSON text per 512-d vector.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_embedding(value)
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_embedding(bytes(value))
 def init_db(app):
     db.init_app(app)
     with app.app_context():
@@ -8,6 +49,9 @@ def init_db(app):
         from models.photo import Photo
         from models.face import Face
         from models.person import Person
+        from models.person_prototype import PersonPrototype
+        from models.embedding_migration import EmbeddingMigration
+        from models.upload_session import UploadSession
         from models.history import DeliveryHistory
         from models.chat_log import ChatLog
         try:
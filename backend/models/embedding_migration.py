@@ -0,0 +1,31 @@
+from models.database import db
+from datetime import datetime
+class EmbeddingMigration(db.Model):
+    __tablename__ = 'embedding_migrations'
+    __table_args__ = (db.UniqueConstraint('user_id', 'model_version', name='uq_embedding_migrations_user_version'),)
+    id            = db.Column(db.Integer, primary_key=True)
+    user_id       = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    model_version = db.Column(db.String(64), nullable=False)   # version being migrated to
+    status        = db.Column(db.String(20), nullable=False, default='pending')   # pending | running | completed
+    last_face_id  = db.Column(db.Integer, nullable=False, default=0)   # checkpoint: faces up to this id are staged
+    faces_total   = db.Column(db.Integer, nullable=False, default=0)
+    faces_done    = db.Column(db.Integer, nullable=False, default=0)
+    faces_failed  = db.Column(db.Integer, nullable=False, default=0)
+    deferrals     = db.Column(db.JSON, nullable=True)   # {photo id: failed attempts} for photos retried later
+    started_at    = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at    = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at  = db.Column(db.DateTime, nullable=True)
+    def to_dict(self):
+        return {
+            "id":            self.id,
+            "user_id":       self.user_id,
+            "model_version": self.model_version,
+            "status":        self.status,
+            "last_face_id":  self.last_face_id,
+            "faces_total":   self.faces_total,
+            "faces_done":    self.faces_done,
+            "faces_failed":  self.faces_failed,
+            "started_at":    self.started_at.isoformat() if self.started_at else None,
+            "updated_at":    self.updated_at.isoformat() if self.updated_at else None,
+            "completed_at":  self.completed_at.isoformat() if self.completed_at else None,
+        }
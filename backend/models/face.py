@@ -1,4 +1,5 @@
-from models.database import db
+import secrets
+from models.database import db, EmbeddingVector
 from datetime import datetime
 class Face(db.Model):
     __tablename__ = 'faces'
@@ -6,10 +7,21 @@ class Face(db.Model):
     photo_id      = db.Column(db.Integer, db.ForeignKey('photos.id'), nullable=False)
     person_id     = db.Column(db.Integer, db.ForeignKey('persons.id'), nullable=True)
     bounding_box  = db.Column(db.JSON)
-    embedding     = db.Column(db.JSON)
+    embedding     = db.Column(EmbeddingVector)
     landmarks     = db.Column(db.JSON)
     confidence    = db.Column(db.Float)
-    model_version = db.Column(db.String(64), default="Facenet512-RetinaFace-MTCNN-v1")
+    # FaceRecognitionService.MODEL_VERSION at embedding time; NULL counts as outdated
+    model_version = db.Column(db.String(64))
+    # Set when the quality gate skipped embedding this face (too_small, low_confidence, blurry, profile)
+    rejected_reason = db.Column(db.String(32), nullable=True)
+    quality         = db.Column(db.JSON)   # gate metrics: size, confidence, yaw, pitch, sharpness
+    # Re-embedding under a newer MODEL_VERSION is staged here until the user's migration completes
+    pending_embedding     = db.Column(EmbeddingVector, nullable=True)
+    pending_model_version = db.Column(db.String(64), nullable=True)
+    # Aligned crop the embedding was computed from, relative to FACE_CROPS_FOLDER
+    crop_path     = db.Column(db.String(256), nullable=True)
+    # Unguessable key the crop is served under (/media/faces/<token>), so face ids are not enumerable
+    crop_token    = db.Column(db.String(32), unique=True, index=True, default=lambda: secrets.token_hex(16))
     created_at    = db.Column(db.DateTime, default=datetime.utcnow)
     def to_dict(self):
         return {
@@ -20,6 +32,9 @@ class Face(db.Model):
             "landmarks":     self.landmarks,
             "confidence":    self.confidence,
             "model_version": self.model_version,
+            "rejected_reason": self.rejected_reason,
+            "quality":       self.quality,
+            "has_crop":      self.crop_path is not None,
             "created_at":    self.created_at.isoformat() if self.created_at else None,
-            "embedding_dim": len(self.embedding) if self.embedding else None,
+            "embedding_dim": len(self.embedding) if self.embedding is not None else None,
         }
\ No newline at end of file
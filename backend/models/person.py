@@ -8,13 +8,20 @@ class Person(db.Model):
     is_auto_created = db.Column(db.Boolean, default=False, nullable=False)
     created_at     = db.Column(db.DateTime, default=datetime.utcnow)
     faces = db.relationship('Face', backref='person', lazy=True, cascade="all, delete-orphan")
+    prototype = db.relationship('PersonPrototype', uselist=False, lazy=True, cascade="all, delete-orphan")
     @property
     def face_count(self) -> int:
         return len(self.faces)
     @property
     def photo_count(self) -> int:
         return len(set(face.photo_id for face in self.faces))
+    @property
+    def avatar_face(self):
+        """Most confident accepted face with a stored crop, or None."""
+        candidates = [f for f in self.faces if f.crop_path and not f.rejected_reason]
+        return max(candidates, key=lambda f: (f.confidence or 0.0, -f.id)) if candidates else None
     def to_dict(self):
+        avatar = self.avatar_face
         return {
             "id":              self.id,
             "name":            self.name,
@@ -22,5 +29,6 @@ class Person(db.Model):
             "is_auto_created": self.is_auto_created,
             "face_count":      self.face_count,
             "photo_count":     self.photo_count,
+            "avatar_token":    avatar.crop_token if avatar else None,
             "created_at":      self.created_at.isoformat() if self.created_at else None,
         }
\ No newline at end of file
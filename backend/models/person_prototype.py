@@ -0,0 +1,21 @@
+from models.database import db, EmbeddingVector
+from datetime import datetime
+class PersonPrototype(db.Model):
+    __tablename__ = 'person_prototypes'
+    person_id     = db.Column(db.Integer, db.ForeignKey('persons.id'), primary_key=True)
+    model_version = db.Column(db.String(64), nullable=False)
+    face_count    = db.Column(db.Integer, nullable=False, default=0)
+    centroid      = db.Column(EmbeddingVector)   # mean of the person's unit-length embeddings
+    exemplars     = db.Column(EmbeddingVector)   # k diverse embeddings, flattened (k * dim)
+    exemplar_ids  = db.Column(db.JSON)           # face ids of the exemplars, in row order
+    updated_at    = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    def exemplar_matrix(self, dim: int):
+        return self.exemplars.reshape(-1, dim) if self.exemplars is not None else None
+    def to_dict(self):
+        return {
+            "person_id":     self.person_id,
+            "model_version": self.model_version,
+            "face_count":    self.face_count,
+            "exemplar_ids":  self.exemplar_ids or [],
+            "updated_at":    self.updated_at.isoformat() if self.updated_at else None,
+        }
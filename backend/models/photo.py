@@ -3,13 +3,18 @@ from datetime import datetime
 class Photo(db.Model):
     __tablename__ = 'photos'
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(256), nullable=False)
+    filename = db.Column(db.String(256), nullable=False, index=True)
     filepath = db.Column(db.String(512), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     size = db.Column(db.Integer) 
     mime_type = db.Column(db.String(64))
+    content_hash = db.Column(db.String(64), index=True)
+    phash = db.Column(db.String(16), index=True)
+    # Set once face results are stored (or copied from a duplicate); exact duplicates wait for it
+    faces_processed_at = db.Column(db.DateTime, nullable=True)
     faces = db.relationship('Face', backref='photo', lazy=True, cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_photos_user_content_hash', 'user_id', 'content_hash'),)
     def to_dict(self):
         return {
             "id": self.id,
@@ -19,12 +24,14 @@ class Photo(db.Model):
             "user_id": self.user_id,
             "mime_type": self.mime_type,
             "size": self.size,
+            "content_hash": self.content_hash,
             "faces": [
                 {
                     "id": f.id, 
                     "person_id": f.person_id, 
                     "person_name": f.person.name if f.person else "Unknown",
                     "is_new": f.person_id is None
-                } for f in getattr(self, 'faces', [])
-            ]
+                } for f in getattr(self, 'faces', []) if not f.rejected_reason
+            ],
+            "faces_skipped": sum(1 for f in getattr(self, 'faces', []) if f.rejected_reason),
         }
\ No newline at end of file
@@ -0,0 +1,26 @@
+from models.database import db
+from datetime import datetime
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    id            = db.Column(db.String(32), primary_key=True)   # uuid4 hex, handed to the client
+    user_id       = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    filename      = db.Column(db.String(256), nullable=False)   # client-side name, for the extension and logs
+    mime_type     = db.Column(db.String(64))
+    declared_size = db.Column(db.BigInteger, nullable=True)   # total announced at init, if any
+    received      = db.Column(db.BigInteger, nullable=False, default=0)   # acknowledged offset
+    status        = db.Column(db.String(20), nullable=False, default='open')   # open | completed | expired | failed
+    photo_id      = db.Column(db.Integer, db.ForeignKey('photos.id', ondelete='SET NULL'), nullable=True)
+    created_at    = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at    = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    def to_dict(self):
+        return {
+            "upload_id":     self.id,
+            "filename":      self.filename,
+            "mime_type":     self.mime_type,
+            "declared_size": self.declared_size,
+            "offset":        self.received,
+            "status":        self.status,
+            "photo_id":      self.photo_id,
+            "created_at":    self.created_at.isoformat() if self.created_at else None,
+            "updated_at":    self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -1,4 +1,5 @@
-from flask import Blueprint, jsonify, send_from_directory, current_app, request
+import os
+from flask import Blueprint, jsonify, send_from_directory, send_file, current_app, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.database import db
 from models.photo import Photo
@@ -62,6 +63,58 @@ def rename_folder(person_id):
     db.session.add(history)
     db.session.commit()
     return success_response(person.to_dict(), f"Folder renamed to {new_name}")
+def _cache_forever(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['MEDIA_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+@dashboard_bp.route('/media/faces/<string:token>')
+def serve_face_crop(token):
+    """Stored aligned crop of a face, by its random crop_token (person avatars: Person.avatar_token)."""
+    from services.face_crops import crop_file
+    face = Face.query.filter_by(crop_token=token).first() if len(token) == 32 else None
+    path = crop_file(face) if face else None
+    if not path or not os.path.exists(path):
+        return error_response("Face crop not found", 404)
+    response = send_file(path, mimetype='image/jpeg', etag=f"face-{face.crop_token}", conditional=True,
+                         max_age=current_app.config['MEDIA_MAX_AGE'])
+    return _cache_forever(response)
 @dashboard_bp.route('/media/<path:filename>')
 def serve_media(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
\ No newline at end of file
+    """
+    Serve an upload, or with ?size=<px> one of its DERIVATIVE_SIZES copies
+    (rendered on first request if the background task has not run yet).
+    Responses carry a strong content-derived ETag, are cacheable as immutable
+    and answer If-None-Match / Range requests.
+    """
+    from services.derivatives import CONTENT_TYPES, derivative_format, ensure_derivative, media_etag
+    size = request.args.get('size')
+    photo = Photo.query.filter_by(filename=filename).first()
+    if photo is None and size is None:
+        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    if photo is None:
+        return error_response("Photo not found", 404)
+    source = os.path.join(current_app.config['UPLOAD_FOLDER'], photo.filename)
+    if not os.path.exists(source):
+        return error_response("Photo file is missing", 404)
+    if size in (None, 'original'):
+        path, etag, mimetype = source, media_etag(photo), photo.mime_type
+    else:
+        if not size.isdigit() or int(size) not in current_app.config['DERIVATIVE_SIZES']:
+            sizes = ', '.join(str(s) for s in current_app.config['DERIVATIVE_SIZES'])
+            return error_response(f"size must be one of: {sizes}, original", 400)
+        fmt = derivative_format()
+        etag = media_etag(photo, int(size), fmt)
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return _cache_forever(response)
+        from filelock import Timeout
+        try:
+            path = ensure_derivative(photo, int(size), source, fmt)
+        except Timeout:
+            return error_response("Derivative is being generated, retry shortly", 503)
+        mimetype = CONTENT_TYPES[fmt]
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                         max_age=current_app.config['MEDIA_MAX_AGE'])
+    return _cache_forever(response)
\ No newline at end of file
@@ -4,17 +4,18 @@ Face API Routes
 Endpoints for face detection, person management, and face-based photo search.
 All routes require a valid JWT token.
 """
-import os
+import hashlib
 import logging
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
 from models.database import db
 from models.face import Face
 from models.person import Person
 from models.photo import Photo
+from services.face_crops import discard_crops
 from services.face_service import FaceService
 from services.face_recognition import FaceRecognitionService
+from services.search_cache import get_search_cache
 from utils.responses import success_response, error_response
 from utils.decorators import log_request
 logger = logging.getLogger(__name__)
@@ -89,7 +90,7 @@ def update_person(person_id):
     if "is_auto_created" in data:
         person.is_auto_created = bool(data["is_auto_created"])
     db.session.commit()
-    FaceRecognitionService().invalidate_cache(user_id)
+    FaceRecognitionService.instance().invalidate_cache(user_id)
     return success_response(person.to_dict(), "Person updated")
 @face_bp.route("/persons/<int:person_id>", methods=["DELETE"])
 @jwt_required()
@@ -100,9 +101,12 @@ def delete_person(person_id):
     if person.user_id != user_id:
         return error_response("Forbidden", 403)
     name = person.name
+    face_ids = [f.id for f in person.faces]
+    crop_paths = [f.crop_path for f in person.faces]
     db.session.delete(person)
     db.session.commit()
-    FaceRecognitionService().invalidate_cache(user_id)
+    discard_crops(crop_paths)
+    FaceRecognitionService.instance().discard_faces(user_id, face_ids)
     return success_response({"deleted": True, "name": name}, f"Person '{name}' deleted")
 @face_bp.route("/label", methods=["POST"])
 @jwt_required()
@@ -132,9 +136,12 @@ def label_face():
         person = Person(name=person_name, user_id=user_id, is_auto_created=False)
         db.session.add(person)
         db.session.flush()
+    previous_person_id = target_face.person_id
     target_face.person_id = person.id
     db.session.commit()
-    FaceRecognitionService().invalidate_cache(user_id)
+    service = FaceRecognitionService.instance()
+    service.refresh_prototypes([previous_person_id, person.id])
+    service.invalidate_cache(user_id)
     return success_response({
         "face_id": target_face.id,
         "person_id": person.id,
@@ -144,10 +151,15 @@ def label_face():
 @jwt_required()
 def search_by_face():
     """
-    Upload a query image and find photos containing matching faces.
-    Form-data field: `photo` (image file)
-    Returns: list of photo records whose stored faces match the query.
+    Upload a query image and find photos containing its faces.
+    Form-data field: `photo` (image file). Every face in the image is searched for.
+    Optional fields (form or query string):
+        mode   – "or" (photos with any of the faces, default) or "and" (all of them)
+        k      – page size, default 50, max 200
+        cursor – next_cursor of the previous page
+    Returns: photos ranked by face similarity, with the matching face per query face.
     """
+    from services.face_search import MODES, rank_photos, page_after, decode_cursor
     user_id = get_jwt_identity()
     if "photo" not in request.files:
         return error_response("No file provided in field 'photo'", 400)
@@ -155,54 +167,121 @@ def search_by_face():
     ext  = (file.filename.rsplit(".", 1)[-1] if "." in file.filename else "").lower()
     if ext not in ALLOWED_SEARCH_EXTENSIONS:
         return error_response(f"Unsupported file type '.{ext}'", 415)
-    temp_dir  = os.path.join(current_app.config["UPLOAD_FOLDER"], "_search_tmp")
-    os.makedirs(temp_dir, exist_ok=True)
-    temp_path = os.path.join(temp_dir, secure_filename(file.filename))
-    file.save(temp_path)
+    mode = (request.values.get("mode") or "or").lower()
+    if mode not in MODES:
+        return error_response(f"mode must be one of {', '.join(MODES)}", 400)
+    k = request.values.get("k", 50, type=int)
+    if not 1 <= k <= 200:
+        return error_response("k must be between 1 and 200", 400)
+    cursor = None
+    if request.values.get("cursor"):
+        try:
+            cursor = decode_cursor(request.values["cursor"])
+        except ValueError as exc:
+            return error_response(str(exc), 400)
+    image_bytes  = file.read()
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    service      = FaceRecognitionService.instance()
+    search_cache = get_search_cache()
+    faces_data   = search_cache.get(content_hash)
+    if faces_data is None:
+        try:
+            faces_data = service.analyze_faces(image_bytes, gate=False)
+        except Exception as exc:
+            logger.error(f"search_by_face: analysis of query image failed: {exc}")
+            return error_response("Could not read the query image", 422)
+        search_cache.put(content_hash, faces_data)
+    else:
+        logger.info(f"search_by_face: query embeddings served from cache ({content_hash[:12]})")
+    query_faces = [f for f in faces_data if f.get("embedding")]
+    if not faces_data:
+        return success_response([], "No face detected in query image")
+    if not query_faces:
+        return error_response("Could not extract embedding from query image", 422)
+    matcher = service.gallery(user_id)
+    ranked  = rank_photos(matcher, [f["embedding"] for f in query_faces], FaceRecognitionService.COSINE_THRESHOLD, mode)
+    page, next_cursor = page_after(ranked, cursor, k)
+    photos = {
+        p.id: p for p in
+        Photo.query.filter(Photo.id.in_([r["photo_id"] for r in page]), Photo.user_id == user_id).all()
+    }
+    results = [
+        {"photo": photos[r["photo_id"]].to_dict(), "score": r["score"], "matches": r["matches"]}
+        for r in page if r["photo_id"] in photos
+    ]
+    return success_response(
+        {
+            "mode":        mode,
+            "query_faces": [
+                {"index": i, "facial_area": f.get("facial_area"), "confidence": f.get("confidence")}
+                for i, f in enumerate(query_faces)
+            ],
+            "results":     results,
+            "count":       len(results),
+            "total":       len(ranked),
+            "next_cursor": next_cursor,
+        },
+        f"Found {len(ranked)} photo(s) matching {len(query_faces)} query face(s) ({mode.upper()})",
+    )
+@face_bp.route("/stats/quantization", methods=["GET"])
+@jwt_required()
+def quantization_report():
+    """
+    Measure int8 gallery quantization on the user's own faces: memory saved
+    and agreement with float32 match decisions at COSINE_THRESHOLD.
+    Query param: sample (held-out query faces, default 200, max 1000).
+    """
+    from config import Config
+    user_id = get_jwt_identity()
+    sample  = min(request.args.get("sample", 200, type=int), 1000)
+    report  = FaceRecognitionService.instance().evaluate_quantization(user_id, sample=sample)
+    if report is None:
+        return error_response("Not enough stored faces to measure", 400)
+    report["enabled"] = Config.FACE_GALLERY_QUANTIZATION
+    return success_response(report)
+@face_bp.route("/reindex", methods=["GET"])
+@jwt_required()
+def reindex_status():
+    """Progress of re-embedding the user's faces with the current MODEL_VERSION."""
+    from services.face_reembedding import EmbeddingMigrator
+    user_id = get_jwt_identity()
+    migrator = EmbeddingMigrator(FaceRecognitionService.instance(), current_app.config["UPLOAD_FOLDER"])
+    return success_response(migrator.progress(user_id))
+@face_bp.route("/reindex", methods=["POST"])
+@jwt_required()
+@log_request
+def reindex_faces():
+    """Start (or resume) re-embedding the user's faces stored under an older MODEL_VERSION."""
+    from services.tasks import reembed_outdated_faces
+    user_id = get_jwt_identity()
     try:
-        service     = FaceRecognitionService()
-        faces_data  = service.detect_and_extract_faces(temp_path)
-        if not faces_data:
-            return success_response([], "No face detected in query image")
-        query_emb   = faces_data[0].get("embedding")
-        if not query_emb:
-            return error_response("Could not extract embedding from query image", 422)
-        matched_person, scores = service.match_face(query_emb, user_id)
-        if not matched_person:
-            return success_response(
-                [],
-                f"No matching person found (best cosine distance: {scores['cosine_distance']:.4f})",
-            )
-        matched_faces = Face.query.filter_by(person_id=matched_person.id).all()
-        photo_ids     = list({f.photo_id for f in matched_faces})
-        photos        = Photo.query.filter(Photo.id.in_(photo_ids), Photo.user_id == user_id).all()
-        return success_response(
-            {
-                "person":  matched_person.to_dict(),
-                "scores":  scores,
-                "photos":  [p.to_dict() for p in photos],
-                "count":   len(photos),
-            },
-            f"Found {len(photos)} photo(s) matching '{matched_person.name}'",
-        )
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        reembed_outdated_faces.delay(user_id)
+    except Exception as exc:
+        logger.error(f"reindex_faces error: {exc}")
+        return error_response(f"Failed to start re-embedding: {str(exc)}", 500)
+    return success_response(
+        {"model_version": FaceRecognitionService.MODEL_VERSION, "status": "processing"},
+        message="Re-embedding started in background",
+        status_code=202,
+    )
 @face_bp.route("/stats", methods=["GET"])
 @jwt_required()
 def recognition_stats():
     """Return face recognition statistics for the authenticated user."""
     user_id     = get_jwt_identity()
     persons     = Person.query.filter_by(user_id=user_id).all()
-    total_faces = Face.query.join(Photo).filter(Photo.user_id == user_id).count()
+    total_faces = Face.query.join(Photo).filter(Photo.user_id == user_id, Face.rejected_reason.is_(None)).count()
+    skipped     = Face.query.join(Photo).filter(Photo.user_id == user_id, Face.rejected_reason.isnot(None)).count()
     auto_count  = sum(1 for p in persons if p.is_auto_created)
     return success_response({
         "total_persons":         len(persons),
         "auto_created_persons":  auto_count,
         "named_persons":         len(persons) - auto_count,
         "total_faces_stored":    total_faces,
+        "faces_skipped":         skipped,
         "model_pipeline":        FaceRecognitionService.MODEL_VERSION,
         "embedding_dimensions":  512,
         "matching_metric":       "cosine",
         "cosine_threshold":      FaceRecognitionService.COSINE_THRESHOLD,
+        "search_cache":          get_search_cache().stats(),
     })
\ No newline at end of file
@@ -6,9 +6,96 @@ from models.database import db
 from models.photo import Photo
 from utils.responses import success_response, error_response
 from utils.validation import validate_file_upload
+from utils.uploads import save_stream, link_or_keep, UploadTooLarge
 from datetime import datetime
 photo_bp = Blueprint('photos', __name__)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+def _find_duplicate(user_id, content_hash):
+    """Oldest photo of user_id with exactly the same bytes, if any."""
+    return Photo.query.filter_by(user_id=user_id, content_hash=content_hash).order_by(Photo.id).first()
+def _perceptual_hash(filepath):
+    if not current_app.config['PHASH_ENABLED']:
+        return None
+    from services.image_preprocessing import perceptual_hash
+    try:
+        return perceptual_hash(filepath)
+    except Exception as e:
+        current_app.logger.warning(f"Could not compute perceptual hash for {filepath}: {str(e)}")
+        return None
+def _near_duplicates(photo):
+    """Ids of the user's other photos whose perceptual hash is within PHASH_MAX_DISTANCE bits."""
+    if not photo.phash:
+        return []
+    from services.phash_index import phash_index
+    hits = phash_index.similar(photo.user_id, photo.phash, current_app.config['PHASH_MAX_DISTANCE'], exclude=photo.id)
+    return [photo_id for photo_id, _ in hits]
+def _queue_derivatives(photo_ids):
+    """Render gallery derivatives in the background; the media endpoint renders any that are still missing."""
+    try:
+        from services.tasks import generate_derivatives
+        chunk = current_app.config['BULK_PHOTOS_PER_TASK']
+        for start in range(0, len(photo_ids), chunk):
+            generate_derivatives.delay(photo_ids[start:start + chunk])
+    except Exception as e:
+        current_app.logger.warning(f"Could not queue derivatives for photos {photo_ids}: {str(e)}")
+def _reuse_sibling_faces(photo):
+    """Copy the faces of a near-identical sibling onto photo; returns (sibling, copied faces)."""
+    if not photo.phash:
+        return None, []
+    from services.phash_index import reusable_sibling
+    from services.face_service import FaceService
+    sibling = reusable_sibling(photo, current_app.config['PHASH_REUSE_DISTANCE'])
+    return sibling, (FaceService.copy_faces(sibling, photo) if sibling else [])
+def _register_photo(user_id, filename, filepath, size, content_hash, mime_type):
+    """
+    Register a fully written upload: dedup by content hash, store the Photo,
+    reuse or queue face processing and queue its derivatives. Returns
+    (photo, response for the client); photo is None when the upload is
+    rejected as a duplicate, and its file is removed.
+    """
+    duplicate = _find_duplicate(user_id, content_hash)
+    if duplicate and current_app.config['DUPLICATE_UPLOADS'] == 'reject':
+        os.remove(filepath)
+        return None, error_response("This photo has already been uploaded", 409, errors={"duplicate_of": duplicate.id})
+    if duplicate:
+        link_or_keep(duplicate.filepath, filepath)
+    photo = Photo(
+        filename=filename, 
+        filepath=filepath, 
+        user_id=user_id,
+        size=size,
+        mime_type=mime_type,
+        content_hash=content_hash,
+        phash=_perceptual_hash(filepath),
+    )
+    db.session.add(photo)
+    db.session.commit()
+    from services.phash_index import phash_index
+    phash_index.add(photo)
+    from services.face_service import FaceService
+    sibling, reused = None, []
+    if duplicate is None:
+        sibling, reused = _reuse_sibling_faces(photo)
+    elif duplicate.faces_processed_at:
+        FaceService.copy_faces(duplicate, photo)
+    # An exact duplicate of a photo still in processing takes its faces once that finishes.
+    if duplicate is None and not reused:
+        try:
+            from services.tasks import process_photo_faces
+            process_photo_faces.delay(photo.id)
+        except Exception:
+            FaceService.process_photo_async(
+                current_app._get_current_object(), photo.id, filepath, user_id
+            )
+    _queue_derivatives([photo.id])
+    data = photo.to_dict()
+    if duplicate:
+        data["duplicate_of"] = duplicate.id
+    if sibling and reused:
+        data["near_duplicate_of"] = sibling.id
+    if photo.phash:
+        data["near_duplicates"] = _near_duplicates(photo)
+    return photo, success_response(data, "Photo uploaded and registered successfully", 201)
 @photo_bp.route('/', methods=['GET'])
 @jwt_required()
 def list_photos():
@@ -27,36 +114,145 @@ def upload():
     filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
     try:
         os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
-        file.save(filepath)
-        stats = os.stat(filepath)
-        current_app.logger.info(f"Photo uploaded: {filename}, Size: {stats.st_size} bytes, Type: {file.content_type}")
-        if stats.st_size > current_app.config['MAX_CONTENT_LENGTH']:
-            current_app.logger.warning(f"File {filename} rejected: size {stats.st_size} exceeds limit {current_app.config['MAX_CONTENT_LENGTH']}")
-            os.remove(filepath)
-            return error_response(f"File too large. Maximum size is {current_app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB", 413)
-        photo = Photo(
-            filename=filename, 
-            filepath=filepath, 
-            user_id=user_id,
-            size=stats.st_size,
-            mime_type=file.content_type
-        )
-        db.session.add(photo)
-        db.session.commit()
         try:
-            from services.tasks import process_photo_faces
-            process_photo_faces.delay(photo.id)
-        except Exception:
-            from services.face_service import FaceService
-            FaceService.process_photo_async(
-                current_app._get_current_object(), photo.id, filepath, user_id
-            )
-        return success_response(photo.to_dict(), "Photo uploaded and registered successfully", 201)
+            size, hasher = save_stream(file.stream, filepath, max_bytes=current_app.config['MAX_CONTENT_LENGTH'])
+        except UploadTooLarge:
+            current_app.logger.warning(f"File {filename} rejected: exceeds limit {current_app.config['MAX_CONTENT_LENGTH']}")
+            return error_response(f"File too large. Maximum size is {current_app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB", 413)
+        content_hash = hasher.hexdigest()
+        current_app.logger.info(f"Photo uploaded: {filename}, Size: {size} bytes, Type: {file.content_type}, sha256: {content_hash[:12]}")
+        _, response = _register_photo(user_id, filename, filepath, size, content_hash, file.content_type)
+        return response
     except Exception as e:
         if os.path.exists(filepath):
             os.remove(filepath)
         current_app.logger.error(f"Upload failed: {str(e)}")
         return error_response(f"An error occurred during upload: {str(e)}", 500)
+def _upload_session(upload_id, user_id):
+    from models.upload_session import UploadSession
+    return UploadSession.query.filter_by(id=upload_id, user_id=user_id).first()
+@photo_bp.route('/uploads', methods=['POST'])
+@jwt_required()
+def init_chunked_upload():
+    """
+    Start a resumable upload: {filename, size?, mime_type?}. Chunks are then
+    sent with PATCH /uploads/<id> and an Upload-Offset header, and the photo
+    is registered by POST /uploads/<id>/finalize.
+    """
+    data = request.get_json(silent=True) or {}
+    user_id = get_jwt_identity()
+    name = data.get('filename') or ''
+    if '.' not in name or name.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+        return error_response(f"Invalid file type. Allowed types: {', '.join(sorted(ALLOWED_EXTENSIONS))}", 400)
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or size <= 0):
+        return error_response("size must be a positive integer", 400)
+    if size and size > current_app.config['MAX_CONTENT_LENGTH']:
+        return error_response(f"File too large. Maximum size is {current_app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB", 413)
+    from services import chunked_uploads
+    session = chunked_uploads.create(user_id, name, data.get('mime_type'), size, current_app.config['UPLOAD_FOLDER'])
+    current_app.logger.info(f"Chunked upload {session.id} started by user {user_id}: {name} ({size or 'unknown'} bytes)")
+    result = session.to_dict()
+    result["chunk_size"] = current_app.config['UPLOAD_CHUNK_SIZE']
+    return success_response(result, "Upload started", 201)
+@photo_bp.route('/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def chunked_upload_status(upload_id):
+    """Acknowledged offset of an upload; a resuming client continues from there."""
+    session = _upload_session(upload_id, get_jwt_identity())
+    if not session:
+        return error_response("Upload not found", 404)
+    return success_response(session.to_dict())
+@photo_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required()
+def append_chunk(upload_id):
+    """Append the raw request body at the Upload-Offset header (or ?offset=)."""
+    session = _upload_session(upload_id, get_jwt_identity())
+    if not session:
+        return error_response("Upload not found", 404)
+    if session.status != 'open':
+        return error_response(f"Upload is {session.status}", 409, errors={"photo_id": session.photo_id})
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return error_response("Upload-Offset header is required", 400)
+    from services import chunked_uploads
+    try:
+        end = chunked_uploads.append(
+            session, request.stream, offset, current_app.config['MAX_CONTENT_LENGTH'], current_app.config['UPLOAD_FOLDER']
+        )
+    except chunked_uploads.OffsetMismatch as e:
+        return error_response(str(e), 409, errors={"offset": e.expected})
+    except chunked_uploads.ChunkInProgress as e:
+        return error_response(str(e), 409, errors={"offset": session.received})
+    except UploadTooLarge:
+        limit = session.declared_size or current_app.config['MAX_CONTENT_LENGTH']
+        return error_response(f"Upload exceeds {limit} bytes", 413, errors={"offset": session.received})
+    return success_response({"upload_id": session.id, "offset": end}, "Chunk stored")
+@photo_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@jwt_required()
+def finalize_chunked_upload(upload_id):
+    """
+    Register the uploaded bytes as a photo (same dedup and processing as
+    /upload). An optional {"sha256"} is checked against the server-side hash.
+    """
+    user_id = get_jwt_identity()
+    session = _upload_session(upload_id, user_id)
+    if not session:
+        return error_response("Upload not found", 404)
+    if session.status != 'open':
+        return error_response(f"Upload is {session.status}", 409, errors={"photo_id": session.photo_id})
+    if not session.received or (session.declared_size and session.received != session.declared_size):
+        return error_response("Upload is incomplete", 400, errors={"offset": session.received, "size": session.declared_size})
+    from services import chunked_uploads
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    content_hash = chunked_uploads.digest(session, upload_folder)
+    expected = ((request.get_json(silent=True) or {}).get('sha256') or '').lower()
+    if expected and expected != content_hash:
+        return error_response("Checksum mismatch", 422, errors={"sha256": content_hash})
+    ext = session.filename.rsplit('.', 1)[1].lower()
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
+    filename = secure_filename(f"user_{user_id}_{timestamp}.{ext}")
+    filepath = os.path.join(upload_folder, filename)
+    try:
+        os.replace(chunked_uploads.part_path(session, upload_folder), filepath)
+        current_app.logger.info(f"Chunked upload {session.id} finalized: {filename}, Size: {session.received} bytes, sha256: {content_hash[:12]}")
+        photo, response = _register_photo(user_id, filename, filepath, session.received, content_hash, session.mime_type)
+        chunked_uploads.complete(session, photo.id if photo else None, upload_folder)
+        return response
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Finalizing upload {upload_id} failed: {str(e)}")
+        _recover_finalize(session, filename, filepath, upload_folder)
+        return error_response(f"An error occurred during upload: {str(e)}", 500)
+def _recover_finalize(session, filename, filepath, upload_folder):
+    """
+    Leave a session whose finalize failed in a consistent state: completed
+    when its Photo was already stored, open with the part file moved back
+    (so finalize can be retried) when not, failed if neither works.
+    """
+    from services import chunked_uploads
+    try:
+        photo = Photo.query.filter_by(filename=filename).first()
+        if photo:
+            chunked_uploads.complete(session, photo.id, upload_folder)
+        elif os.path.exists(filepath):
+            os.replace(filepath, chunked_uploads.part_path(session, upload_folder))
+        else:
+            chunked_uploads.fail(session, upload_folder)
+    except Exception as exc:
+        db.session.rollback()
+        current_app.logger.error(f"Upload {session.id} could not be recovered, marking it failed: {exc}")
+        chunked_uploads.fail(session, upload_folder)
+@photo_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@jwt_required()
+def abort_chunked_upload(upload_id):
+    session = _upload_session(upload_id, get_jwt_identity())
+    if not session:
+        return error_response("Upload not found", 404)
+    from services import chunked_uploads
+    chunked_uploads.discard(session, current_app.config['UPLOAD_FOLDER'])
+    return success_response(None, "Upload aborted")
 @photo_bp.route('/bulk_upload', methods=['POST'])
 @jwt_required()
 def bulk_upload():
@@ -68,6 +264,7 @@ def bulk_upload():
         return error_response("No files selected", 400)
     user_id = get_jwt_identity()
     uploaded_photos = []
+    pending = []
     errors = []
     os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
     for file in files:
@@ -81,33 +278,124 @@ def bulk_upload():
         filename = secure_filename(f"user_{user_id}_{timestamp}.{ext}")
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         try:
-            file.save(filepath)
-            stats = os.stat(filepath)
-            current_app.logger.info(f"Bulk photo saved: {filename}, Size: {stats.st_size} bytes, Type: {file.content_type}")
+            size, hasher = save_stream(file.stream, filepath, max_bytes=current_app.config['MAX_CONTENT_LENGTH'])
+            content_hash = hasher.hexdigest()
+            current_app.logger.info(f"Bulk photo saved: {filename}, Size: {size} bytes, Type: {file.content_type}")
+            duplicate = _find_duplicate(user_id, content_hash)
+            if duplicate and current_app.config['DUPLICATE_UPLOADS'] == 'reject':
+                os.remove(filepath)
+                errors.append(f"{file.filename} is a duplicate of photo {duplicate.id}")
+                continue
+            if duplicate:
+                link_or_keep(duplicate.filepath, filepath)
             photo = Photo(
                 filename=filename, 
                 filepath=filepath, 
                 user_id=user_id,
-                size=stats.st_size,
-                mime_type=file.content_type
+                size=size,
+                mime_type=file.content_type,
+                content_hash=content_hash,
+                phash=_perceptual_hash(filepath),
             )
             db.session.add(photo)
             db.session.flush() 
-            from services.tasks import process_photo_faces
-            process_photo_faces.delay(photo.id)
             uploaded_photos.append({
                 "id": photo.id,
-                "filename": filename
+                "filename": filename,
+                "duplicate_of": duplicate.id if duplicate else None,
             })
+            pending.append((photo, duplicate))
+        except UploadTooLarge:
+            errors.append(f"{file.filename} exceeds the maximum upload size")
         except Exception as e:
             current_app.logger.error(f"Failed to process {file.filename}: {str(e)}")
             errors.append(f"{file.filename} failed to save: {str(e)}")
     db.session.commit()
+    from services.face_service import FaceService
+    photo_ids = []
+    for (photo, duplicate), entry in zip(pending, uploaded_photos):
+        if duplicate:
+            # Reuse the original's results, now or once its processing finishes; never run inference twice.
+            if duplicate.faces_processed_at:
+                FaceService.copy_faces(duplicate, photo)
+            continue
+        sibling, reused = _reuse_sibling_faces(photo)
+        if reused:
+            entry["near_duplicate_of"] = sibling.id
+            continue
+        photo_ids.append(photo.id)
+    if pending:
+        _queue_derivatives([photo.id for photo, _ in pending])
+        _dispatch_bulk(user_id, photo_ids, [photo.id for photo, _ in pending], uploaded_photos)
     return success_response({
         "uploaded": uploaded_photos,
         "failed": errors,
         "total_successful": len(uploaded_photos)
     }, "Bulk upload processed", 201)
+def _dispatch_bulk(user_id, photo_ids, all_ids, uploaded_photos):
+    """
+    Queue face processing of a bulk upload as one chord (batches, then
+    finish_bulk_upload). When the broker refuses it, the fair-share slots
+    are given back and each photo falls back to process_photo_async; photos
+    that cannot be queued at all are flagged in their upload entry.
+    """
+    from celery import chord
+    from services.fair_scheduling import reserve, release
+    from services.face_service import FaceService
+    from services.tasks import process_photo_batch, finish_bulk_upload
+    chunk = current_app.config['BULK_PHOTOS_PER_TASK']
+    chunks = [photo_ids[start:start + chunk] for start in range(0, len(photo_ids), chunk)]
+    reserved = 0
+    try:
+        priorities = reserve(user_id, len(chunks))
+        reserved = len(chunks)
+        batches = [
+            process_photo_batch.s(ids, False, user_id).set(priority=priority)
+            for ids, priority in zip(chunks, priorities)
+        ]
+        callback = finish_bulk_upload.s(user_id, all_ids)
+        if batches:
+            chord(batches)(callback)
+        else:
+            callback.delay([])
+        return
+    except Exception as exc:
+        current_app.logger.error(f"Bulk upload dispatch failed for user {user_id}: {exc}")
+        if reserved:
+            release(user_id, reserved)
+    app = current_app._get_current_object()
+    entries = {entry["id"]: entry for entry in uploaded_photos}
+    for photo_id in photo_ids:
+        try:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], entries[photo_id]["filename"])
+            FaceService.process_photo_async(app, photo_id, filepath, user_id)
+        except Exception as exc:
+            current_app.logger.error(f"Could not queue face processing of photo {photo_id}: {exc}")
+            entries[photo_id]["processing_queued"] = False
+@photo_bp.route('/<int:photo_id>/similar', methods=['GET'])
+@jwt_required()
+def similar_photos(photo_id):
+    """Near-duplicates and burst siblings of a photo, closest first (max_distance in bits, 0-16)."""
+    user_id = get_jwt_identity()
+    photo = Photo.query.filter_by(id=photo_id, user_id=user_id).first()
+    if not photo:
+        return error_response("Photo not found or unauthorized", 404)
+    if not photo.phash:
+        return error_response("This photo has no perceptual hash", 409)
+    try:
+        max_distance = int(request.args.get('max_distance', current_app.config['PHASH_MAX_DISTANCE']))
+    except ValueError:
+        return error_response("max_distance must be an integer", 400)
+    if not 0 <= max_distance <= 16:
+        return error_response("max_distance must be between 0 and 16", 400)
+    from services.phash_index import phash_index
+    hits = phash_index.similar(photo.user_id, photo.phash, max_distance, exclude=photo.id)
+    found = {p.id: p for p in Photo.query.filter(Photo.id.in_([pid for pid, _ in hits]), Photo.user_id == photo.user_id)} if hits else {}
+    similar = [
+        {"photo": found[pid].to_dict(), "distance": distance}
+        for pid, distance in hits if pid in found
+    ]
+    return success_response({"photo_id": photo.id, "max_distance": max_distance, "similar": similar, "count": len(similar)})
 @photo_bp.route('/organize', methods=['POST'])
 @jwt_required()
 def organize_photos():
@@ -146,9 +434,18 @@ def delete_photo(photo_id):
         from models.person import Person
         from models.face import Face
         person_ids_to_check = list(set([f.person_id for f in photo.faces if f.person_id]))
+        face_ids = [f.id for f in photo.faces]
+        crop_paths = [f.crop_path for f in photo.faces]
         current_app.logger.info(f"Checking for empty persons. Person IDs: {person_ids_to_check}")
         db.session.delete(photo)
         db.session.commit()
+        if not photo.content_hash or not Photo.query.filter_by(content_hash=photo.content_hash).first():
+            from services.derivatives import discard_derivatives
+            discard_derivatives(photo)
+        from services.face_crops import discard_crops
+        discard_crops(crop_paths)
+        from services.face_recognition import FaceRecognitionService
+        FaceRecognitionService.instance().discard_faces(user_id, face_ids, person_ids_to_check)
         for person_id in person_ids_to_check:
             try:
                 remaining_faces = Face.query.filter_by(person_id=person_id).count()
@@ -0,0 +1,198 @@
+"""
+ANN Index
+=========
+Optional per-user IVF (inverted file) index for very large face galleries.
+Stored embeddings are partitioned by a spherical k-means coarse quantiser;
+a query only probes the `nprobe` closest partitions, and the resulting
+shortlist is re-scored exactly by FaceMatcher so COSINE_THRESHOLD keeps its
+meaning. The index holds only centroids and face ids — vectors stay in the
+gallery — and is persisted as EMBEDDINGS_FOLDER/user_<id>/ivf_index.npz.
+"""
+import os
+import time
+import logging
+import weakref
+import threading
+import numpy as np
+from filelock import FileLock
+logger = logging.getLogger(__name__)
+class IVFIndex:
+    TRAIN_POINTS_PER_LIST = 40
+    KMEANS_ITERATIONS     = 10
+    ASSIGN_CHUNK          = 16384
+    def __init__(self, centroids: np.ndarray, lists: list, model_version: str, trained_size: int):
+        self.centroids     = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.lists         = lists
+        self.model_version = model_version
+        self.trained_size  = trained_size
+    def __len__(self) -> int:
+        return sum(len(l) for l in self.lists)
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+    def face_ids(self) -> np.ndarray:
+        if not self.lists:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(self.lists)
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.ASSIGN_CHUNK):
+            chunk = vectors[start:start + self.ASSIGN_CHUNK]
+            out[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return out
+    @classmethod
+    def build(cls, face_ids, vectors: np.ndarray, model_version: str, nlist: int = 0, seed: int = 0) -> "IVFIndex":
+        """Train centroids on a sample of (already L2-normalised) vectors and assign every row."""
+        t0 = time.time()
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        count = len(face_ids)
+        if nlist <= 0:
+            nlist = int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, nlist * cls.TRAIN_POINTS_PER_LIST)
+        sample = vectors[np.sort(rng.choice(count, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(cls.KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            used, starts = np.unique(assign[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[used] = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = sums / np.where(norms > 0, norms, 1.0)[:, None]
+        index = cls(centroids, [np.zeros(0, dtype=np.int64) for _ in range(nlist)], model_version, count)
+        index.add(face_ids, vectors)
+        logger.info(f"Built IVF index: {count} faces, nlist={nlist} [{time.time() - t0:.2f}s]")
+        return index
+    def add(self, face_ids, vectors: np.ndarray) -> None:
+        """Append new (normalised) vectors to their closest partitions."""
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        if not len(face_ids):
+            return
+        assign = self._assign(np.asarray(vectors, dtype=np.float32))
+        order  = np.argsort(assign, kind="stable")
+        lists, starts = np.unique(assign[order], return_index=True)
+        for li, chunk in zip(lists, np.split(face_ids[order], starts[1:])):
+            self.lists[li] = np.concatenate([self.lists[li], chunk])
+    def probe(self, queries: np.ndarray, nprobe: int) -> list:
+        """Return, per normalised query, the face ids stored in its nprobe closest partitions."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = queries @ self.centroids.T
+        nearest = np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+        return [np.concatenate([self.lists[li] for li in row]) for row in nearest]
+    def save(self, path: str) -> None:
+        sizes = np.array([len(l) for l in self.lists], dtype=np.int64)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            centroids=self.centroids,
+            sizes=sizes,
+            face_ids=self.face_ids(),
+            model_version=np.array(self.model_version),
+            trained_size=np.array(self.trained_size),
+        )
+        os.replace(tmp, path)
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            offsets = np.cumsum(data["sizes"])[:-1]
+            lists = np.split(data["face_ids"].astype(np.int64), offsets)
+            return cls(data["centroids"], lists, str(data["model_version"]), int(data["trained_size"]))
+class AnnIndexStore:
+    """
+    Loads, repairs and caches per-user IVF indexes.
+    The on-disk file is guarded by a file lock so web and Celery processes
+    can update it concurrently. When the gallery has drifted from the index
+    (missing faces are added, too many deleted faces or a model change
+    trigger a rebuild) the file is rewritten before use.
+    """
+    STALE_FRACTION = 0.2
+    REBUILD_GROWTH = 4
+    def __init__(self, folder: str, min_size: int, nlist: int, nprobe: int, model_version: str):
+        self.folder        = folder
+        self.min_size      = min_size
+        self.nlist         = nlist
+        self.nprobe        = nprobe
+        self.model_version = model_version
+        self._indexes: dict = {}
+        self._lock = threading.Lock()
+    def path(self, user_id: int) -> str:
+        return os.path.join(self.folder, f"user_{user_id}", "ivf_index.npz")
+    def _needs_rebuild(self, index, matcher) -> bool:
+        if index is None or index.model_version != self.model_version:
+            return True
+        if index.centroids.shape[1] != matcher.dim:
+            return True
+        if len(matcher) > self.REBUILD_GROWTH * max(index.trained_size, 1):
+            return True
+        stale = len(np.setdiff1d(index.face_ids(), matcher.face_ids, assume_unique=True))
+        return stale > self.STALE_FRACTION * max(len(index), 1)
+    def _sync(self, user_id: int, matcher) -> IVFIndex:
+        path = self.path(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with FileLock(f"{path}.lock"):
+            index = None
+            if os.path.exists(path):
+                try:
+                    index = IVFIndex.load(path)
+                except Exception as exc:
+                    logger.warning(f"Discarding unreadable ANN index {path}: {exc}")
+            if self._needs_rebuild(index, matcher):
+                index = IVFIndex.build(matcher.face_ids, matcher.vectors(), self.model_version, self.nlist)
+                index.save(path)
+            else:
+                missing = np.setdiff1d(matcher.face_ids, index.face_ids(), assume_unique=True)
+                if len(missing):
+                    index.add(missing, matcher.vectors(matcher.rows_for(missing)))
+                    index.save(path)
+                    logger.info(f"ANN index for user {user_id}: added {len(missing)} missing face(s)")
+            return index
+    def get(self, user_id: int, matcher):
+        """Return an index consistent with matcher, or None when exact search should be used."""
+        if len(matcher) < self.min_size:
+            return None
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is not None and cached[1]() is matcher:
+                return cached[0]
+        index = self._sync(user_id, matcher)
+        with self._lock:
+            self._indexes[user_id] = (index, weakref.ref(matcher))
+        return index
+    def add_faces(self, user_id: int, face_ids, vectors: np.ndarray) -> None:
+        """Incrementally add newly stored (normalised) vectors to an existing on-disk index."""
+        path = self.path(user_id)
+        if not os.path.exists(path):
+            return
+        with FileLock(f"{path}.lock"):
+            try:
+                index = IVFIndex.load(path)
+            except Exception as exc:
+                logger.warning(f"Could not update ANN index {path}: {exc}")
+                return
+            index.add(face_ids, vectors)
+            index.save(path)
+        with self._lock:
+            self._indexes.pop(user_id, None)
+    def drop(self, user_id: int) -> None:
+        """Delete the user's index so the next search rebuilds it from the current gallery."""
+        path = self.path(user_id)
+        if os.path.exists(path):
+            with FileLock(f"{path}.lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._lock:
+            self._indexes.pop(user_id, None)
+    def search(self, user_id: int, matcher, queries, threshold: float, top_k: int = 5):
+        """Probe the index and exactly re-rank the shortlist; None if the gallery is below the cutoff."""
+        index = self.get(user_id, matcher)
+        if index is None:
+            return None
+        q, _ = matcher.normalize(queries)
+        shortlists = [matcher.rows_for(ids) for ids in index.probe(q, self.nprobe)]
+        return matcher.match_candidates(queries, shortlists, threshold, top_k=top_k)
@@ -0,0 +1,113 @@
+"""
+Chunked Uploads
+===============
+Resumable uploads in three steps. init creates an upload_sessions row and
+an empty part file under UPLOAD_FOLDER/temp. Each append streams one chunk
+into the part file at the acknowledged offset, which only moves forward once
+the chunk is fully written, so a client that lost a connection asks for the
+session and resends from its offset. finalize hands the completed file to the
+regular photo registration; if that fails the part file is moved back so
+finalize can be retried.
+The sha256 is computed while chunks are written: every process keeps the
+hash state of the sessions it appended to, keyed by offset. When a chunk
+lands on another worker, or after a restart, the prefix is re-hashed once
+from the part file. The total is checked against MAX_CONTENT_LENGTH on every
+chunk. Abandoned sessions expire with the daily temp cleanup.
+"""
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from filelock import FileLock, Timeout
+from models.database import db
+from models.upload_session import UploadSession
+from utils.uploads import append_stream, hash_file
+logger = logging.getLogger(__name__)
+class OffsetMismatch(Exception):
+    """Raised by append when the chunk does not start at the acknowledged offset."""
+    def __init__(self, expected: int):
+        super().__init__(f"Chunk must start at offset {expected}")
+        self.expected = expected
+class ChunkInProgress(Exception):
+    """Raised by append while another request is writing to the same session."""
+_hashers: dict = {}   # upload id -> (offset, sha256 state of the first offset bytes)
+_hashers_lock = threading.Lock()
+def temp_folder(upload_folder: str) -> str:
+    return os.path.join(upload_folder, "temp")
+def part_path(session: UploadSession, upload_folder: str) -> str:
+    return os.path.join(temp_folder(upload_folder), f"{session.id}.part")
+def _hasher_at(session: UploadSession, path: str, offset: int):
+    """A fresh copy of the sha256 state after offset bytes, re-hashing the part file if this process has none."""
+    with _hashers_lock:
+        cached = _hashers.get(session.id)
+    if cached and cached[0] == offset:
+        return cached[1].copy()
+    if offset:
+        logger.info(f"Upload {session.id}: re-hashing the first {offset} bytes")
+    return hash_file(path, offset) if offset else hashlib.sha256()
+def create(user_id: int, filename: str, mime_type: str, declared_size: int, upload_folder: str) -> UploadSession:
+    session = UploadSession(
+        id=uuid.uuid4().hex, user_id=user_id, filename=filename, mime_type=mime_type,
+        declared_size=declared_size, received=0, status="open",
+    )
+    os.makedirs(temp_folder(upload_folder), exist_ok=True)
+    open(part_path(session, upload_folder), "wb").close()
+    db.session.add(session)
+    db.session.commit()
+    return session
+def append(session: UploadSession, stream, offset: int, max_bytes: int, upload_folder: str) -> int:
+    """
+    Write one chunk at offset and acknowledge it. Returns the new offset.
+    Raises OffsetMismatch, ChunkInProgress or utils.uploads.UploadTooLarge
+    (the session keeps its previous offset in every case).
+    """
+    path = part_path(session, upload_folder)
+    try:
+        with FileLock(f"{path}.lock", timeout=0):
+            db.session.refresh(session)
+            if offset != session.received:
+                raise OffsetMismatch(session.received)
+            hasher = _hasher_at(session, path, offset)
+            limit = min(max_bytes, session.declared_size) if session.declared_size else max_bytes
+            end = append_stream(stream, path, offset, max_bytes=limit, hasher=hasher)
+            session.received = end
+            db.session.commit()
+            with _hashers_lock:
+                _hashers[session.id] = (end, hasher)
+            return end
+    except Timeout:
+        raise ChunkInProgress(f"Another chunk of upload {session.id} is being written")
+def digest(session: UploadSession, upload_folder: str) -> str:
+    """sha256 hex digest of the acknowledged bytes."""
+    return _hasher_at(session, part_path(session, upload_folder), session.received).hexdigest()
+def complete(session: UploadSession, photo_id: int, upload_folder: str) -> None:
+    """Mark the session finished once its part file was moved into place."""
+    session.status   = "completed"
+    session.photo_id = photo_id
+    db.session.commit()
+    _forget(session, upload_folder)
+def _forget(session: UploadSession, upload_folder: str) -> None:
+    with _hashers_lock:
+        _hashers.pop(session.id, None)
+    for path in (part_path(session, upload_folder), f"{part_path(session, upload_folder)}.lock"):
+        if os.path.exists(path):
+            os.remove(path)
+def fail(session: UploadSession, upload_folder: str) -> None:
+    """Close a session whose bytes are gone (e.g. finalize failed after moving them); the client must start over."""
+    _forget(session, upload_folder)
+    session.status = "failed"
+    db.session.commit()
+def discard(session: UploadSession, upload_folder: str) -> None:
+    _forget(session, upload_folder)
+    db.session.delete(session)
+    db.session.commit()
+def expire_stale(older_than: datetime, upload_folder: str) -> int:
+    """Expire open sessions idle since older_than and delete their part files."""
+    stale = UploadSession.query.filter(UploadSession.status == "open", UploadSession.updated_at < older_than).all()
+    for session in stale:
+        _forget(session, upload_folder)
+        session.status = "expired"
+    db.session.commit()
+    return len(stale)
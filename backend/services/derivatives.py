@@ -0,0 +1,77 @@
+"""
+Media Derivatives
+=================
+Downscaled copies of uploads for gallery tiles and viewers, one per size in
+DERIVATIVE_SIZES (long side in px, never upscaled), encoded as
+DERIVATIVE_FORMAT (WebP, or JPEG where Pillow lacks WebP support).
+Derivatives are content-addressed: the file name and the strong ETag both
+come from the photo's content_hash, the size and the format, so a media URL
+always maps to the same bytes and can be cached as immutable; identical
+uploads share their derivatives. They are rendered by a Celery task after
+upload and, when missing, on the first request under a per-file lock so
+concurrent requests render each file once.
+"""
+import os
+import logging
+from filelock import FileLock
+from config import Config
+logger = logging.getLogger(__name__)
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+EXTENSIONS    = {"webp": "webp", "jpeg": "jpg"}
+def derivative_format() -> str:
+    fmt = Config.DERIVATIVE_FORMAT.lower()
+    if fmt == "webp":
+        from PIL import features
+        return "webp" if features.check("webp") else "jpeg"
+    return "jpeg"
+def media_key(photo) -> str:
+    """Identifier of the photo's bytes: its sha256, or its id for photos stored before hashing."""
+    return photo.content_hash or f"photo{photo.id}"
+def media_etag(photo, size: int = None, fmt: str = None) -> str:
+    key = media_key(photo)
+    return f"{key}-{size}.{EXTENSIONS[fmt]}" if size else key
+def derivative_path(photo, size: int, fmt: str) -> str:
+    key = media_key(photo)
+    return os.path.join(Config.DERIVATIVES_FOLDER, key[:2], f"{key}_{size}.{EXTENSIONS[fmt]}")
+def render(source_path: str, target_path: str, size: int, fmt: str, quality: int) -> None:
+    """Write a copy of source_path fitting in size x size to target_path (atomically)."""
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as image:
+        image.draft("RGB", (size, size))   # JPEG: let the decoder downscale by 1/2..1/8
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.LANCZOS)
+        alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if alpha and fmt == "webp" else "RGB")
+        tmp = f"{target_path}.{os.getpid()}.tmp"
+        try:
+            image.save(tmp, format=fmt.upper(), quality=quality, **({"method": 4} if fmt == "webp" else {"optimize": True}))
+            os.replace(tmp, target_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+def ensure_derivative(photo, size: int, source_path: str, fmt: str = None) -> str:
+    """Path of the photo's derivative, rendering it first when it does not exist yet."""
+    fmt = fmt or derivative_format()
+    path = derivative_path(photo, size, fmt)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with FileLock(f"{path}.lock", timeout=Config.DERIVATIVE_LOCK_TIMEOUT):
+        if not os.path.exists(path):
+            render(source_path, path, size, fmt, Config.DERIVATIVE_QUALITY)
+            logger.info(f"Rendered {size}px {fmt} derivative of photo {photo.id}")
+    return path
+def ensure_derivatives(photo, source_path: str) -> list:
+    fmt = derivative_format()
+    return [ensure_derivative(photo, size, source_path, fmt) for size in Config.DERIVATIVE_SIZES]
+def discard_derivatives(photo) -> int:
+    """Delete every derivative of the photo's bytes; call once no other photo shares its content_hash."""
+    removed = 0
+    for size in Config.DERIVATIVE_SIZES:
+        for fmt in EXTENSIONS:
+            for path in (derivative_path(photo, size, fmt), f"{derivative_path(photo, size, fmt)}.lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+    return removed
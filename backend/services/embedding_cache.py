@@ -0,0 +1,133 @@
+"""
+Embedding Cache
+===============
+Process-wide LRU cache of decoded per-user FaceMatcher galleries.
+Entries expire after a TTL and the cache is bounded by total matrix bytes.
+Cross-process invalidation uses a per-user generation counter in Redis:
+every writer bumps the counter, and readers reload when the counter no
+longer matches the generation their entry was built from. If Redis is
+down, entries are trusted until their TTL runs out.
+prototype_cache holds the per-user person-prototype matchers; it reads the
+same generation counters, so any gallery change also invalidates it.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from config import Config
+from services.redis_service import RedisService
+logger = logging.getLogger(__name__)
+class _Entry:
+    __slots__ = ("matcher", "generation", "loaded_at")
+    def __init__(self, matcher, generation, loaded_at):
+        self.matcher    = matcher
+        self.generation = generation
+        self.loaded_at  = loaded_at
+class EmbeddingCache:
+    KEY_PREFIX = "drishyamitra:emb_gen:"
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes    = 0
+        self._lock     = threading.RLock()
+        self.hits      = 0
+        self.misses    = 0
+    def _key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+    def _remote_generation(self, user_id: int):
+        client = RedisService.get_client()
+        if client is None:
+            return None
+        try:
+            value = client.get(self._key(user_id))
+            return int(value) if value is not None else 0
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+            return None
+    def _bump_generation(self, user_id: int):
+        client = RedisService.get_client()
+        if client is None:
+            return None
+        try:
+            return int(client.incr(self._key(user_id)))
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+            return None
+    def _drop(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.matcher.nbytes
+    def _store(self, user_id: int, matcher, generation) -> None:
+        with self._lock:
+            self._drop(user_id)
+            if matcher.nbytes > self.max_bytes:
+                logger.warning(
+                    f"Gallery for user {user_id} ({matcher.nbytes} bytes) exceeds cache cap; not cached"
+                )
+                return
+            self._entries[user_id] = _Entry(matcher, generation, time.time())
+            self._bytes += matcher.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                evicted, entry = self._entries.popitem(last=False)
+                self._bytes -= entry.matcher.nbytes
+                logger.debug(f"Evicted embedding cache entry for user {evicted}")
+    def get(self, user_id: int, loader):
+        """Return the cached matcher for user_id, calling loader() on a miss."""
+        generation = self._remote_generation(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                fresh   = time.time() - entry.loaded_at < self.ttl
+                current = generation is None or entry.generation == generation
+                if fresh and current:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry.matcher
+                self._drop(user_id)
+            self.misses += 1
+        matcher = loader()
+        self._store(user_id, matcher, generation)
+        return matcher
+    def invalidate(self, user_id: int) -> None:
+        """Drop the local entry and signal every other process to reload."""
+        with self._lock:
+            self._drop(user_id)
+        self._bump_generation(user_id)
+        logger.debug(f"Cache invalidated for user {user_id}")
+    def forget(self, user_id: int) -> None:
+        """Drop only the local entry, e.g. when a derived cache's source changed."""
+        with self._lock:
+            self._drop(user_id)
+    def extend(self, user_id: int, face_ids, person_ids, embeddings) -> None:
+        """
+        Append newly stored faces to the local entry instead of reloading it.
+        Other processes are invalidated; the local entry survives only if no
+        other writer bumped the generation since it was loaded.
+        """
+        generation = self._bump_generation(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if generation is not None and entry.generation is not None and generation != entry.generation + 1:
+                self._drop(user_id)
+                return
+            matcher = entry.matcher.extended(face_ids, person_ids, embeddings)
+        self._store(user_id, matcher, generation)
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes":   self._bytes,
+                "hits":    self.hits,
+                "misses":  self.misses,
+            }
+embedding_cache = EmbeddingCache(
+    max_bytes=Config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+    ttl=Config.EMBEDDING_CACHE_TTL,
+)
+prototype_cache = EmbeddingCache(
+    max_bytes=Config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024 // 4,
+    ttl=Config.EMBEDDING_CACHE_TTL,
+)
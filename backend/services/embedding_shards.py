@@ -0,0 +1,202 @@
+"""
+Embedding Shards
+================
+Optional per-user, append-only embedding storage outside the relational
+DB, enabled with FACE_EMBEDDING_SHARDS. Layout under
+EMBEDDINGS_FOLDER/user_<id>/shards/:
+    manifest.json   – ordered list of live shard names
+    <name>.npy      – preallocated (capacity, dim) float32 unit vectors
+    <name>.ids.npy  – sidecar rows (face_id, person_id, norm); its length is
+                      the number of valid rows in <name>.npy
+    tombstones.npy  – face ids deleted since the last compaction
+Shards are opened with mmap, so web and Celery processes share the pages
+through the OS page cache, and a single-shard gallery is scored in place.
+Appends write vectors first and publish them by atomically replacing the
+sidecar, so readers never see half-written rows. Compaction merges shards
+into one and drops tombstoned rows.
+"""
+import os
+import json
+import uuid
+import logging
+import numpy as np
+from filelock import FileLock
+logger = logging.getLogger(__name__)
+SIDECAR_DTYPE = np.dtype([("face_id", "<i8"), ("person_id", "<i8"), ("norm", "<f4")])
+class ShardGallery:
+    """Read-only view of a user's shards: ids, norms and the (possibly mmapped) unit-vector matrix."""
+    __slots__ = ("face_ids", "person_ids", "norms", "matrix", "tombstones", "shard_count")
+    def __init__(self, face_ids, person_ids, norms, matrix, tombstones, shard_count):
+        self.face_ids    = face_ids
+        self.person_ids  = person_ids
+        self.norms       = norms
+        self.matrix      = matrix
+        self.tombstones  = tombstones
+        self.shard_count = shard_count
+    def __len__(self) -> int:
+        return len(self.face_ids)
+class ShardStore:
+    MIN_CAPACITY   = 4096
+    STALE_FRACTION = 0.1
+    def __init__(self, folder: str, dim: int):
+        self.folder = folder
+        self.dim    = dim
+    def _dir(self, user_id: int) -> str:
+        return os.path.join(self.folder, f"user_{user_id}", "shards")
+    def _lock(self, user_id: int) -> FileLock:
+        path = self._dir(user_id)
+        os.makedirs(path, exist_ok=True)
+        return FileLock(os.path.join(path, ".lock"))
+    @staticmethod
+    def _replace(path: str, write) -> None:
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    def _manifest(self, path: str) -> list:
+        try:
+            with open(os.path.join(path, "manifest.json")) as fh:
+                return json.load(fh)["shards"]
+        except FileNotFoundError:
+            return []
+    def _write_manifest(self, path: str, shards: list) -> None:
+        self._replace(
+            os.path.join(path, "manifest.json"),
+            lambda fh: fh.write(json.dumps({"shards": shards}).encode()),
+        )
+    def _tombstones(self, path: str) -> np.ndarray:
+        try:
+            return np.load(os.path.join(path, "tombstones.npy"))
+        except FileNotFoundError:
+            return np.zeros(0, dtype=np.int64)
+    def _write_sidecar(self, path: str, name: str, rows: np.ndarray) -> None:
+        self._replace(os.path.join(path, f"{name}.ids.npy"), lambda fh: np.save(fh, rows))
+    def _new_shard(self, path: str, capacity: int) -> tuple:
+        name = f"shard_{uuid.uuid4().hex[:12]}"
+        vectors = np.lib.format.open_memmap(
+            os.path.join(path, f"{name}.npy"), mode="w+", dtype=np.float32, shape=(capacity, self.dim),
+        )
+        return name, vectors
+    def read(self, user_id: int) -> ShardGallery:
+        """
+        Map the user's shards. With one shard the matrix is a view onto the
+        mmapped file; several shards are concatenated until compaction.
+        """
+        path = self._dir(user_id)
+        for attempt in range(3):
+            try:
+                shards = self._manifest(path)
+                metas, blocks = [], []
+                for name in shards:
+                    meta = np.load(os.path.join(path, f"{name}.ids.npy"))
+                    vectors = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                    metas.append(meta)
+                    blocks.append(vectors[:len(meta)])
+                tombstones = self._tombstones(path)
+                break
+            except FileNotFoundError:
+                # A concurrent compaction replaced the shard set; re-read the manifest.
+                if attempt == 2:
+                    raise
+        if not metas:
+            empty = np.zeros(0, dtype=np.int64)
+            return ShardGallery(empty, empty, np.zeros(0, np.float32),
+                                np.zeros((0, self.dim), np.float32), tombstones, 0)
+        meta   = metas[0] if len(metas) == 1 else np.concatenate(metas)
+        matrix = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        return ShardGallery(
+            meta["face_id"], meta["person_id"], meta["norm"], matrix, tombstones, len(shards),
+        )
+    def append(self, user_id: int, face_ids, person_ids, vectors: np.ndarray, norms: np.ndarray) -> None:
+        """Append unit vectors (with their original norms) to the user's tail shard."""
+        rows = np.empty(len(face_ids), dtype=SIDECAR_DTYPE)
+        if not len(rows):
+            return
+        rows["face_id"]   = face_ids
+        rows["person_id"] = person_ids
+        rows["norm"]      = norms
+        path = self._dir(user_id)
+        with self._lock(user_id):
+            shards = self._manifest(path)
+            tail, meta, vectors_out = None, None, None
+            if shards:
+                tail = shards[-1]
+                meta = np.load(os.path.join(path, f"{tail}.ids.npy"))
+                vectors_out = np.load(os.path.join(path, f"{tail}.npy"), mmap_mode="r+")
+                if len(meta) + len(rows) > len(vectors_out):
+                    tail = None
+            if tail is None:
+                total = sum(len(np.load(os.path.join(path, f"{n}.ids.npy"))) for n in shards)
+                capacity = max(self.MIN_CAPACITY, 2 * len(rows), total)
+                tail, vectors_out = self._new_shard(path, capacity)
+                meta = np.zeros(0, dtype=SIDECAR_DTYPE)
+                shards = shards + [tail]
+            start = len(meta)
+            vectors_out[start:start + len(rows)] = vectors
+            vectors_out.flush()
+            del vectors_out
+            self._write_sidecar(path, tail, np.concatenate([meta, rows]))
+            self._write_manifest(path, shards)
+    def tombstone(self, user_id: int, face_ids) -> None:
+        """Mark face ids as deleted; their rows are skipped until compaction removes them."""
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        if not len(face_ids):
+            return
+        path = self._dir(user_id)
+        with self._lock(user_id):
+            merged = np.union1d(self._tombstones(path), face_ids)
+            self._replace(os.path.join(path, "tombstones.npy"), lambda fh: np.save(fh, merged))
+    def drop(self, user_id: int) -> None:
+        """Delete every shard of the user, e.g. after their embeddings were replaced; the next load backfills from the DB."""
+        path = self._dir(user_id)
+        with self._lock(user_id):
+            for name in os.listdir(path):
+                if name != ".lock":
+                    os.remove(os.path.join(path, name))
+        logger.info(f"Dropped embedding shards for user {user_id}")
+    def needs_compaction(self, gallery: ShardGallery) -> bool:
+        return gallery.shard_count > 1 or len(gallery.tombstones) > self.STALE_FRACTION * max(len(gallery), 1)
+    def compact(self, user_id: int, live: dict = None) -> int:
+        """
+        Rewrite the user's gallery as one shard without tombstoned or
+        duplicate rows. When live (face_id → person_id, from the DB) is
+        given, rows for faces no longer in it are dropped and person ids
+        are refreshed. Returns the number of rows kept.
+        """
+        path = self._dir(user_id)
+        with self._lock(user_id):
+            gallery = self.read(user_id)
+            old_shards = self._manifest(path)
+            # Later rows win for duplicated face ids (re-appended faces).
+            _, last = np.unique(gallery.face_ids[::-1], return_index=True)
+            keep = np.zeros(len(gallery), dtype=bool)
+            keep[len(gallery) - 1 - last] = True
+            keep &= ~np.isin(gallery.face_ids, gallery.tombstones)
+            person_ids = gallery.person_ids.copy()
+            if live is not None:
+                keep &= np.isin(gallery.face_ids, np.fromiter(live.keys(), dtype=np.int64, count=len(live)))
+                for row in np.flatnonzero(keep):
+                    person_ids[row] = live[int(gallery.face_ids[row])]
+            kept = int(keep.sum())
+            name, vectors_out = self._new_shard(path, max(self.MIN_CAPACITY, kept + kept // 2))
+            vectors_out[:kept] = gallery.matrix[keep]
+            vectors_out.flush()
+            del vectors_out
+            rows = np.empty(kept, dtype=SIDECAR_DTYPE)
+            rows["face_id"]   = gallery.face_ids[keep]
+            rows["person_id"] = person_ids[keep]
+            rows["norm"]      = gallery.norms[keep]
+            self._write_sidecar(path, name, rows)
+            self._write_manifest(path, [name])
+            tombstone_path = os.path.join(path, "tombstones.npy")
+            if os.path.exists(tombstone_path):
+                os.remove(tombstone_path)
+            del gallery
+            for old in old_shards:
+                for suffix in (".npy", ".ids.npy"):
+                    try:
+                        os.remove(os.path.join(path, f"{old}{suffix}"))
+                    except FileNotFoundError:
+                        pass
+        logger.info(f"Compacted embedding shards for user {user_id}: {len(old_shards)} shard(s) → 1, {kept} row(s)")
+        return kept
@@ -0,0 +1,92 @@
+"""
+Face Assignment
+===============
+Joint assignment of all faces in one photo to known persons.
+Each face is scored against the gallery once (FaceRecognitionService.
+match_faces); the per-face candidate lists are then turned into a
+faces × persons score matrix and solved as a maximum-weight bipartite
+matching, so no person is assigned to two faces of the same photo. A face
+whose best available person is outside the threshold stays unmatched.
+"""
+import numpy as np
+INFEASIBLE = 1e6
+def linear_sum_assignment(cost) -> tuple:
+    """
+    Minimum-cost assignment for a rectangular cost matrix (Hungarian
+    algorithm with potentials, O(n² m)). Returns (row_indices, col_indices)
+    with one entry per row of the smaller dimension, sorted by row.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    u   = np.zeros(n + 1)
+    v   = np.zeros(m + 1)
+    p   = np.zeros(m + 1, dtype=np.int64)   # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.flatnonzero(p[1:])
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+def assign_faces(results: list, threshold: float) -> list:
+    """
+    Resolve per-face match results (FaceMatcher.match format) jointly.
+    Every face may take any of its candidate persons whose cosine distance
+    is below threshold, or stay unmatched; the assignment maximises the
+    total similarity margin over the threshold with each person used at
+    most once. Returns one (person_id | None, similarity | None) per face.
+    """
+    persons = sorted({c["person_id"] for res in results for c in res["candidates"]})
+    if not results:
+        return []
+    if not persons:
+        return [(None, None)] * len(results)
+    column = {pid: j for j, pid in enumerate(persons)}
+    faces = len(results)
+    sims = np.full((faces, len(persons)), -np.inf)
+    for i, res in enumerate(results):
+        for c in res["candidates"]:
+            sims[i, column[c["person_id"]]] = c["similarity"]
+    margin = sims - (1.0 - threshold)
+    feasible = margin > 0
+    # One private "stay unmatched" column per face, at zero cost.
+    cost = np.full((faces, len(persons) + faces), INFEASIBLE)
+    cost[:, :len(persons)] = np.where(feasible, -margin, INFEASIBLE)
+    cost[np.arange(faces), len(persons) + np.arange(faces)] = 0.0
+    rows, cols = linear_sum_assignment(cost)
+    assigned = [(None, None)] * faces
+    for i, j in zip(rows, cols):
+        if j < len(persons) and feasible[i, j]:
+            assigned[i] = (persons[j], float(sims[i, j]))
+    return assigned
@@ -0,0 +1,215 @@
+"""
+Face Clustering
+===============
+Groups a user's unrecognised faces into stable auto-created persons.
+Every face that misses the threshold at upload time still gets its own
+"Unknown Person"; cluster_unknown_faces then runs after bulk uploads and
+merges those singletons:
+    1. new faces are first attached to existing auto-created clusters whose
+       centroid (the person prototype) is within the threshold,
+    2. the remainder is clustered with centroid-linkage agglomeration,
+    3. resulting clusters that land near an existing cluster join it.
+Only faces above a per-user watermark are clustered, so each run costs
+O(new faces) against the existing cluster summaries.
+"""
+import os
+import shutil
+import logging
+import numpy as np
+from sqlalchemy import type_coerce
+from models.database import db, decode_embeddings
+from models.face import Face
+from models.person import Person
+from models.person_prototype import PersonPrototype
+from services.face_matcher import FaceMatcher
+from services.redis_service import RedisService
+logger = logging.getLogger(__name__)
+def agglomerate(unit: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Centroid-linkage agglomerative clustering of unit vectors. Pairs of
+    clusters are merged, closest first, while the cosine distance between
+    their centroids is below threshold. Returns a cluster label per row
+    (0..k-1, in order of first appearance).
+    """
+    n = len(unit)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    min_sim = 1.0 - threshold
+    sums    = unit.astype(np.float32).copy()
+    cents   = sums.copy()
+    owner   = np.arange(n)
+    active  = np.ones(n, dtype=bool)
+    sim     = cents @ cents.T
+    np.fill_diagonal(sim, -np.inf)
+    nn_idx  = np.argmax(sim, axis=1)
+    nn_sim  = sim[np.arange(n), nn_idx]
+    while True:
+        i = int(np.argmax(nn_sim))
+        if not nn_sim[i] > min_sim:
+            break
+        j = int(nn_idx[i])
+        sums[i] += sums[j]
+        cents[i] = sums[i] / max(float(np.linalg.norm(sums[i])), 1e-12)
+        owner[owner == j] = i
+        active[j] = False
+        sim[j, :] = -np.inf
+        sim[:, j] = -np.inf
+        nn_sim[j] = -np.inf
+        row = cents @ cents[i]
+        row[~active] = -np.inf
+        row[i] = -np.inf
+        sim[i, :] = row
+        sim[:, i] = row
+        # Rows whose nearest neighbour was merged away, or that are now closer to i, need a new nearest.
+        dirty = active & ((nn_idx == i) | (nn_idx == j))
+        dirty[i] = True
+        for r in np.flatnonzero(dirty):
+            nn_idx[r] = int(np.argmax(sim[r]))
+            nn_sim[r] = sim[r, nn_idx[r]]
+        closer = active & (row > nn_sim)
+        nn_idx[closer] = i
+        nn_sim[closer] = row[closer]
+    _, labels = np.unique(owner, return_inverse=True)
+    first = np.unique(labels, return_index=True)[1]
+    remap = np.empty_like(first)
+    remap[np.argsort(first)] = np.arange(len(first))
+    return remap[labels]
+class FaceClusterer:
+    WATERMARK_KEY = "drishyamitra:cluster_watermark:"
+    MAX_BATCH     = 4000
+    def __init__(self, service, threshold: float):
+        self.service   = service
+        self.threshold = threshold
+    def _watermark(self, user_id: int) -> int:
+        client = RedisService.get_client()
+        if client is None:
+            return 0
+        try:
+            return int(client.get(f"{self.WATERMARK_KEY}{user_id}") or 0)
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+            return 0
+    def _set_watermark(self, user_id: int, face_id: int) -> None:
+        client = RedisService.get_client()
+        if client is None:
+            return
+        try:
+            client.set(f"{self.WATERMARK_KEY}{user_id}", int(face_id))
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    def _new_faces(self, user_id: int, watermark: int) -> tuple:
+        """Faces above the watermark that belong to auto-created persons with no older faces."""
+        raw_embedding = type_coerce(Face.embedding, db.LargeBinary).label("embedding")
+        rows = (
+            db.session.query(Face.id, Face.person_id, raw_embedding)
+            .join(Person, Face.person_id == Person.id)
+            .filter(
+                Person.user_id == user_id,
+                Person.is_auto_created.is_(True),
+                Face.embedding.isnot(None),
+                Face.id > watermark,
+            )
+            .order_by(Face.id)
+            .all()
+        )
+        if not rows:
+            return [], [], np.zeros((0, 0), dtype=np.float32)
+        person_ids = {r.person_id for r in rows}
+        settled = {
+            pid for (pid,) in db.session.query(Face.person_id)
+            .filter(Face.person_id.in_(person_ids), Face.id <= watermark)
+            .distinct()
+        }
+        rows = [r for r in rows if r.person_id not in settled]
+        return (
+            [r.id for r in rows],
+            [r.person_id for r in rows],
+            decode_embeddings([bytes(r.embedding) for r in rows]),
+        )
+    def _summaries(self, user_id: int, exclude: set) -> tuple:
+        """(person_ids, unit centroids) of the user's existing auto-created clusters."""
+        protos = self.service.prototypes.current(user_id)
+        auto = {
+            pid for (pid,) in db.session.query(Person.id)
+            .filter(Person.user_id == user_id, Person.is_auto_created.is_(True))
+        }
+        pids = [pid for pid in protos if pid in auto and pid not in exclude and protos[pid].centroid is not None]
+        if not pids:
+            return [], np.zeros((0, self.service.EMBEDDING_DIM), dtype=np.float32)
+        unit, _ = FaceMatcher.normalize(np.stack([protos[pid].centroid for pid in pids]))
+        return pids, unit
+    def _plan(self, face_person_ids: list, unit: np.ndarray, summary_ids: list, summaries: np.ndarray) -> list:
+        """Return the target person id for every new face."""
+        min_sim = 1.0 - self.threshold
+        targets = np.full(len(unit), -1, dtype=np.int64)
+        if len(summary_ids):
+            sims = unit @ summaries.T
+            best = np.argmax(sims, axis=1)
+            hit  = sims[np.arange(len(unit)), best] > min_sim
+            targets[hit] = np.asarray(summary_ids, dtype=np.int64)[best[hit]]
+        rest = np.flatnonzero(targets < 0)
+        if len(rest):
+            labels = agglomerate(unit[rest], self.threshold)
+            for label in range(int(labels.max()) + 1):
+                members = rest[labels == label]
+                centre, _ = FaceMatcher.normalize(unit[members].sum(axis=0))
+                target = -1
+                if len(summary_ids):
+                    sims = summaries @ centre[0]
+                    if sims.max() > min_sim:
+                        target = summary_ids[int(np.argmax(sims))]
+                if target < 0:
+                    target = min(face_person_ids[m] for m in members)
+                targets[members] = target
+        return targets.tolist()
+    def cluster_user(self, user_id: int) -> dict:
+        """Cluster new unknown faces of user_id and merge the resulting persons."""
+        watermark = self._watermark(user_id)
+        face_ids, face_person_ids, vectors = self._new_faces(user_id, watermark)
+        if not face_ids:
+            return {"faces": 0, "merged_persons": 0}
+        unit, _ = FaceMatcher.normalize(vectors)
+        summary_ids, summaries = self._summaries(user_id, exclude=set(face_person_ids))
+        targets = []
+        for start in range(0, len(face_ids), self.MAX_BATCH):
+            chunk = slice(start, start + self.MAX_BATCH)
+            chunk_targets = self._plan(face_person_ids[chunk], unit[chunk], summary_ids, summaries)
+            targets += chunk_targets
+            # Clusters formed in this chunk become summaries for the next one.
+            for pid in sorted(set(chunk_targets) - set(summary_ids)):
+                rows = [i for i, t in enumerate(chunk_targets) if t == pid]
+                centre, _ = FaceMatcher.normalize(unit[chunk][rows].sum(axis=0))
+                summary_ids.append(pid)
+                summaries = np.concatenate([summaries, centre])
+        moves = {}
+        for face_id, old, new in zip(face_ids, face_person_ids, targets):
+            if old != new:
+                moves.setdefault(new, []).append(face_id)
+        for target, ids in moves.items():
+            Face.query.filter(Face.id.in_(ids)).update({Face.person_id: target}, synchronize_session=False)
+        emptied = set(face_person_ids) - set(targets)
+        emptied_names = [name for (name,) in db.session.query(Person.name).filter(Person.id.in_(emptied))]
+        if emptied:
+            PersonPrototype.query.filter(PersonPrototype.person_id.in_(emptied)).delete(synchronize_session=False)
+            Person.query.filter(Person.id.in_(emptied)).delete(synchronize_session=False)
+        db.session.commit()
+        if moves:
+            self.service.refresh_prototypes(list(moves.keys()))
+            self.service.invalidate_cache(user_id)
+        self._set_watermark(user_id, max(face_ids))
+        logger.info(
+            f"Clustered {len(face_ids)} unknown face(s) for user {user_id}: "
+            f"{len(set(targets))} cluster(s), {len(emptied)} singleton person(s) merged away"
+        )
+        return {"faces": len(face_ids), "clusters": len(set(targets)), "merged_persons": len(emptied),
+                "removed_names": emptied_names}
+def remove_person_folders(user_dir: str, names: list, user_id: int) -> None:
+    """Delete organised folders of persons that were merged away, unless a surviving person maps to the same folder."""
+    def folder(name):
+        return "".join(c for c in name if c.isalnum() or c in " -_").strip()
+    in_use = {folder(name) for (name,) in db.session.query(Person.name).filter(Person.user_id == user_id)}
+    for name in names:
+        safe_name = folder(name)
+        path = os.path.join(user_dir, safe_name)
+        if safe_name and safe_name not in in_use and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
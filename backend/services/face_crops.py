@@ -0,0 +1,115 @@
+"""
+Face Crops
+==========
+The aligned BGR crop each embedding was computed from, kept as a small JPEG
+under FACE_CROPS_FOLDER/user_<id>/<face id>.jpg and linked through
+Face.crop_path (relative to the folder). Crops larger than
+FACE_CROP_MAX_SIDE px are downscaled; that is still above the embedding
+models' input size, so re-embedding jobs can run the embedding model on
+the stored crop without decoding and re-detecting the photo, and person
+avatars are served without touching the original.
+"""
+import os
+import logging
+import numpy as np
+from config import Config
+logger = logging.getLogger(__name__)
+def crop_file(face):
+    """Absolute path of the face's stored crop, or None."""
+    return os.path.join(Config.FACE_CROPS_FOLDER, face.crop_path) if face.crop_path else None
+def save_crop(face, user_id: int, crop: np.ndarray):
+    """
+    Write crop for a flushed Face and return its relative path (None when
+    the crop is empty or cannot be written; the face is still stored).
+    """
+    import cv2
+    if crop is None or not crop.size:
+        return None
+    relpath = os.path.join(f"user_{user_id}", f"{face.id}.jpg")
+    path = os.path.join(Config.FACE_CROPS_FOLDER, relpath)
+    try:
+        side = max(crop.shape[:2])
+        if side > Config.FACE_CROP_MAX_SIDE:
+            factor = Config.FACE_CROP_MAX_SIDE / side
+            crop = cv2.resize(crop, (max(1, round(crop.shape[1] * factor)), max(1, round(crop.shape[0] * factor))),
+                              interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", np.ascontiguousarray(crop), [cv2.IMWRITE_JPEG_QUALITY, Config.FACE_CROP_QUALITY])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(encoded.tobytes())
+        os.replace(tmp, path)
+        return relpath
+    except Exception as exc:
+        logger.warning(f"Could not store the crop of face {face.id}: {exc}")
+        return None
+def save_crops(faces: list, crops: list, user_id: int) -> int:
+    """Set crop_path on flushed Face rows from their parallel crops; returns how many were stored."""
+    stored = 0
+    for face, crop in zip(faces, crops):
+        face.crop_path = save_crop(face, user_id, crop)
+        stored += face.crop_path is not None
+    return stored
+def store_crops(faces: list, crops: list, user_id: int) -> int:
+    """
+    Write the crops of committed Face rows and commit their crop_path.
+    Crops are only written once their faces exist, so a failed face
+    insert leaves no files behind; see commit_crop_paths.
+    """
+    stored = save_crops(faces, crops, user_id)
+    return stored if stored and commit_crop_paths(faces) else 0
+def commit_crop_paths(faces: list) -> bool:
+    """Commit crop_path of faces whose crops were just written; on failure roll back and delete the files."""
+    from models.database import db
+    crop_paths = [face.crop_path for face in faces]
+    try:
+        db.session.commit()
+        return True
+    except Exception as exc:
+        db.session.rollback()
+        discard_crops(crop_paths)
+        logger.warning(f"Could not link {sum(p is not None for p in crop_paths)} face crop(s): {exc}")
+        return False
+def load_crop(face):
+    """The stored crop as a BGR array, or None when it is missing or unreadable."""
+    import cv2
+    path = crop_file(face)
+    if not path or not os.path.exists(path):
+        return None
+    crop = cv2.imread(path, cv2.IMREAD_COLOR)
+    return crop if crop is not None and crop.size else None
+def copy_crop(source, target, user_id: int):
+    """Give target (a flushed copy of source) its own crop file: a hard link when possible. Returns the relative path."""
+    import shutil
+    source_path = crop_file(source)
+    if not source_path or not os.path.exists(source_path):
+        return None
+    relpath = os.path.join(f"user_{user_id}", f"{target.id}.jpg")
+    path = os.path.join(Config.FACE_CROPS_FOLDER, relpath)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+        except OSError:
+            shutil.copyfile(source_path, path)
+        return relpath
+    except OSError as exc:
+        logger.warning(f"Could not copy the crop of face {source.id} to face {target.id}: {exc}")
+        return None
+def discard_crops(crop_paths) -> int:
+    """Delete stored crops by relative path (after their faces are gone)."""
+    removed = 0
+    for relpath in crop_paths:
+        if not relpath:
+            continue
+        path = os.path.join(Config.FACE_CROPS_FOLDER, relpath)
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning(f"Could not delete face crop {path}: {exc}")
+    return removed
@@ -0,0 +1,202 @@
+"""
+Face Matcher
+============
+Vectorised matching of query embeddings against a user's face gallery.
+The gallery is held as one contiguous, L2-normalised float32 matrix so all
+query faces of a photo are scored with a single matrix multiply.
+Decisions are identical to the original per-pair loop: a stored face is a
+match when its cosine distance is strictly below the threshold, and the
+closest such face wins.
+"""
+import logging
+import numpy as np
+logger = logging.getLogger(__name__)
+def _no_match(candidates: list) -> dict:
+    return {
+        "person_id": None, "face_id": None, "cosine_distance": float("inf"),
+        "euclidean": float("inf"), "similarity": -1.0, "candidates": candidates,
+    }
+class FaceMatcher:
+    """
+    Immutable gallery of (face_id, person_id, embedding) rows.
+    Rows are normalised once at build time; the original norms are kept so
+    the Euclidean distance reported by match_face can be recovered from the
+    cosine similarity without holding a second copy of the vectors.
+    """
+    def __init__(self, face_ids, person_ids, embeddings, norms=None, normalized: bool = False):
+        self.face_ids   = np.asarray(face_ids, dtype=np.int64).reshape(-1)
+        self.person_ids = np.asarray(person_ids, dtype=np.int64).reshape(-1)
+        count  = len(self.face_ids)
+        if normalized:
+            matrix = np.asarray(embeddings, dtype=np.float32, order="C")
+        else:
+            matrix = np.array(embeddings, dtype=np.float32, order="C")
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(count, -1) if count else np.zeros((0, 0), dtype=np.float32)
+        if normalized:
+            self.norms = np.asarray(norms, dtype=np.float32) if norms is not None else np.ones(count, dtype=np.float32)
+        else:
+            self.norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+            matrix /= np.where(self.norms > 0, self.norms, 1.0)[:, None]
+        self.matrix = matrix
+        self._order = np.argsort(self.person_ids, kind="stable")
+        sorted_ids  = self.person_ids[self._order]
+        if count:
+            self._starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        else:
+            self._starts = np.zeros(0, dtype=np.int64)
+        self.unique_person_ids = sorted_ids[self._starts]
+        self._id_order = np.argsort(self.face_ids, kind="stable")
+    def __len__(self) -> int:
+        return len(self.face_ids)
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.norms.nbytes + self.face_ids.nbytes + self.person_ids.nbytes + self._order.nbytes
+    def extended(self, face_ids, person_ids, embeddings) -> "FaceMatcher":
+        """Return a new matcher with extra rows appended, without re-reading the gallery."""
+        new_faces = FaceMatcher(face_ids, person_ids, embeddings)
+        if not len(new_faces):
+            return self
+        if not len(self):
+            return new_faces
+        return FaceMatcher(
+            np.concatenate([self.face_ids, new_faces.face_ids]),
+            np.concatenate([self.person_ids, new_faces.person_ids]),
+            np.concatenate([self.matrix, new_faces.matrix]),
+            norms=np.concatenate([self.norms, new_faces.norms]),
+            normalized=True,
+        )
+    def vectors(self, rows=None) -> np.ndarray:
+        """Unit-length float32 rows (all rows when rows is None)."""
+        return self.matrix if rows is None else self.matrix[rows]
+    def rows_for(self, face_ids) -> np.ndarray:
+        """Map face ids to row indices, silently dropping ids not in the gallery."""
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        if not len(self) or not len(face_ids):
+            return np.zeros(0, dtype=np.int64)
+        sorted_ids = self.face_ids[self._id_order]
+        pos = np.clip(np.searchsorted(sorted_ids, face_ids), 0, len(sorted_ids) - 1)
+        hit = sorted_ids[pos] == face_ids
+        return self._id_order[pos[hit]]
+    @staticmethod
+    def normalize(queries) -> tuple:
+        """Return (unit-length float32 rows, original norms) for a batch of embeddings."""
+        q = np.array(queries, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(q, axis=1)
+        q /= np.where(norms > 0, norms, 1.0)[:, None]
+        return q, norms
+    def similarities(self, queries) -> np.ndarray:
+        """Cosine similarity of every query against every stored face, shape (Q, N)."""
+        q, _ = self.normalize(queries)
+        return q @ self.matrix.T
+    def faces_within(self, queries, threshold: float) -> list:
+        """
+        Every stored face within threshold (cosine distance) of each query.
+        Returns one (rows, similarities) pair of arrays per query.
+        """
+        if not len(self):
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(len(queries))]
+        sims = self.similarities(queries)
+        out = []
+        for row in sims:
+            rows = np.flatnonzero(1.0 - row < threshold)
+            out.append((rows, row[rows]))
+        return out
+    def person_similarities(self, sims: np.ndarray) -> np.ndarray:
+        """Reduce face-level similarities (Q, N) to the best face per person, shape (Q, P)."""
+        if not len(self):
+            return np.zeros((sims.shape[0], 0), dtype=np.float32)
+        return np.maximum.reduceat(sims[:, self._order], self._starts, axis=1)
+    def _best_face_of_person(self, sims_row: np.ndarray, person_idx: int) -> int:
+        start = self._starts[person_idx]
+        end   = self._starts[person_idx + 1] if person_idx + 1 < len(self._starts) else len(self._order)
+        rows  = self._order[start:end]
+        return int(rows[np.argmax(sims_row[rows])])
+    def _euclidean(self, q_norm: float, row: int, sim: float) -> float:
+        """Euclidean distance between the raw query and stored row, from their norms and cosine similarity."""
+        stored_norm = float(self.norms[row])
+        sq = q_norm ** 2 + stored_norm ** 2 - 2.0 * q_norm * stored_norm * sim
+        return float(np.sqrt(max(sq, 0.0)))
+    def euclidean_to_person(self, query, person_id: int) -> float:
+        """Euclidean distance from query to the person's most similar stored face (inf when none is stored)."""
+        rows = np.flatnonzero(self.person_ids == person_id)
+        if not len(rows):
+            return float("inf")
+        q, norms = self.normalize(query)
+        sims = self.matrix[rows] @ q[0]
+        best = int(np.argmax(sims))
+        return self._euclidean(float(norms[0]), int(rows[best]), float(sims[best]))
+    def _result(self, q_norm: float, row: int, sim: float, candidates: list, threshold: float) -> dict:
+        cos_d = 1.0 - sim
+        if not cos_d < threshold:
+            return _no_match(candidates)
+        return {
+            "person_id":       int(self.person_ids[row]),
+            "face_id":         int(self.face_ids[row]),
+            "cosine_distance": cos_d,
+            "euclidean":       self._euclidean(q_norm, row, sim),
+            "similarity":      sim,
+            "candidates":      candidates,
+        }
+    def match(self, queries, threshold: float, top_k: int = 5) -> list:
+        """
+        Score a batch of query embeddings in one pass.
+        Returns one dict per query:
+            person_id / face_id – best stored face with cosine distance < threshold, else None
+            cosine_distance, euclidean, similarity – scores of that face (inf/inf/-1 when unmatched)
+            candidates – up to top_k persons ranked by their best face similarity
+        """
+        q, q_norms = self.normalize(queries)
+        if not len(self) or q.shape[1] != self.dim:
+            return [_no_match([]) for _ in range(len(q))]
+        results = []
+        sims   = q @ self.matrix.T
+        best   = np.argmax(sims, axis=1)
+        person = self.person_similarities(sims)
+        k      = min(top_k, person.shape[1])
+        for qi in range(len(q)):
+            row = sims[qi]
+            candidates = []
+            if k:
+                top = np.argpartition(-person[qi], k - 1)[:k]
+                top = top[np.argsort(-person[qi][top], kind="stable")]
+                for pi in top:
+                    fi = self._best_face_of_person(row, int(pi))
+                    candidates.append({
+                        "person_id":  int(self.unique_person_ids[pi]),
+                        "face_id":    int(self.face_ids[fi]),
+                        "similarity": float(person[qi][pi]),
+                    })
+            bi = int(best[qi])
+            results.append(self._result(float(q_norms[qi]), bi, float(row[bi]), candidates, threshold))
+        return results
+    def match_candidates(self, queries, candidate_rows: list, threshold: float, top_k: int = 5) -> list:
+        """
+        Exact re-ranking of a per-query shortlist of gallery rows (e.g. from an
+        ANN index). Same result format and threshold semantics as match().
+        """
+        q, q_norms = self.normalize(queries)
+        if not len(self) or q.shape[1] != self.dim:
+            return [_no_match([]) for _ in range(len(q))]
+        results = []
+        for qi, rows in enumerate(candidate_rows):
+            rows = np.asarray(rows, dtype=np.int64)
+            if not len(rows):
+                results.append(_no_match([]))
+                continue
+            sims  = self.matrix[rows] @ q[qi]
+            order = np.argsort(-sims, kind="stable")
+            pids  = self.person_ids[rows[order]]
+            _, first = np.unique(pids, return_index=True)
+            first = np.sort(first)[:top_k]
+            candidates = [{
+                "person_id":  int(pids[i]),
+                "face_id":    int(self.face_ids[rows[order[i]]]),
+                "similarity": float(sims[order[i]]),
+            } for i in first]
+            bi = int(order[0])
+            results.append(self._result(float(q_norms[qi]), int(rows[bi]), float(sims[bi]), candidates, threshold))
+        return results
@@ -0,0 +1,89 @@
+"""
+Face Quality Gate
+=================
+Cheap checks between detection and embedding. A detection is rejected
+before it costs a Facenet512 forward pass when it is
+    too_small    – shorter box side below FACE_QUALITY_MIN_SIZE px (source image),
+    low_confidence – detector score below FACE_QUALITY_MIN_CONFIDENCE,
+    blurry       – variance of the Laplacian of the aligned crop (resized to
+                   a fixed size, so it does not grow with resolution) below
+                   FACE_QUALITY_MIN_SHARPNESS,
+    profile      – nose offset from the eye midpoint, relative to the eye
+                   distance, above FACE_QUALITY_MAX_YAW (turned head), or the
+                   nose placed outside FACE_QUALITY_PITCH_RANGE between the
+                   eye line and the mouth (head tilted up/down).
+Rejected faces are stored without an embedding or person.
+"""
+import numpy as np
+from config import Config
+SHARPNESS_SIDE = 112
+def laplacian_variance(crop: np.ndarray) -> float:
+    """Focus measure of a BGR or gray crop, computed at SHARPNESS_SIDE px."""
+    import cv2
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    gray = cv2.resize(gray, (SHARPNESS_SIDE, SHARPNESS_SIDE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+def pose_from_landmarks(landmarks: dict) -> tuple:
+    """
+    Return (yaw, pitch) ratios from the five RetinaFace landmarks, or
+    (None, None) when they are incomplete. yaw is 0 for a frontal face;
+    pitch is the nose's position between the eye line (0) and the mouth (1).
+    """
+    try:
+        left, right = np.asarray(landmarks["left_eye"], float), np.asarray(landmarks["right_eye"], float)
+        nose = np.asarray(landmarks["nose"], float)
+        mouth = (np.asarray(landmarks["mouth_left"], float) + np.asarray(landmarks["mouth_right"], float)) / 2
+    except (KeyError, TypeError, ValueError):
+        return None, None
+    eye_mid = (left + right) / 2
+    eye_axis = left - right
+    eye_dist = float(np.linalg.norm(eye_axis))
+    if eye_dist <= 0:
+        return None, None
+    axis = eye_axis / eye_dist
+    normal = np.array([-axis[1], axis[0]])
+    yaw = abs(float((nose - eye_mid) @ axis)) / eye_dist
+    span = float((mouth - eye_mid) @ normal)
+    pitch = float((nose - eye_mid) @ normal) / span if abs(span) > 1e-6 else None
+    return yaw, pitch
+class FaceQualityGate:
+    def __init__(self, min_size: int, min_confidence: float, min_sharpness: float,
+                 max_yaw: float, pitch_range: tuple):
+        self.min_size       = min_size
+        self.min_confidence = min_confidence
+        self.min_sharpness  = min_sharpness
+        self.max_yaw        = max_yaw
+        self.pitch_range    = pitch_range
+    @classmethod
+    def from_config(cls) -> "FaceQualityGate":
+        return cls(
+            min_size=Config.FACE_QUALITY_MIN_SIZE,
+            min_confidence=Config.FACE_QUALITY_MIN_CONFIDENCE,
+            min_sharpness=Config.FACE_QUALITY_MIN_SHARPNESS,
+            max_yaw=Config.FACE_QUALITY_MAX_YAW,
+            pitch_range=Config.FACE_QUALITY_PITCH_RANGE,
+        )
+    def assess(self, face: dict, crop: np.ndarray) -> tuple:
+        """
+        Score one detection (source-space facial_area, confidence, landmarks)
+        and its aligned crop. Returns (metrics dict, rejection reason | None);
+        checks run cheapest first and stop at the first failure.
+        """
+        area = face["facial_area"]
+        metrics = {"size": int(min(area.get("w", 0), area.get("h", 0))), "confidence": float(face.get("confidence", 0.0))}
+        if metrics["size"] < self.min_size:
+            return metrics, "too_small"
+        if metrics["confidence"] < self.min_confidence:
+            return metrics, "low_confidence"
+        yaw, pitch = pose_from_landmarks(face.get("landmarks") or {})
+        metrics["yaw"], metrics["pitch"] = yaw, pitch
+        if yaw is not None and yaw > self.max_yaw:
+            return metrics, "profile"
+        if pitch is not None and not self.pitch_range[0] <= pitch <= self.pitch_range[1]:
+            return metrics, "profile"
+        if crop is None or not crop.size:
+            return metrics, "too_small"
+        metrics["sharpness"] = round(laplacian_variance(crop), 2)
+        if metrics["sharpness"] < self.min_sharpness:
+            return metrics, "blurry"
+        return metrics, None
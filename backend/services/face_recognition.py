@@ -1,35 +1,126 @@
 """
 Face Recognition Service
 ========================
-Pipeline: RetinaFace detection → MTCNN alignment → Facenet512 embeddings
-Matching: cosine similarity + optional Euclidean distance
-Optimizations: per-user embedding cache (TTL=5min), batch processing support
+Pipeline: decode once → single RetinaFace pass on a capped copy (boxes + landmarks)
+          → eye alignment on full-resolution pixels → Facenet512 embeddings
+Matching: cosine similarity + optional Euclidean distance, vectorised via FaceMatcher
+Optimizations: process-wide per-user embedding cache (LRU + TTL, Redis-invalidated), batch processing support
 """
 import os
 import time
 import logging
+import threading
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from models.database import db
+from sqlalchemy import type_coerce
+from models.database import db, decode_embeddings
 from models.face import Face
 from models.person import Person
+from services.face_matcher import FaceMatcher
+from services.quantization import QuantizedMatcher
+from services.face_assignment import assign_faces
+from services.embedding_cache import embedding_cache, prototype_cache
+from services.person_prototypes import PrototypeService
+from services.image_preprocessing import DecodedImage, decode_image
+from services.face_quality import FaceQualityGate
 from config import Config
 logger = logging.getLogger(__name__)
+_ann_store = None
+def get_ann_store():
+    """Shared AnnIndexStore, or None when FACE_ANN_ENABLED is off."""
+    global _ann_store
+    if _ann_store is None and Config.FACE_ANN_ENABLED:
+        from services.ann_index import AnnIndexStore
+        _ann_store = AnnIndexStore(
+            folder=Config.EMBEDDINGS_FOLDER,
+            min_size=Config.ANN_MIN_GALLERY_SIZE,
+            nlist=Config.ANN_NLIST,
+            nprobe=Config.ANN_NPROBE,
+            model_version=FaceRecognitionService.MODEL_VERSION,
+        )
+    return _ann_store
+_shard_store = None
+def get_shard_store():
+    """Shared ShardStore, or None when FACE_EMBEDDING_SHARDS is off."""
+    global _shard_store
+    if _shard_store is None and Config.FACE_EMBEDDING_SHARDS:
+        from services.embedding_shards import ShardStore
+        _shard_store = ShardStore(Config.EMBEDDINGS_FOLDER, FaceRecognitionService.EMBEDDING_DIM)
+    return _shard_store
+def schedule_shard_compaction(user_id: int) -> None:
+    """Queue compact_embedding_shards for user_id, at most once per few minutes."""
+    from services.redis_service import RedisService
+    client = RedisService.get_client()
+    if client is not None:
+        try:
+            if not client.set(f"drishyamitra:shard_compaction:{user_id}", 1, nx=True, ex=300):
+                return
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    try:
+        from services.tasks import compact_embedding_shards
+        compact_embedding_shards.delay(user_id)
+    except Exception as exc:
+        logger.warning(f"Could not queue shard compaction for user {user_id}: {exc}")
 class FaceRecognitionService:
     """
     Unified face detection and recognition service.
     Detection  : RetinaFace  — robust under varied lighting/angles
-    Alignment  : MTCNN       — landmark extraction + geometric normalisation
+    Alignment  : RetinaFace landmarks — eye-line rotation of each crop
     Embeddings : Facenet512  — 512-dimensional face representation
-    Matching   : cosine similarity (default) or Euclidean distance
+    Matching   : cosine similarity (default) or Euclidean distance,
+                 person prototypes first, full gallery for ambiguous faces
     """
     MODEL_NAME        = "Facenet512"
     DETECTOR_BACKEND  = "retinaface"   
-    ALIGN_BACKEND     = "mtcnn"        
-    MODEL_VERSION     = "Facenet512-RetinaFace-MTCNN-v1"
+    ALIGN_BACKEND     = "retinaface-landmarks"
+    # Bump whenever detection, alignment or embedding changes: stored vectors are re-embedded (services/face_reembedding.py)
+    MODEL_VERSION     = "Facenet512-RetinaFace-landmarks-v2"
+    DETECTION_THRESHOLD = 0.9
+    EMBEDDING_DIM       = 512
     COSINE_THRESHOLD    = 0.40   
     EUCLIDEAN_THRESHOLD = 20.0   
-    CACHE_TTL = 300  
+    CACHE_TTL = Config.EMBEDDING_CACHE_TTL
+    _instance = None
+    _instance_lock = threading.Lock()
+    _warm_lock = threading.Lock()
+    _ready = False
+    @classmethod
+    def instance(cls) -> "FaceRecognitionService":
+        """Process-wide service whose models stay loaded between tasks and requests."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+    @classmethod
+    def is_ready(cls) -> bool:
+        return cls._ready
+    def warm_up(self) -> dict:
+        """
+        Load Facenet512 and RetinaFace weights and run a dummy inference so
+        the first real photo does not pay the TensorFlow graph build.
+        Returns {"cold_seconds", "warm_seconds"}; safe to call more than once.
+        """
+        with self._warm_lock:
+            if FaceRecognitionService._ready:
+                return {"cold_seconds": 0.0, "warm_seconds": 0.0}
+            from deepface import DeepFace
+            from retinaface import RetinaFace
+            dummy_image = np.zeros((320, 320, 3), dtype=np.uint8)
+            dummy_face  = np.zeros((160, 160, 3), dtype=np.uint8)
+            t0 = time.time()
+            DeepFace.build_model(model_name=self.MODEL_NAME)
+            RetinaFace.build_model()
+            self.detect_faces(dummy_image)
+            self._embed_crop(dummy_face)
+            cold = time.time() - t0
+            t1 = time.time()
+            self.detect_faces(dummy_image)
+            self._embed_crop(dummy_face)
+            warm = time.time() - t1
+            FaceRecognitionService._ready = True
+        logger.info(f"Face models ready (pid={os.getpid()}): cold start {cold:.2f}s, warm inference {warm:.3f}s")
+        return {"cold_seconds": cold, "warm_seconds": warm}
     def __init__(self):
         self.embeddings_folder = Config.EMBEDDINGS_FOLDER
         self.metric = "cosine"
@@ -37,84 +128,413 @@ class FaceRecognitionService:
         self.detector_backend = self.DETECTOR_BACKEND
         self.align_backend    = self.ALIGN_BACKEND
         self.distance_threshold = self.COSINE_THRESHOLD
-        self._emb_cache: dict = {}
-        self._cache_ts: dict = {}
+        self.prototypes = PrototypeService(self.EMBEDDING_DIM, Config.PERSON_EXEMPLARS, self.MODEL_VERSION)
+        self.quality_gate = FaceQualityGate.from_config() if Config.FACE_QUALITY_GATE else None
         logger.info(
             f"FaceRecognitionService initialised | model={self.MODEL_NAME} "
             f"detector={self.DETECTOR_BACKEND} align={self.ALIGN_BACKEND}"
         )
-    def _get_user_embeddings(self, user_id: int) -> list:
-        """Return user embeddings from DB (cache disabled for real-time sync)."""
-        from sqlalchemy.orm import joinedload
+    def _get_user_matcher(self, user_id: int) -> FaceMatcher:
+        """Return the user's gallery from the shared cache, loading it on a miss."""
+        return embedding_cache.get(user_id, lambda: self._load_user_matcher(user_id))
+    def gallery(self, user_id: int) -> FaceMatcher:
+        """The user's stored faces as a FaceMatcher (shared cache), for callers outside the matching pipeline."""
+        return self._get_user_matcher(user_id)
+    def _load_user_matcher(self, user_id: int) -> FaceMatcher:
+        """Build a FaceMatcher over every stored embedding of user_id."""
+        shard_store = get_shard_store()
+        if shard_store is not None:
+            return self._load_sharded_matcher(user_id, shard_store)
         logger.debug(f"Querying latest embeddings for user {user_id}")
-        persons = Person.query.options(joinedload(Person.faces)).filter_by(user_id=user_id).all()
-        data = []
-        for person in persons:
-            for face in person.faces:
-                if face.embedding:
-                    data.append({"person": person, "embedding": face.embedding})
-        logger.info(f"Loaded {len(data)} embeddings for user {user_id}")
-        return data
+        raw_embedding = type_coerce(Face.embedding, db.LargeBinary).label("embedding")
+        rows = (
+            db.session.query(Face.id, Face.person_id, raw_embedding)
+            .join(Person, Face.person_id == Person.id)
+            .filter(Person.user_id == user_id, Face.embedding.isnot(None))
+            .all()
+        )
+        face_ids   = [r.id for r in rows]
+        person_ids = [r.person_id for r in rows]
+        vectors    = decode_embeddings([bytes(r.embedding) for r in rows])
+        if Config.FACE_GALLERY_QUANTIZATION == "int8":
+            unit, norms = FaceMatcher.normalize(vectors)
+            del vectors
+            matcher = QuantizedMatcher.from_unit(
+                face_ids, person_ids, unit, norms,
+                fetch=self._fetch_unit_vectors, rescore_top=Config.QUANT_RESCORE_TOP,
+            )
+        else:
+            matcher = FaceMatcher(face_ids, person_ids, vectors)
+        logger.info(f"Loaded {len(matcher)} embeddings for user {user_id} ({matcher.nbytes} bytes resident)")
+        return matcher
+    def _fetch_unit_vectors(self, face_ids) -> np.ndarray:
+        """Exact unit-length embeddings of face_ids, in the given order (re-scoring source for quantized galleries)."""
+        face_ids = [int(i) for i in face_ids]
+        if not face_ids:
+            return np.zeros((0, self.EMBEDDING_DIM), dtype=np.float32)
+        raw_embedding = type_coerce(Face.embedding, db.LargeBinary).label("embedding")
+        rows = db.session.query(Face.id, raw_embedding).filter(Face.id.in_(face_ids)).all()
+        found = dict(zip((r.id for r in rows), decode_embeddings([bytes(r.embedding) for r in rows])))
+        missing = np.zeros(self.EMBEDDING_DIM, dtype=np.float32)   # deleted since the gallery was loaded
+        unit, _ = FaceMatcher.normalize([found.get(i, missing) for i in face_ids])
+        return unit
+    def live_faces(self, user_id: int) -> tuple:
+        """(face_ids, person_ids) of the user's labelled faces with embeddings, sorted by face id."""
+        rows = (
+            db.session.query(Face.id, Face.person_id)
+            .join(Person, Face.person_id == Person.id)
+            .filter(Person.user_id == user_id, Face.embedding.isnot(None))
+            .order_by(Face.id)
+            .all()
+        )
+        return (
+            np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((r.person_id for r in rows), dtype=np.int64, count=len(rows)),
+        )
+    def evaluate_quantization(self, user_id: int, sample: int = 200):
+        """
+        Measure int8 quantization of the user's gallery against float32
+        decisions (see services.quantization.evaluate_quantization).
+        Returns None when the user has fewer than two labelled faces.
+        """
+        from services.quantization import evaluate_quantization
+        face_ids, person_ids = self.live_faces(user_id)
+        if len(face_ids) < 2:
+            return None
+        return evaluate_quantization(
+            face_ids, person_ids, self._fetch_unit_vectors(face_ids), self.COSINE_THRESHOLD,
+            sample=sample, rescore_top=Config.QUANT_RESCORE_TOP,
+        )
+    def _load_sharded_matcher(self, user_id: int, shard_store) -> FaceMatcher:
+        """
+        Build a FaceMatcher over the user's mmapped shards. The DB decides
+        which faces exist and who they belong to: faces missing from the
+        shards are backfilled from Face.embedding, and rows for deleted faces
+        are skipped (forcing a filtered copy) until compaction drops them.
+        """
+        live_ids, live_persons = self.live_faces(user_id)
+        gallery = shard_store.read(user_id)
+        missing = np.setdiff1d(live_ids, gallery.face_ids, assume_unique=False)
+        if len(missing):
+            raw_embedding = type_coerce(Face.embedding, db.LargeBinary).label("embedding")
+            rows = (
+                db.session.query(Face.id, raw_embedding)
+                .filter(Face.id.in_([int(i) for i in missing]))
+                .order_by(Face.id)
+                .all()
+            )
+            vectors, norms = FaceMatcher.normalize(decode_embeddings([bytes(r.embedding) for r in rows]))
+            ids = np.array([r.id for r in rows], dtype=np.int64)
+            shard_store.append(user_id, ids, live_persons[np.searchsorted(live_ids, ids)], vectors, norms)
+            logger.info(f"Backfilled {len(ids)} embedding(s) into shards for user {user_id}")
+            gallery = shard_store.read(user_id)
+        pos  = np.clip(np.searchsorted(live_ids, gallery.face_ids), 0, max(len(live_ids) - 1, 0))
+        keep = (live_ids[pos] == gallery.face_ids) if len(live_ids) else np.zeros(len(gallery), dtype=bool)
+        keep &= ~np.isin(gallery.face_ids, gallery.tombstones)
+        _, first = np.unique(gallery.face_ids, return_index=True)
+        unique = np.zeros(len(gallery), dtype=bool)
+        unique[first] = True
+        keep &= unique
+        person_ids = live_persons[pos] if len(live_ids) else gallery.person_ids
+        if keep.all():
+            matrix, norms, face_ids = gallery.matrix, gallery.norms, gallery.face_ids
+        else:
+            matrix, norms, face_ids, person_ids = (
+                gallery.matrix[keep], gallery.norms[keep], gallery.face_ids[keep], person_ids[keep],
+            )
+        if shard_store.needs_compaction(gallery) or not keep.all():
+            schedule_shard_compaction(user_id)
+        if Config.FACE_GALLERY_QUANTIZATION == "int8":
+            # Re-score straight from the mmapped shard; a multi-shard gallery is already a private copy, so use the DB.
+            single = gallery.shard_count == 1
+            matcher = QuantizedMatcher.from_unit(
+                face_ids, person_ids, matrix, norms,
+                fetch=self._fetch_unit_vectors,
+                exact=gallery.matrix if single else None,
+                exact_index=None if keep.all() else np.flatnonzero(keep),
+                rescore_top=Config.QUANT_RESCORE_TOP,
+            )
+        else:
+            matcher = FaceMatcher(face_ids, person_ids, matrix, norms=norms, normalized=True)
+        logger.info(f"Mapped {len(matcher)} sharded embeddings for user {user_id} ({gallery.shard_count} shard(s))")
+        return matcher
     def invalidate_cache(self, user_id: int) -> None:
-        """Force re-fetch on next access for a given user."""
-        self._emb_cache.pop(user_id, None)
-        self._cache_ts.pop(user_id, None)
-        logger.debug(f"Cache invalidated for user {user_id}")
+        """Force re-fetch on next access for a given user, in every process."""
+        embedding_cache.invalidate(user_id)
+        prototype_cache.forget(user_id)
+    def reset_gallery(self, user_id: int) -> None:
+        """Drop every derived copy of the user's embeddings (shards, ANN index, caches) after they were rewritten."""
+        shard_store = get_shard_store()
+        if shard_store is not None:
+            shard_store.drop(user_id)
+        ann_store = get_ann_store()
+        if ann_store is not None:
+            ann_store.drop(user_id)
+        self.invalidate_cache(user_id)
+    def discard_faces(self, user_id: int, face_ids: list, person_ids: list = None) -> None:
+        """
+        Call after deleting Face rows: tombstone them in the shards, refresh
+        the prototypes of the persons they belonged to and invalidate the gallery.
+        """
+        shard_store = get_shard_store()
+        if shard_store is not None and face_ids:
+            shard_store.tombstone(user_id, face_ids)
+            schedule_shard_compaction(user_id)
+        if person_ids:
+            self.refresh_prototypes(person_ids)
+        self.invalidate_cache(user_id)
+    def refresh_prototypes(self, person_ids: list) -> None:
+        """Rebuild the centroid/exemplar prototypes of person_ids after relabels or deletes."""
+        try:
+            self.prototypes.rebuild(person_ids)
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            logger.warning(f"Prototype refresh failed for persons {person_ids}: {exc}")
+    def cache_new_faces(self, user_id: int, faces: list) -> None:
+        """Append freshly committed Face rows to the cached gallery of user_id."""
+        faces = [f for f in faces if f.embedding is not None and f.person_id is not None]
+        shard_store = get_shard_store()
+        if shard_store is not None:
+            if faces:
+                vectors, norms = FaceMatcher.normalize([f.embedding for f in faces])
+                shard_store.append(user_id, [f.id for f in faces], [f.person_id for f in faces], vectors, norms)
+            # Reloading only re-maps the shard files, so skip the private in-memory copy.
+            embedding_cache.invalidate(user_id)
+        else:
+            embedding_cache.extend(
+                user_id,
+                [f.id for f in faces],
+                [f.person_id for f in faces],
+                [f.embedding for f in faces],
+            )
+        ann_store = get_ann_store()
+        if ann_store is not None and faces:
+            vectors, _ = FaceMatcher.normalize([f.embedding for f in faces])
+            ann_store.add_faces(user_id, [f.id for f in faces], vectors)
+        try:
+            self.prototypes.add_faces(faces)
+            prototype_cache.forget(user_id)
+        except Exception as exc:
+            db.session.rollback()
+            logger.warning(f"Prototype update failed for user {user_id}; it will be rebuilt on next load: {exc}")
+    def _load_image(self, image) -> DecodedImage:
+        """Decode a path/bytes once, or wrap an already decoded BGR ndarray."""
+        return decode_image(image)
+    @staticmethod
+    def _scale_face(face: dict, factor: float) -> dict:
+        """Return a copy of a detection with every coordinate multiplied by factor."""
+        if factor == 1.0:
+            return dict(face, facial_area=dict(face["facial_area"]), landmarks=dict(face["landmarks"]))
+        scale_point = lambda p: [p[0] * factor, p[1] * factor] if p else p
+        area = face["facial_area"]
+        landmarks = {name: scale_point(point) for name, point in face["landmarks"].items()}
+        return dict(
+            face,
+            facial_area={
+                "x": int(round(area["x"] * factor)), "y": int(round(area["y"] * factor)),
+                "w": int(round(area["w"] * factor)), "h": int(round(area["h"] * factor)),
+                "left_eye":  landmarks.get("left_eye"),
+                "right_eye": landmarks.get("right_eye"),
+            },
+            landmarks=landmarks,
+        )
+    def _detect_raw(self, pixels: np.ndarray) -> list:
+        from retinaface import RetinaFace
+        resp = RetinaFace.detect_faces(img_path=pixels, threshold=self.DETECTION_THRESHOLD)
+        if not isinstance(resp, dict):
+            return []
+        faces = []
+        for det in resp.values():
+            x1, y1, x2, y2 = (int(v) for v in det["facial_area"])
+            landmarks = {
+                name: [float(point[0]), float(point[1])]
+                for name, point in (det.get("landmarks") or {}).items()
+            }
+            faces.append({
+                "facial_area": {
+                    "x": x1, "y": y1, "w": x2 - x1, "h": y2 - y1,
+                    "left_eye":  landmarks.get("left_eye"),
+                    "right_eye": landmarks.get("right_eye"),
+                },
+                "confidence": float(det.get("score", 0.0)),
+                "landmarks":  landmarks,
+            })
+        return faces
+    def detect_faces(self, image) -> list:
+        """
+        Single RetinaFace pass over an image (path, bytes, BGR ndarray or DecodedImage).
+        Detection runs on the resolution-capped copy; coordinates are returned
+        in the oriented source image's space.
+        Returns a list of dicts with keys:
+            facial_area – {x, y, w, h, left_eye, right_eye}
+            confidence  – detection score
+            landmarks   – {right_eye, left_eye, nose, mouth_right, mouth_left}
+        Boxes and landmarks come from the same detection record, so they can
+        never be paired with the wrong face.
+        """
+        decoded = self._load_image(image)
+        factor  = decoded.detect_scale * decoded.source_scale
+        return [self._scale_face(face, factor) for face in self._detect_raw(decoded.detect_pixels)]
+    @staticmethod
+    def align_face(img: np.ndarray, facial_area: dict, landmarks: dict) -> np.ndarray:
+        """
+        Rotate the face so the eyes are level and cut it out of img.
+        Only a padded region around the box is warped, not the whole image.
+        Falls back to a plain crop when eye landmarks are missing.
+        """
+        import cv2
+        height, width = img.shape[:2]
+        x, y, w, h = (int(facial_area.get(k, 0)) for k in ("x", "y", "w", "h"))
+        left_eye, right_eye = landmarks.get("left_eye"), landmarks.get("right_eye")
+        if not left_eye or not right_eye:
+            return img[max(y, 0):y + h, max(x, 0):x + w].copy()
+        pad = max(w, h) // 2
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        x1, y1 = min(x + w + pad, width), min(y + h + pad, height)
+        region = img[y0:y1, x0:x1]
+        angle  = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+        center = ((left_eye[0] + right_eye[0]) / 2 - x0, (left_eye[1] + right_eye[1]) / 2 - y0)
+        matrix  = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rotated = cv2.warpAffine(region, matrix, (region.shape[1], region.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+        cx, cy = x - x0, y - y0
+        return rotated[max(cy, 0):cy + h, max(cx, 0):cx + w].copy()
+    def embed_faces(self, face_crops: list, batch_size: int = None) -> np.ndarray:
+        """
+        Run Facenet512 over N aligned BGR face crops (from one or many photos)
+        as tensor batches of at most batch_size (default FACE_EMBED_BATCH_SIZE).
+        Preprocessing mirrors DeepFace.represent, so vectors are comparable
+        with embeddings produced by the single-crop path.
+        Returns a float32 array of shape (N, 512).
+        """
+        if not face_crops:
+            return np.zeros((0, self.EMBEDDING_DIM), dtype=np.float32)
+        from deepface import DeepFace
+        from deepface.modules import preprocessing
+        t0 = time.time()
+        batch_size = batch_size or Config.FACE_EMBED_BATCH_SIZE
+        client = DeepFace.build_model(model_name=self.MODEL_NAME)
+        target = client.input_shape
+        prepared = [
+            preprocessing.normalize_input(
+                preprocessing.resize_image(img=crop[:, :, ::-1], target_size=(target[1], target[0])),
+                normalization="base",
+            )
+            for crop in face_crops
+        ]
+        out = []
+        for start in range(0, len(prepared), batch_size):
+            batch = np.concatenate(prepared[start:start + batch_size], axis=0)
+            out.append(np.asarray(client.model(batch, training=False), dtype=np.float32))
+        vectors = np.concatenate(out)
+        logger.debug(f"Embedded {len(vectors)} face(s) in batches of {batch_size} [{time.time() - t0:.3f}s]")
+        return vectors
+    def _embed_crop(self, face_crop: np.ndarray) -> list | None:
+        return self.embed_faces([face_crop])[0].tolist()
+    def detect_and_align(self, decoded: DecodedImage, gate: bool = True) -> list:
+        """
+        Detect on the capped copy, cut aligned crops from the working-resolution
+        pixels and, when gate is set, run the quality gate on each face.
+        """
+        faces = []
+        for raw in self._detect_raw(decoded.detect_pixels):
+            in_pixels = self._scale_face(raw, decoded.detect_scale)
+            face = self._scale_face(raw, decoded.detect_scale * decoded.source_scale)
+            face["face"] = self.align_face(decoded.pixels, in_pixels["facial_area"], in_pixels["landmarks"])
+            face["face_confidence"] = face["confidence"]
+            if gate and self.quality_gate is not None:
+                face["quality"], face["rejected"] = self.quality_gate.assess(face, face["face"])
+            faces.append(face)
+        return faces
+    def _attach_embeddings(self, faces: list, batch_size: int = None) -> None:
+        usable  = [f for f in faces if f["face"].size and not f.get("rejected")]
+        vectors = self.embed_faces([f["face"] for f in usable], batch_size)
+        for face in faces:
+            face["embedding"] = None
+        for face, vector in zip(usable, vectors):
+            face["embedding"] = vector.tolist()
+    def analyze_faces(self, image, embed: bool = True, gate: bool = True) -> list:
+        """
+        Detect once, align each face from the detector's own landmarks and
+        (optionally) embed all aligned crops of the image in one batch.
+        Returns the detect_faces dicts extended with:
+            face            – aligned BGR face crop
+            embedding       – list[float] (512-d), when embed=True
+            face_confidence – alias for confidence
+            quality, rejected – gate metrics and rejection reason (no embedding
+                                is computed for rejected faces); gate=False skips it
+        """
+        t0 = time.time()
+        decoded = self._load_image(image)
+        faces = self.detect_and_align(decoded, gate=gate)
+        if embed:
+            self._attach_embeddings(faces)
+        name = os.path.basename(decoded.name)
+        logger.info(
+            f"analyze_faces: {len(faces)} face(s) in {name} "
+            f"(embed={embed}) [{time.time() - t0:.2f}s]"
+        )
+        return faces
+    def analyze_batch(self, images: list, batch_size: int = None) -> list:
+        """
+        Detect and align faces in each image, then embed the crops of all
+        images together so Facenet512 sees full tensor batches.
+        With FACE_INFERENCE_MODE=process the work is spread over the shared
+        InferencePool, with images and results passed through shared memory.
+        Returns one analyze_faces-style list per input image, in input order.
+        """
+        if Config.FACE_INFERENCE_MODE != "process":
+            return self._analyze_batch_local(images, batch_size)
+        from services.inference_pool import InferencePool
+        decoded = []
+        for image in images:
+            try:
+                decoded.append(self._load_image(image))
+            except Exception as exc:
+                logger.error(f"Could not decode {image if isinstance(image, str) else '<array>'}: {exc}")
+                decoded.append(None)
+        from concurrent.futures.process import BrokenProcessPool
+        pool = InferencePool.get()
+        try:
+            analysed = pool.analyze([img for img in decoded if img is not None])
+        except BrokenProcessPool:
+            # A pool process was killed (e.g. OOM): start a new pool and retry the batch once.
+            InferencePool.reset(pool)
+            analysed = InferencePool.get().analyze([img for img in decoded if img is not None])
+        analysed = iter(analysed)
+        return [next(analysed) if img is not None else [] for img in decoded]
+    def _analyze_batch_local(self, images: list, batch_size: int = None) -> list:
+        """In-process implementation of analyze_batch."""
+        t0 = time.time()
+        per_image = []
+        for image in images:
+            try:
+                per_image.append(self.detect_and_align(self._load_image(image)))
+            except Exception as exc:
+                logger.error(f"Detection failed for {getattr(image, 'name', image) if not isinstance(image, np.ndarray) else '<array>'}: {exc}")
+                per_image.append([])
+        all_faces = [face for faces in per_image for face in faces]
+        self._attach_embeddings(all_faces, batch_size)
+        rejected = sum(1 for face in all_faces if face.get("rejected"))
+        logger.info(
+            f"analyze_batch: {len(images)} image(s), {len(all_faces)} face(s), "
+            f"{rejected} rejected by the quality gate [{time.time() - t0:.2f}s]"
+        )
+        return per_image
     def extract_faces_with_landmarks(self, image_path: str) -> list:
         """
-        Use RetinaFace for detection and MTCNN for landmark extraction.
+        Detection + alignment without embeddings.
         Returns a list of dicts with keys:
-            face       – cropped face numpy array
+            face       – aligned face crop numpy array
             facial_area – {x, y, w, h}
             confidence – detection score
             landmarks  – {right_eye, left_eye, nose, mouth_right, mouth_left}
         """
-        t0 = time.time()
-        results = []
         try:
-            from deepface import DeepFace
-            detected = DeepFace.extract_faces(
-                img_path=image_path,
-                detector_backend=self.DETECTOR_BACKEND,
-                align=False,          
-                enforce_detection=False,
-            )
+            return self.analyze_faces(image_path, embed=False)
         except Exception as exc:
             logger.error(f"RetinaFace detection failed for {image_path}: {exc}")
-            detected = []
-        if not detected:
-            logger.info(f"No faces detected by RetinaFace in {image_path}")
             return []
-        logger.info(f"RetinaFace found {len(detected)} face(s) in {os.path.basename(image_path)}")
-        try:
-            from deepface import DeepFace
-            aligned = DeepFace.extract_faces(
-                img_path=image_path,
-                detector_backend=self.ALIGN_BACKEND,   
-                align=True,
-                enforce_detection=False,
-            )
-        except Exception as exc:
-            logger.warning(
-                f"MTCNN alignment failed for {image_path}: {exc}. "
-                "Falling back to RetinaFace crops without alignment."
-            )
-            aligned = detected  
-        face_list = aligned if len(aligned) == len(detected) else detected
-        for item in face_list:
-            landmark_data = item.get("facial_area", {})
-            results.append({
-                "face":         item.get("face"),          
-                "facial_area":  item.get("facial_area", {}),
-                "confidence":   item.get("confidence", 0.0),
-                "landmarks":    item.get("landmarks", {}), 
-            })
-        elapsed = time.time() - t0
-        logger.info(
-            f"Detection+alignment completed in {elapsed:.2f}s "
-            f"({len(results)} face(s)) for {os.path.basename(image_path)}"
-        )
-        return results
     def get_embedding(self, image_path: str, face_crop=None) -> list | None:
         """
         Extract a 512-dimensional Facenet512 embedding.
@@ -122,19 +542,12 @@ class FaceRecognitionService:
         Returns a list[float] of length 512, or None on failure.
         """
         t0 = time.time()
-        img_input = face_crop if face_crop is not None else image_path
         try:
-            from deepface import DeepFace
-            objs = DeepFace.represent(
-                img_path=img_input,
-                model_name=self.MODEL_NAME,
-                detector_backend=self.DETECTOR_BACKEND,
-                align=True,
-                enforce_detection=False,
-            )
-            if not objs:
-                return None
-            emb = objs[0].get("embedding")
+            if face_crop is not None:
+                emb = self._embed_crop(face_crop)
+            else:
+                faces = self.analyze_faces(image_path)
+                emb = faces[0].get("embedding") if faces else None
             elapsed = time.time() - t0
             logger.debug(f"Embedding extracted in {elapsed:.3f}s  dim={len(emb) if emb else 'N/A'}")
             return emb
@@ -143,7 +556,7 @@ class FaceRecognitionService:
             return None
     def detect_and_extract_faces(self, image_path: str) -> list:
         """
-        Full pipeline for a single image.
+        Full single-pass pipeline for a single image.
         Returns a list of dicts (one per detected face):
             embedding   – list[float] (512-d)
             facial_area – {x, y, w, h}
@@ -151,44 +564,44 @@ class FaceRecognitionService:
             landmarks   – dict
             face_confidence – alias for confidence
         """
-        t0 = time.time()
         try:
-            from deepface import DeepFace
-            raw = DeepFace.represent(
-                img_path=image_path,
-                model_name=self.MODEL_NAME,
-                detector_backend=self.DETECTOR_BACKEND,
-                align=True,
-                enforce_detection=False,
-            )
-            elapsed = time.time() - t0
-            logger.info(
-                f"detect_and_extract_faces: {len(raw)} face(s) found in "
-                f"{os.path.basename(image_path)} ({elapsed:.2f}s)"
-            )
-            for item in raw:
-                item.setdefault("face_confidence", item.get("confidence", 0.0))
-            return raw
+            return self.analyze_faces(image_path)
         except Exception as exc:
             logger.error(f"Pipeline failed for {image_path}: {exc}")
             return []
-    def process_batch(self, image_paths: list, max_workers: int = 4) -> list:
+    @staticmethod
+    def pair_by_geometry(boxes_a: list, boxes_b: list, min_iou: float = 0.5) -> list:
+        """
+        Greedily pair two lists of [x, y, w, h] boxes by IoU.
+        Returns (index_a, index_b) tuples; boxes without a partner above
+        min_iou are left unpaired.
+        """
+        if not boxes_a or not boxes_b:
+            return []
+        a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+        b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+        ix = np.clip(np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+        iy = np.clip(np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+        inter = ix * iy
+        union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+        iou = np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+        pairs = []
+        while iou.size and iou.max() >= min_iou:
+            i, j = np.unravel_index(int(np.argmax(iou)), iou.shape)
+            pairs.append((int(i), int(j)))
+            iou[i, :] = -1.0
+            iou[:, j] = -1.0
+        return pairs
+    def process_batch(self, image_paths: list, batch_size: int = None) -> list:
         """
-        Process multiple images concurrently.
+        Process multiple images with batched embedding inference.
         Returns list of {"image": path, "faces": [...]}.
         """
-        logger.info(f"Batch processing {len(image_paths)} image(s) with {max_workers} worker(s)")
-        results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as pool:
-            future_map = {pool.submit(self.detect_and_extract_faces, p): p for p in image_paths}
-            for future in as_completed(future_map):
-                path = future_map[future]
-                try:
-                    faces = future.result()
-                except Exception as exc:
-                    logger.error(f"Batch item {path} raised: {exc}")
-                    faces = []
-                results.append({"image": path, "faces": faces})
+        logger.info(f"Batch processing {len(image_paths)} image(s)")
+        results = [
+            {"image": path, "faces": faces}
+            for path, faces in zip(image_paths, self.analyze_batch(image_paths, batch_size))
+        ]
         logger.info(f"Batch complete — processed {len(results)} image(s)")
         return results
     @staticmethod
@@ -207,51 +620,142 @@ class FaceRecognitionService:
     def euclidean_distance(a: list, b: list) -> float:
         """L2 distance. Lower = more similar."""
         return float(np.linalg.norm(np.array(a, dtype=np.float32) - np.array(b, dtype=np.float32)))
-    def match_face(self, target_embedding: list, user_id: int) -> tuple:
+    def match_faces(self, target_embeddings: list, user_id: int, top_k: int = 5) -> list:
         """
-        Match target_embedding against all known faces for user_id.
-        Returns (best_person | None, {"cosine_distance": float, "euclidean": float, "similarity": float})
+        Match a batch of embeddings (e.g. every face of one photo) against all
+        known faces for user_id with a single matrix multiply.
+        Returns a list of (best_person | None, score) tuples in input order, where
+        score = {"cosine_distance", "euclidean", "similarity", "candidates"}.
         """
+        if not target_embeddings:
+            return []
         t0 = time.time()
-        user_faces = self._get_user_embeddings(user_id)
-        best_person = None
-        best_cos_dist = float("inf")
-        best_euclid   = float("inf")
-        best_sim      = -1.0
-        for entry in user_faces:
-            stored = entry["embedding"]
-            cos_d  = self.cosine_distance(target_embedding, stored)
-            euclid = self.euclidean_distance(target_embedding, stored)
-            sim    = 1.0 - cos_d  
-            if cos_d < self.COSINE_THRESHOLD and cos_d < best_cos_dist:
-                best_cos_dist = cos_d
-                best_euclid   = euclid
-                best_sim      = sim
-                best_person   = entry["person"]
+        results = [None] * len(target_embeddings)
+        if Config.FACE_PROTOTYPE_MATCHING:
+            protos = prototype_cache.get(user_id, lambda: self.prototypes.load_matcher(user_id))
+            for i, res in enumerate(protos.match(target_embeddings, self.COSINE_THRESHOLD, top_k=top_k)):
+                if self._is_decisive(res):
+                    results[i] = res
+        pending = [i for i, res in enumerate(results) if res is None]
+        gallery_size = None
+        if pending:
+            matcher = self._get_user_matcher(user_id)
+            gallery_size = len(matcher)
+            queries = [target_embeddings[i] for i in pending]
+            ann_store = get_ann_store()
+            exact = None
+            if ann_store is not None:
+                exact = ann_store.search(user_id, matcher, queries, self.COSINE_THRESHOLD, top_k=top_k)
+            if exact is None:
+                exact = matcher.match(queries, self.COSINE_THRESHOLD, top_k=top_k)
+            for i, res in zip(pending, exact):
+                results[i] = res
+        persons = {}
+        matches = []
+        for res in results:
+            pid = res["person_id"]
+            if pid is not None and pid not in persons:
+                persons[pid] = db.session.get(Person, pid)
+            score = {
+                "cosine_distance": res["cosine_distance"],
+                "euclidean":       res["euclidean"],
+                "similarity":      res["similarity"],
+                "candidates":      res["candidates"],
+            }
+            matches.append((persons.get(pid), score))
         elapsed = time.time() - t0
-        score = {"cosine_distance": best_cos_dist, "euclidean": best_euclid, "similarity": best_sim}
-        if best_person:
+        matched = sum(1 for person, _ in matches if person is not None)
+        logger.info(
+            f"Matched {len(matches)} face(s) for user {user_id}: {len(matches) - len(pending)} by prototype, "
+            f"{len(pending)} against {gallery_size if gallery_size is not None else '-'} stored faces; "
+            f"{matched} match(es), threshold={self.COSINE_THRESHOLD} [{elapsed:.3f}s]"
+        )
+        return matches
+    def match_photo_faces(self, target_embeddings: list, user_id: int, top_k: int = 5) -> list:
+        """
+        Match every face of one photo in a single scoring pass, then resolve
+        the assignment jointly so that no person is given to two faces of
+        the same photo. Same return format as match_faces; a face moved to
+        another candidate gets that candidate's similarity, the Euclidean
+        distance to its closest stored face and candidates led by it.
+        """
+        matches = self.match_faces(target_embeddings, user_id, top_k=top_k)
+        if len(matches) < 2:
+            return matches
+        assigned = assign_faces([score for _, score in matches], self.COSINE_THRESHOLD)
+        resolved = []
+        for embedding, (person, score), (pid, sim) in zip(target_embeddings, matches, assigned):
+            if person is not None and person.id == pid:
+                resolved.append((person, score))
+                continue
+            if pid is None:
+                score = dict(score, cosine_distance=float("inf"), euclidean=float("inf"), similarity=-1.0)
+                resolved.append((None, score))
+            else:
+                candidates = sorted(score["candidates"], key=lambda c: c["person_id"] != pid)
+                euclidean  = self._get_user_matcher(user_id).euclidean_to_person(embedding, pid)
+                score = dict(score, cosine_distance=1.0 - sim, euclidean=euclidean, similarity=sim, candidates=candidates)
+                resolved.append((db.session.get(Person, pid), score))
             logger.info(
-                f"Match found for user {user_id}: person='{best_person.name}' "
-                f"cos_dist={best_cos_dist:.4f} sim={best_sim:.4f} [{elapsed:.3f}s]"
+                f"Joint assignment moved a face from person {person.id if person else None} to {pid} "
+                f"(user {user_id})"
             )
-        else:
+        return resolved
+    def _is_decisive(self, res: dict) -> bool:
+        """
+        A prototype-tier result stands on its own when the best person is well
+        inside the threshold and clearly ahead of the runner-up, or when even
+        the best person is well outside it.
+        """
+        candidates = res["candidates"]
+        if not candidates:
+            return False
+        margin = Config.PROTOTYPE_MARGIN
+        best   = 1.0 - candidates[0]["similarity"]
+        second = 1.0 - candidates[1]["similarity"] if len(candidates) > 1 else float("inf")
+        if res["person_id"] is not None:
+            return best < self.COSINE_THRESHOLD - margin and second - best > margin
+        return best >= self.COSINE_THRESHOLD + margin
+    def match_face(self, target_embedding: list, user_id: int) -> tuple:
+        """
+        Match target_embedding against all known faces for user_id.
+        Returns (best_person | None, {"cosine_distance": float, "euclidean": float, "similarity": float, "candidates": list})
+        """
+        best_person, score = self.match_faces([target_embedding], user_id)[0]
+        if best_person:
             logger.info(
-                f"No match for user {user_id} (threshold={self.COSINE_THRESHOLD}) [{elapsed:.3f}s]"
+                f"Match found for user {user_id}: person='{best_person.name}' "
+                f"cos_dist={score['cosine_distance']:.4f} sim={score['similarity']:.4f}"
             )
         return best_person, score
-    def auto_create_person(self, user_id: int, label: str = None) -> "Person":
+    def auto_create_persons(self, user_id: int, count: int) -> list:
         """
-        Create a new Person record for an unrecognised face.
-        The person is flagged as auto-created so the UI can prompt
-        the user to optionally assign a real name later.
+        Create count "Unknown Person N" records for unrecognised faces with a
+        single numbering query and a single flush. Numbering continues from
+        the highest existing suffix, so names stay unique after clustering
+        deletes persons. The persons are flagged as auto-created so the UI
+        can prompt the user to name them later.
         """
+        if count <= 0:
+            return []
+        prefix = "Unknown Person "
+        names = db.session.query(Person.name).filter(Person.user_id == user_id, Person.name.like(f"{prefix}%"))
+        suffixes = [name[len(prefix):] for (name,) in names]
+        start = max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+        persons = [
+            Person(name=f"Unknown Person {start + i + 1}", user_id=user_id, is_auto_created=True)
+            for i in range(count)
+        ]
+        db.session.add_all(persons)
+        db.session.flush()
+        logger.info(f"Auto-created {count} person(s) for user {user_id} (ids {persons[0].id}..{persons[-1].id})")
+        return persons
+    def auto_create_person(self, user_id: int, label: str = None) -> "Person":
+        """Create a single Person for an unrecognised face (see auto_create_persons)."""
         if label is None:
-            count = Person.query.filter_by(user_id=user_id, is_auto_created=True).count()
-            label = f"Unknown Person {count + 1}"
+            return self.auto_create_persons(user_id, 1)[0]
         person = Person(name=label, user_id=user_id, is_auto_created=True)
         db.session.add(person)
-        db.session.flush()   
-        self.invalidate_cache(user_id)
+        db.session.flush()
         logger.info(f"Auto-created person '{label}' (id={person.id}) for user {user_id}")
         return person
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+Face Re-embedding
+=================
+Moves a user's library to the current FaceRecognitionService.MODEL_VERSION.
+Faces stored under an older version are reprocessed in chunks. A face
+with a stored aligned crop (Face.crop_path) is only run through the
+embedding model. For the others each photo is decoded once, detection runs
+again, and every face is embedded from the crop of the detection that
+overlaps it (or from its stored box and landmarks when the detector no
+longer finds it); those crops are stored for next time. New vectors are
+staged in Face.pending_embedding; the embedding_migrations row records a
+checkpoint (last processed face id) in the same transaction, so a chunk
+that dies with its worker is simply redone. A photo that fails for any
+other reason than a missing or undecodable file keeps the checkpoint in
+front of its faces, so they are retried by a later chunk; after
+REEMBED_MAX_DEFERRALS attempts it is given up like an unreadable one.
+Matching keeps using the old embeddings until every outdated face of the
+user is staged. Completion swaps all staged vectors in with one UPDATE
+and rebuilds the user's prototypes, shards and ANN index; faces staged
+without a vector (their photo is gone or unreadable) lose their embedding.
+"""
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import or_
+from models.database import db
+from models.embedding_migration import EmbeddingMigration
+from models.face import Face
+from models.person import Person
+from models.photo import Photo
+from config import Config
+from services.face_crops import load_crop, save_crop
+logger = logging.getLogger(__name__)
+class EmbeddingMigrator:
+    def __init__(self, service, upload_folder: str):
+        self.service       = service
+        self.upload_folder = upload_folder
+        self.version       = service.MODEL_VERSION
+    def _outdated(self):
+        """Faces with a usable embedding from another MODEL_VERSION."""
+        return (
+            Face.query.join(Photo, Face.photo_id == Photo.id)
+            .filter(
+                Face.embedding.isnot(None),
+                or_(Face.model_version.is_(None), Face.model_version != self.version),
+            )
+        )
+    def outdated_users(self) -> list:
+        rows = self._outdated().with_entities(Photo.user_id).distinct().all()
+        return sorted(user_id for (user_id,) in rows)
+    def start(self, user_id: int) -> EmbeddingMigration:
+        """Return the user's migration to the current version, creating or reopening it."""
+        migration = EmbeddingMigration.query.filter_by(user_id=user_id, model_version=self.version).first()
+        if migration is None:
+            migration = EmbeddingMigration(user_id=user_id, model_version=self.version, status="pending",
+                                           last_face_id=0, faces_done=0, faces_failed=0)
+            db.session.add(migration)
+        if migration.status == "completed":
+            # Outdated faces reappeared (e.g. reused from an old duplicate); run again from the start.
+            migration.last_face_id = 0
+            migration.faces_done   = 0
+            migration.faces_failed = 0
+            migration.deferrals    = None
+            migration.completed_at = None
+        if migration.status != "running":
+            remaining = self._outdated().filter(Photo.user_id == user_id, Face.id > migration.last_face_id).count()
+            migration.faces_total = migration.faces_done + migration.faces_failed + remaining
+            migration.status = "running"
+        db.session.commit()
+        return migration
+    def _crops(self, decoded, faces: list) -> dict:
+        """Return {face_id: aligned crop} for the stored faces of one decoded photo."""
+        detected = self.service.detect_and_align(decoded, gate=False)
+        stored_boxes = [f.bounding_box or [0, 0, 0, 0] for f in faces]
+        detected_boxes = [[d["facial_area"][k] for k in ("x", "y", "w", "h")] for d in detected]
+        crops = {}
+        for i, j in self.service.pair_by_geometry(stored_boxes, detected_boxes):
+            crops[faces[i].id] = detected[j]["face"]
+        to_pixels = 1.0 / decoded.source_scale
+        for face in faces:
+            if face.id in crops or not face.bounding_box:
+                continue
+            x, y, w, h = face.bounding_box
+            stored = self.service._scale_face(
+                {"facial_area": {"x": x, "y": y, "w": w, "h": h}, "landmarks": face.landmarks or {}},
+                to_pixels,
+            )
+            crops[face.id] = self.service.align_face(decoded.pixels, stored["facial_area"], stored["landmarks"])
+        return {face_id: crop for face_id, crop in crops.items() if crop.size}
+    def run_chunk(self, migration: EmbeddingMigration, batch_size: int) -> dict:
+        """
+        Stage new embeddings for the next batch_size outdated faces after the
+        checkpoint and advance it. Returns {"staged", "failed", "deferred",
+        "attempts", "from_crops", "remaining"}; from_crops counts faces
+        embedded from stored crops, deferred the faces left for a later chunk
+        and attempts the most failures of any of their photos so far.
+        """
+        from services.image_preprocessing import decode_image
+        faces = (
+            self._outdated()
+            .filter(Photo.user_id == migration.user_id, Face.id > migration.last_face_id)
+            .filter(or_(Face.pending_model_version.is_(None), Face.pending_model_version != self.version))
+            .order_by(Face.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not faces:
+            return {"staged": 0, "failed": 0, "deferred": 0, "attempts": 0, "remaining": False}
+        crops = {}
+        for face in faces:
+            crop = load_crop(face)
+            if crop is not None:
+                crops[face.id] = crop
+        by_photo = {}
+        for face in faces:
+            if face.id not in crops:
+                by_photo.setdefault(face.photo_id, []).append(face)
+        unreadable, deferred = set(), set()
+        deferrals = dict(migration.deferrals or {})
+        for photo in Photo.query.filter(Photo.id.in_(list(by_photo))).all() if by_photo else []:
+            try:
+                decoded = decode_image(os.path.join(self.upload_folder, photo.filename))
+            except (OSError, ValueError) as exc:
+                logger.warning(f"Re-embedding: photo {photo.id} is missing or unreadable: {exc}")
+                unreadable.update(face.id for face in by_photo[photo.id])
+                continue
+            try:
+                recovered = self._crops(decoded, by_photo[photo.id])
+            except Exception as exc:
+                attempts = deferrals.get(str(photo.id), 0) + 1
+                if attempts >= Config.REEMBED_MAX_DEFERRALS:
+                    logger.warning(f"Re-embedding: photo {photo.id} failed {attempts} times, giving up: {exc}")
+                    deferrals.pop(str(photo.id), None)
+                    continue
+                logger.warning(f"Re-embedding: photo {photo.id} could not be reprocessed, retrying later: {exc}")
+                deferrals[str(photo.id)] = attempts
+                deferred.update(face.id for face in by_photo[photo.id])
+                continue
+            deferrals.pop(str(photo.id), None)
+            crops.update(recovered)
+            for face in by_photo[photo.id]:
+                if face.id in recovered:
+                    face.crop_path = save_crop(face, photo.user_id, recovered[face.id])
+        face_ids = [face_id for face_id in (f.id for f in faces) if face_id in crops]
+        vectors = self.service.embed_faces([crops[face_id] for face_id in face_ids])
+        staged = dict(zip(face_ids, vectors))
+        failed = 0
+        for face in faces:
+            if face.id in deferred:
+                continue
+            # Staged without a vector when nothing is left to embed from: completion drops the old one.
+            face.pending_embedding     = staged.get(face.id)
+            face.pending_model_version = self.version
+            failed += face.id not in staged
+        # Never move the checkpoint past a deferred face; faces staged after it are skipped by the query.
+        migration.last_face_id  = min(deferred) - 1 if deferred else faces[-1].id
+        migration.faces_done   += len(staged)
+        migration.faces_failed += failed
+        migration.deferrals     = deferrals or None
+        db.session.commit()
+        return {
+            "staged":     len(staged),
+            "failed":     failed,
+            "deferred":   len(deferred),
+            "attempts":   max((deferrals[str(f.photo_id)] for f in faces if f.id in deferred), default=0),
+            "from_crops": len(faces) - sum(len(group) for group in by_photo.values()),
+            "remaining":  len(faces) == batch_size or bool(deferred),
+        }
+    def complete(self, migration: EmbeddingMigration) -> dict:
+        """
+        Swap the staged embeddings in for every face of the user in one
+        transaction. Faces staged without a vector (their photo is missing,
+        unreadable or kept failing) lose their embedding, which lives in another vector
+        space, but keep their person.
+        """
+        user_id = migration.user_id
+        user_faces = db.select(Face.id).join(Photo, Face.photo_id == Photo.id).where(Photo.user_id == user_id)
+        staged  = Face.query.filter(Face.id.in_(user_faces), Face.pending_model_version == self.version)
+        dropped = staged.filter(Face.pending_embedding.is_(None)).count()
+        swapped = staged.update(
+            {
+                Face.embedding:             Face.pending_embedding,
+                Face.model_version:         Face.pending_model_version,
+                Face.pending_embedding:     None,
+                Face.pending_model_version: None,
+            },
+            synchronize_session=False,
+        ) - dropped
+        migration.status       = "completed"
+        migration.completed_at = datetime.utcnow()
+        db.session.commit()
+        person_ids = [pid for (pid,) in db.session.query(Person.id).filter(Person.user_id == user_id)]
+        self.service.refresh_prototypes(person_ids)
+        self.service.reset_gallery(user_id)
+        logger.info(
+            f"Embedding migration of user {user_id} to {self.version} completed: "
+            f"{swapped} face(s) re-embedded, {dropped} without a new embedding"
+        )
+        return {"swapped": swapped, "dropped": dropped}
+    def progress(self, user_id: int) -> dict:
+        migration = EmbeddingMigration.query.filter_by(user_id=user_id, model_version=self.version).first()
+        outdated = self._outdated().filter(Photo.user_id == user_id).count()
+        return {
+            "model_version":  self.version,
+            "outdated_faces": outdated,
+            "migration":      migration.to_dict() if migration else None,
+        }
@@ -0,0 +1,90 @@
+"""
+Face Search
+===========
+Ranks a user's photos for one or more query faces.
+Every query face is scored against the face-level gallery in one pass
+(FaceMatcher.faces_within). A photo's score for a query face is its best
+matching stored face; with mode "or" a photo is ranked by its best score
+over the query faces, with mode "and" it must match every query face and
+is ranked by its weakest one. Results are ordered by (score, photo id)
+descending and paged with an opaque cursor holding the last pair seen.
+"""
+import json
+import base64
+import numpy as np
+from models.database import db
+from models.face import Face
+MODES = ("or", "and")
+def encode_cursor(score: float, photo_id: int) -> str:
+    raw = json.dumps({"s": score, "p": photo_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+def decode_cursor(cursor: str) -> tuple:
+    """Return (score, photo_id); raises ValueError for a malformed cursor."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(data["s"]), int(data["p"])
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+def _photo_lookup(face_ids) -> dict:
+    """{face_id: photo_id} for the given face ids, in chunks of 5000 ids."""
+    lookup = {}
+    unique = np.unique(np.asarray(face_ids, dtype=np.int64)).tolist()
+    for start in range(0, len(unique), 5000):
+        chunk = unique[start:start + 5000]
+        lookup.update(db.session.query(Face.id, Face.photo_id).filter(Face.id.in_(chunk)).all())
+    return lookup
+def rank_photos(matcher, queries: list, threshold: float, mode: str = "or") -> list:
+    """
+    Return every matching photo as {"photo_id", "score", "matches"} sorted
+    best first, where matches lists the best stored face per query face.
+    """
+    hits = matcher.faces_within(queries, threshold)
+    lookup = _photo_lookup(np.concatenate([matcher.face_ids[rows] for rows, _ in hits])) if hits else {}
+    per_query = []
+    for qi, (rows, sims) in enumerate(hits):
+        if not len(rows):
+            per_query.append({})
+            continue
+        photos = np.fromiter((lookup.get(int(f), -1) for f in matcher.face_ids[rows]), dtype=np.int64, count=len(rows))
+        order  = np.argsort(-sims, kind="stable")
+        uniq, first = np.unique(photos[order], return_index=True)
+        best = {}
+        for photo_id, pos in zip(uniq.tolist(), first.tolist()):
+            if photo_id < 0:
+                continue
+            row = int(rows[order[pos]])
+            best[photo_id] = {
+                "query":      qi,
+                "face_id":    int(matcher.face_ids[row]),
+                "person_id":  int(matcher.person_ids[row]),
+                "similarity": round(float(sims[order[pos]]), 6),
+            }
+        per_query.append(best)
+    if mode == "and":
+        photo_ids = set(per_query[0]).intersection(*per_query[1:]) if per_query else set()
+    else:
+        photo_ids = set().union(*per_query)
+    combine = min if mode == "and" else max
+    ranked = []
+    for photo_id in photo_ids:
+        matches = [best[photo_id] for best in per_query if photo_id in best]
+        ranked.append({
+            "photo_id": photo_id,
+            "score":    combine(m["similarity"] for m in matches),
+            "matches":  matches,
+        })
+    ranked.sort(key=lambda r: (r["score"], r["photo_id"]), reverse=True)
+    return ranked
+def page_after(ranked: list, cursor: tuple, k: int) -> tuple:
+    """Slice the k results after cursor (None for the first page); returns (page, next_cursor)."""
+    start = 0
+    if cursor is not None:
+        score, photo_id = cursor
+        start = next(
+            (i for i, r in enumerate(ranked) if (r["score"], r["photo_id"]) < (score, photo_id)),
+            len(ranked),
+        )
+    page = ranked[start:start + k]
+    more = start + k < len(ranked)
+    next_cursor = encode_cursor(page[-1]["score"], page[-1]["photo_id"]) if page and more else None
+    return page, next_cursor
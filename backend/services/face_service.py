@@ -7,6 +7,7 @@ All heavy inference is delegated to FaceRecognitionService to avoid duplication.
 import os
 import threading
 import logging
+from datetime import datetime
 from models.database import db
 from models.face import Face
 logger = logging.getLogger(__name__)
@@ -14,45 +15,56 @@ class FaceService:
     @staticmethod
     def detect_and_store_faces(photo_id: int, image_path: str, user_id: int) -> list:
         """
-        Run the full Facenet512/RetinaFace/MTCNN pipeline on *image_path*,
+        Run the single-pass RetinaFace/Facenet512 pipeline on *image_path*,
         store results in the DB, and return the created Face objects.
         Steps
         -----
-        1. detect_and_extract_faces  – RetinaFace detection + Facenet512 embeds
-        2. extract_faces_with_landmarks – MTCNN landmarks (best-effort)
-        3. match_face               – compare against existing DB profiles
-        4. auto_create_person       – create Unknown Person if no match
-        5. Persist Face records     – bounding box, embedding, landmarks, confidence
+        1. detect_and_extract_faces  – RetinaFace boxes + landmarks, aligned Facenet512 embeds
+        2. match_photo_faces        – score all faces at once, assign jointly (one face per person)
+        3. auto_create_persons      – create Unknown Persons for the unmatched faces in one flush
+        4. Persist Face records     – bounding box, embedding, landmarks, confidence, aligned crop
         """
+        from models.photo import Photo
+        from services.face_crops import store_crops
         from services.face_recognition import FaceRecognitionService
-        service = FaceRecognitionService()
+        service = FaceRecognitionService.instance()
         faces_data = service.detect_and_extract_faces(image_path)
         if not faces_data:
             logger.info(f"No faces found in photo {photo_id} at {image_path}")
+            photo = db.session.get(Photo, photo_id)
+            if photo:
+                photo.faces_processed_at = datetime.utcnow()
+                db.session.commit()
+                FaceService.copy_to_waiting_duplicates(photo)
             return []
-        landmark_data = service.extract_faces_with_landmarks(image_path)
-        landmark_map = {}  
-        for idx, lm in enumerate(landmark_data):
-            landmark_map[idx] = lm.get("landmarks", {})
         faces_created = []
         try:
+            candidates = []
+            rejected   = []
+            crops      = []
             for idx, face_info in enumerate(faces_data):
+                if face_info.get("rejected"):
+                    rejected.append(FaceService.rejected_face(photo_id, face_info))
+                    continue
+                if not face_info.get("embedding"):
+                    logger.warning(f"Empty embedding for face #{idx} in photo {photo_id} — skipping")
+                    continue
+                candidates.append((idx, face_info))
+            matches = service.match_photo_faces([f["embedding"] for _, f in candidates], user_id)
+            unknown = iter(service.auto_create_persons(user_id, sum(1 for p, _ in matches if p is None)))
+            for (idx, face_info), (matched_person, scores) in zip(candidates, matches):
                 embedding    = face_info.get("embedding")
                 facial_area  = face_info.get("facial_area", {})
                 confidence   = face_info.get("face_confidence", face_info.get("confidence", 0.0))
-                landmarks    = landmark_map.get(idx, {})
+                landmarks    = face_info.get("landmarks", {})
                 bbox = [
                     facial_area.get("x", 0),
                     facial_area.get("y", 0),
                     facial_area.get("w", 0),
                     facial_area.get("h", 0),
                 ]
-                if not embedding:
-                    logger.warning(f"Empty embedding for face #{idx} in photo {photo_id} — skipping")
-                    continue
-                matched_person, scores = service.match_face(embedding, user_id)
                 if matched_person is None:
-                    matched_person = service.auto_create_person(user_id)
+                    matched_person = next(unknown)
                 face = Face(
                     photo_id      = photo_id,
                     person_id     = matched_person.id,
@@ -64,11 +76,19 @@ class FaceService:
                 )
                 db.session.add(face)
                 faces_created.append(face)
+                crops.append(face_info.get("face"))
+            db.session.add_all(rejected)
+            photo = db.session.get(Photo, photo_id)
+            if photo:
+                photo.faces_processed_at = datetime.utcnow()
             db.session.commit()
-            service.invalidate_cache(user_id)
+            store_crops(faces_created, crops, user_id)
+            service.cache_new_faces(user_id, faces_created)
+            if photo:
+                FaceService.copy_to_waiting_duplicates(photo)
             logger.info(
                 f"Stored {len(faces_created)} face(s) for photo {photo_id} "
-                f"(user {user_id})"
+                f"(user {user_id}), {len(rejected)} skipped by the quality gate"
             )
         except Exception as exc:
             db.session.rollback()
@@ -82,5 +102,72 @@ class FaceService:
         process_photo_faces.delay(photo_id)
         logger.info(f"Celery task queued for photo {photo_id}")
     @staticmethod
+    def copy_faces(source_photo, target_photo) -> list:
+        """
+        Reuse the stored face results of source_photo for target_photo (an
+        identical upload) instead of running inference again. Returns the
+        new Face rows; empty when the source has no faces yet.
+        """
+        from services.face_crops import commit_crop_paths, copy_crop
+        from services.face_recognition import FaceRecognitionService
+        originals = Face.query.filter_by(photo_id=source_photo.id).all()
+        copies = [
+            Face(
+                photo_id        = target_photo.id,
+                person_id       = face.person_id,
+                bounding_box    = face.bounding_box,
+                embedding       = face.embedding,
+                landmarks       = face.landmarks,
+                confidence      = face.confidence,
+                model_version   = face.model_version,
+                rejected_reason = face.rejected_reason,
+                quality         = face.quality,
+            )
+            for face in originals
+        ]
+        target_photo.faces_processed_at = datetime.utcnow()
+        db.session.add_all(copies)
+        db.session.commit()
+        if not copies:
+            return []
+        for face, copy in zip(originals, copies):
+            copy.crop_path = copy_crop(face, copy, target_photo.user_id)
+        if any(copy.crop_path for copy in copies):
+            commit_crop_paths(copies)
+        FaceRecognitionService.instance().cache_new_faces(target_photo.user_id, copies)
+        logger.info(f"Reused {len(copies)} face(s) of photo {source_photo.id} for duplicate photo {target_photo.id}")
+        return copies
+    @staticmethod
+    def copy_to_waiting_duplicates(photo) -> dict:
+        """
+        Give the exact duplicates of photo that were uploaded while it was
+        still being processed its face results. Returns {duplicate id: copied faces}.
+        """
+        from models.photo import Photo
+        if not photo.content_hash:
+            return {}
+        waiting = Photo.query.filter(
+            Photo.user_id == photo.user_id,
+            Photo.content_hash == photo.content_hash,
+            Photo.id != photo.id,
+            Photo.faces_processed_at.is_(None),
+        ).all()
+        return {duplicate.id: FaceService.copy_faces(photo, duplicate) for duplicate in waiting}
+    @staticmethod
+    def rejected_face(photo_id: int, face_info: dict) -> Face:
+        """Face row for a detection the quality gate skipped: box and metrics only, no embedding or person."""
+        from services.face_recognition import FaceRecognitionService
+        facial_area = face_info.get("facial_area", {})
+        return Face(
+            photo_id        = photo_id,
+            person_id       = None,
+            bounding_box    = [facial_area.get(k, 0) for k in ("x", "y", "w", "h")],
+            landmarks       = face_info.get("landmarks", {}),
+            confidence      = float(face_info.get("confidence", 0.0)),
+            model_version   = FaceRecognitionService.MODEL_VERSION,
+            rejected_reason = face_info["rejected"],
+            quality         = face_info.get("quality"),
+        )
+    @staticmethod
     def get_faces_for_photo(photo_id: int) -> list:
         return Face.query.filter_by(photo_id=photo_id).all()
\ No newline at end of file
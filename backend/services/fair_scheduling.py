@@ -0,0 +1,47 @@
+"""
+Fair Scheduling
+===============
+Per-user fair share on the bulk queue. Every user's queued bulk batches are
+counted in Redis, and each new batch is sent with priority
+min(9, batches already queued for the user // BULK_FAIR_SHARE); the Redis
+transport serves priority 0 first. The first BULK_FAIR_SHARE batches of any
+user therefore overtake the tail of another user's large import, so one
+tenant's 5,000-photo import cannot hold every other upload behind it.
+Bulk workers prefetch one task at a time and acknowledge late, so the
+priorities are applied each time a worker becomes free.
+Without Redis the priorities only spread one upload's own batches.
+"""
+import logging
+from config import Config
+from services.redis_service import RedisService
+logger = logging.getLogger(__name__)
+BACKLOG_KEY  = "drishyamitra:bulk_backlog:{}"
+BACKLOG_TTL  = 86400   # a crashed worker's slots are forgotten after a day
+MAX_PRIORITY = 9
+def reserve(user_id, count: int) -> list:
+    """Count count new batches of user_id as queued; returns one priority per batch."""
+    queued = 0
+    client = RedisService.get_client()
+    if client is not None:
+        try:
+            key = BACKLOG_KEY.format(user_id)
+            pipe = client.pipeline()
+            pipe.incrby(key, count)
+            pipe.expire(key, BACKLOG_TTL)
+            queued = int(pipe.execute()[0]) - count
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    share = max(Config.BULK_FAIR_SHARE, 1)
+    queued = max(queued, 0)
+    return [min(MAX_PRIORITY, (queued + i) // share) for i in range(count)]
+def release(user_id, count: int = 1) -> None:
+    """Mark count batches of user_id as done."""
+    client = RedisService.get_client()
+    if client is None:
+        return
+    try:
+        key = BACKLOG_KEY.format(user_id)
+        if int(client.decrby(key, count)) <= 0:
+            client.delete(key)
+    except Exception as exc:
+        RedisService.mark_unavailable(exc)
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+Image Preprocessing
+===================
+Decode-once stage in front of the face pipeline.
+Each upload is decoded a single time with EXIF orientation applied. Large
+JPEGs use Pillow's draft mode so the DCT decoder itself skips resolution
+we would throw away. The stage yields:
+    pixels        – working-resolution BGR array; face crops are cut from it
+    detect_pixels – a copy capped at FACE_DETECT_MAX_SIDE for RetinaFace
+Coordinates found on detect_pixels are mapped back with detect_scale (to
+pixels) and source_scale (to the oriented original), so stored boxes and
+landmarks always refer to the image the user sees.
+"""
+import io
+import logging
+import numpy as np
+from config import Config
+logger = logging.getLogger(__name__)
+class DecodedImage:
+    __slots__ = ("pixels", "detect_pixels", "detect_scale", "source_scale", "source_size", "name")
+    def __init__(self, pixels: np.ndarray, source_size: tuple, name: str = "<array>", detect_max_side: int = None):
+        import cv2
+        self.pixels      = pixels
+        self.source_size = source_size
+        self.name        = name
+        height, width    = pixels.shape[:2]
+        self.source_scale = max(source_size) / max(width, height)
+        detect_max_side = detect_max_side or Config.FACE_DETECT_MAX_SIDE
+        longest = max(width, height)
+        if longest > detect_max_side:
+            factor = detect_max_side / longest
+            self.detect_pixels = cv2.resize(
+                pixels, (max(1, round(width * factor)), max(1, round(height * factor))),
+                interpolation=cv2.INTER_AREA,
+            )
+            self.detect_scale = 1.0 / factor
+        else:
+            self.detect_pixels = pixels
+            self.detect_scale  = 1.0
+    @property
+    def shape(self) -> tuple:
+        return self.pixels.shape
+def decode_image(source, max_side: int = None, detect_max_side: int = None) -> DecodedImage:
+    """
+    Decode a path, bytes or file-like object once, or wrap an already
+    decoded BGR ndarray (or DecodedImage) without touching its pixels.
+    """
+    if isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, np.ndarray):
+        return DecodedImage(source, (source.shape[1], source.shape[0]), detect_max_side=detect_max_side)
+    from PIL import Image, ImageOps
+    max_side = max_side or Config.FACE_DECODE_MAX_SIDE
+    name = source if isinstance(source, str) else "<stream>"
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as im:
+        width, height = im.size
+        if im.format == "JPEG" and max(width, height) > max_side:
+            factor = max_side / max(width, height)
+            im.draft("RGB", (int(width * factor), int(height * factor)))
+        oriented = ImageOps.exif_transpose(im)
+        if oriented.size == (im.size[1], im.size[0]) and im.size[0] != im.size[1]:
+            width, height = height, width
+        rgb = oriented.convert("RGB")
+    if max(rgb.size) > max_side:
+        rgb.thumbnail((max_side, max_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pixels = np.ascontiguousarray(np.asarray(rgb)[:, :, ::-1])
+    logger.debug(f"Decoded {name}: source {width}x{height} → working {pixels.shape[1]}x{pixels.shape[0]}")
+    return DecodedImage(pixels, (width, height), name=name, detect_max_side=detect_max_side)
+def perceptual_hash(source) -> str:
+    """
+    64-bit difference hash (dHash) as 16 hex digits. Resized or recompressed
+    copies of an image land within a few bits of each other.
+    """
+    from PIL import Image
+    if isinstance(source, DecodedImage):
+        source = source.detect_pixels
+    if isinstance(source, np.ndarray):
+        image = Image.fromarray(np.ascontiguousarray(source[:, :, ::-1]))
+    else:
+        with Image.open(source) as im:
+            im.draft("L", (64, 64))
+            image = im.convert("L")
+    small = np.asarray(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+def hamming_distances(hashes, target: str) -> np.ndarray:
+    """Bit distance between target and every 16-hex-digit hash in hashes."""
+    if not len(hashes):
+        return np.zeros(0, dtype=np.int64)
+    values = np.array([int(h, 16) for h in hashes], dtype=np.uint64) ^ np.uint64(int(target, 16))
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1).astype(np.int64)
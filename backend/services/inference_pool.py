@@ -0,0 +1,187 @@
+"""
+Inference Pool
+==============
+Optional process-pool execution mode for face inference on CPU-only hosts.
+Each pool process owns a warm FaceRecognitionService with its own
+TensorFlow intra-/inter-op thread budget, so inference scales past one
+core's worth of Python. Decoded images are handed to the pool through
+shared memory, and embeddings and aligned crops come back the same way;
+only small per-face metadata is pickled.
+Enabled with FACE_INFERENCE_MODE=process. Pool processes are started with
+the "spawn" method because TensorFlow is not fork-safe; run the Celery
+worker with a solo or threads pool when using this mode.
+"""
+import time
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+from config import Config
+logger = logging.getLogger(__name__)
+def configure_tf_threads(intra: int, inter: int) -> None:
+    """Apply TensorFlow thread limits; must run before the TF runtime starts. 0 keeps TF's default."""
+    if not intra and not inter:
+        return
+    import tensorflow as tf
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as exc:
+        logger.warning(f"TensorFlow thread limits not applied (runtime already initialised): {exc}")
+def _share(array: np.ndarray, track: bool = True) -> dict:
+    """Copy array into a new shared-memory block and return a picklable descriptor."""
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    if not track:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return {"name": shm.name, "shape": array.shape, "dtype": array.dtype.str}
+def _take(desc: dict, unlink: bool) -> np.ndarray:
+    """Copy a shared block out into process-local memory, optionally freeing it."""
+    shm = shared_memory.SharedMemory(name=desc["name"])
+    try:
+        return np.ndarray(desc["shape"], dtype=np.dtype(desc["dtype"]), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+def _unlink(name: str) -> None:
+    """Free a shared block by name if it still exists."""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+def _init_worker(intra: int, inter: int) -> None:
+    configure_tf_threads(intra, inter)
+    from services.face_recognition import FaceRecognitionService
+    FaceRecognitionService.instance().warm_up()
+def _analyze_shared(image_descs: list) -> list:
+    """
+    Pool-side entry point. Reads each image straight from shared memory,
+    runs the local batched pipeline and publishes embeddings and crops as
+    new shared blocks owned (and unlinked) by the parent.
+    """
+    from services.face_recognition import FaceRecognitionService
+    from services.image_preprocessing import DecodedImage
+    service = FaceRecognitionService.instance()
+    images, handles = [], []
+    for desc in image_descs:
+        shm = shared_memory.SharedMemory(name=desc["name"])
+        handles.append(shm)
+        pixels = np.ndarray(desc["shape"], dtype=np.dtype(desc["dtype"]), buffer=shm.buf)
+        images.append(DecodedImage(pixels, tuple(desc["source_size"]), name=desc["source_name"]))
+    try:
+        per_image = service._analyze_batch_local(images)
+    finally:
+        del images
+        for shm in handles:
+            shm.close()
+    results = []
+    for faces in per_image:
+        has_vector = [f.get("embedding") is not None for f in faces]
+        vectors = [f.pop("embedding") for f in faces if f.get("embedding") is not None]
+        crops = [f.pop("face") for f in faces]
+        for face in faces:
+            face.pop("embedding", None)
+        matrix = np.asarray(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+        flat = np.concatenate([c.reshape(-1) for c in crops]) if crops else np.zeros(0, dtype=np.uint8)
+        results.append({
+            "faces":       faces,
+            "has_vector":  has_vector,
+            "embeddings":  _share(matrix, track=False),
+            "crops":       _share(flat.astype(np.uint8), track=False),
+            "crop_shapes": [c.shape for c in crops],
+        })
+    return results
+class InferencePool:
+    """Process pool of warm inference workers with shared-memory I/O."""
+    _instance = None
+    _lock = threading.Lock()
+    def __init__(self, processes: int, intra: int, inter: int):
+        self.processes = processes
+        ctx = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(intra, inter),
+        )
+        logger.info(f"Inference pool started: {processes} process(es), intra={intra} inter={inter}")
+    @classmethod
+    def get(cls) -> "InferencePool":
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(
+                        Config.FACE_INFERENCE_PROCESSES,
+                        Config.TF_INTRA_OP_THREADS,
+                        Config.TF_INTER_OP_THREADS,
+                    )
+        return cls._instance
+    @classmethod
+    def reset(cls, broken: "InferencePool") -> None:
+        """Drop a pool whose processes died (BrokenProcessPool) so the next get() starts a fresh one."""
+        with cls._lock:
+            if cls._instance is broken:
+                cls._instance = None
+        broken._executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Inference pool broken (a worker process died); it will be restarted")
+    def analyze(self, images: list) -> list:
+        """
+        Run analyze_batch semantics across the pool. images are DecodedImage
+        objects; only their working pixels cross the process boundary, along
+        with the source size so coordinates still map to the original image.
+        The batch is split into one chunk per process.
+        """
+        if not images:
+            return []
+        t0 = time.time()
+        descs = [
+            dict(_share(img.pixels), source_size=img.source_size, source_name=img.name)
+            for img in images
+        ]
+        chunk = -(-len(descs) // self.processes)
+        items, per_image = [], []
+        try:
+            futures = [
+                self._executor.submit(_analyze_shared, descs[start:start + chunk])
+                for start in range(0, len(descs), chunk)
+            ]
+            # Wait for every chunk, so the result blocks of all of them are freed even if one fails.
+            wait(futures)
+            error = None
+            for future in futures:
+                try:
+                    items.extend(future.result())
+                except Exception as exc:
+                    error = error or exc
+            if error is not None:
+                raise error
+            for item in items:
+                vectors = _take(item["embeddings"], unlink=True)
+                flat    = _take(item["crops"], unlink=True)
+                offset, rows = 0, iter(vectors)
+                for face, shape, has_vector in zip(item["faces"], item["crop_shapes"], item["has_vector"]):
+                    size = int(np.prod(shape))
+                    face["face"] = flat[offset:offset + size].reshape(shape)
+                    offset += size
+                    face["embedding"] = next(rows).tolist() if has_vector else None
+                per_image.append(item["faces"])
+        finally:
+            for desc in descs:
+                _unlink(desc["name"])
+            for item in items:
+                _unlink(item["embeddings"]["name"])
+                _unlink(item["crops"]["name"])
+        logger.info(
+            f"Inference pool analysed {len(images)} image(s) in {len(futures)} chunk(s) "
+            f"[{time.time() - t0:.2f}s]"
+        )
+        return per_image
@@ -0,0 +1,141 @@
+"""
+Person Prototypes
+=================
+Compact per-person representatives used as the first matching tier.
+Each Person keeps a running centroid of its unit-length embeddings plus up
+to k diverse exemplars (farthest-point selection), stored in
+person_prototypes and tagged with the MODEL_VERSION they were built from.
+Queries whose prototype scores are decisive – clearly inside the threshold
+with a margin over the runner-up, or clearly outside it – are answered
+from the prototypes alone; the rest fall back to the full face gallery.
+"""
+import logging
+import numpy as np
+from sqlalchemy import func, type_coerce
+from models.database import db, decode_embeddings
+from models.face import Face
+from models.person import Person
+from models.person_prototype import PersonPrototype
+from services.face_matcher import FaceMatcher
+logger = logging.getLogger(__name__)
+def select_exemplars(unit: np.ndarray, k: int) -> np.ndarray:
+    """
+    Farthest-point selection over unit vectors: start from the row closest
+    to the centroid, then repeatedly add the row least similar to every
+    row picked so far. Returns row indices.
+    """
+    if len(unit) <= k:
+        return np.arange(len(unit))
+    centre = unit.mean(axis=0)
+    chosen = [int(np.argmax(unit @ centre))]
+    closest = unit @ unit[chosen[0]]
+    for _ in range(k - 1):
+        closest[chosen] = np.inf
+        pick = int(np.argmin(closest))
+        chosen.append(pick)
+        closest = np.maximum(closest, unit @ unit[pick])
+    return np.array(chosen, dtype=np.int64)
+class PrototypeService:
+    def __init__(self, dim: int, exemplars: int, model_version: str):
+        self.dim           = dim
+        self.exemplars     = exemplars
+        self.model_version = model_version
+    def _person_embeddings(self, person_id: int) -> tuple:
+        raw_embedding = type_coerce(Face.embedding, db.LargeBinary).label("embedding")
+        rows = (
+            db.session.query(Face.id, raw_embedding)
+            .filter(Face.person_id == person_id, Face.embedding.isnot(None))
+            .order_by(Face.id)
+            .all()
+        )
+        return [r.id for r in rows], decode_embeddings([bytes(r.embedding) for r in rows])
+    def _fill(self, proto: PersonPrototype, face_ids: list, vectors: np.ndarray, centroid: np.ndarray, count: int) -> None:
+        unit, _ = FaceMatcher.normalize(vectors)
+        picked = select_exemplars(unit, self.exemplars)
+        proto.model_version = self.model_version
+        proto.face_count    = count
+        proto.centroid      = centroid
+        proto.exemplars     = vectors[picked].reshape(-1)
+        proto.exemplar_ids  = [int(face_ids[i]) for i in picked]
+    def rebuild(self, person_ids) -> None:
+        """Recompute the prototypes of person_ids from their stored faces (caller commits)."""
+        for person_id in {int(p) for p in person_ids if p is not None}:
+            proto = db.session.get(PersonPrototype, person_id)
+            face_ids, vectors = self._person_embeddings(person_id)
+            if not face_ids or db.session.get(Person, person_id) is None:
+                if proto is not None:
+                    db.session.delete(proto)
+                continue
+            if proto is None:
+                proto = PersonPrototype(person_id=person_id)
+                db.session.add(proto)
+            unit, _ = FaceMatcher.normalize(vectors)
+            self._fill(proto, face_ids, vectors, unit.mean(axis=0), len(face_ids))
+    def add_faces(self, faces: list) -> None:
+        """
+        Fold newly stored Face rows into their persons' prototypes: the
+        centroid is updated as a running mean and the exemplars are
+        re-selected among the old exemplars plus the new faces.
+        """
+        by_person = {}
+        for face in faces:
+            if face.embedding is not None and face.person_id is not None:
+                by_person.setdefault(face.person_id, []).append(face)
+        for person_id, new_faces in by_person.items():
+            proto = db.session.get(PersonPrototype, person_id)
+            if proto is None or proto.model_version != self.model_version or proto.centroid is None:
+                self.rebuild([person_id])
+                continue
+            vectors = np.asarray([f.embedding for f in new_faces], dtype=np.float32)
+            unit, _ = FaceMatcher.normalize(vectors)
+            count    = proto.face_count + len(new_faces)
+            centroid = (proto.centroid * proto.face_count + unit.sum(axis=0)) / count
+            pool_ids = list(proto.exemplar_ids or []) + [f.id for f in new_faces]
+            pool     = np.concatenate([proto.exemplar_matrix(self.dim), vectors])
+            self._fill(proto, pool_ids, pool, centroid, count)
+        if by_person:
+            db.session.commit()
+    def current(self, user_id: int) -> dict:
+        """
+        Return {person_id: PersonPrototype} for user_id. Prototypes that are
+        missing, out of date with MODEL_VERSION, or whose face count drifted
+        from the DB are rebuilt first.
+        """
+        counts = dict(
+            db.session.query(Face.person_id, func.count(Face.id))
+            .join(Person, Face.person_id == Person.id)
+            .filter(Person.user_id == user_id, Face.embedding.isnot(None))
+            .group_by(Face.person_id)
+            .all()
+        )
+        query = PersonPrototype.query.join(Person, PersonPrototype.person_id == Person.id).filter(Person.user_id == user_id)
+        protos = {p.person_id: p for p in query.all()}
+        stale = [
+            pid for pid, count in counts.items()
+            if pid not in protos
+            or protos[pid].model_version != self.model_version
+            or protos[pid].face_count != count
+        ] + [pid for pid in protos if pid not in counts]
+        if stale:
+            self.rebuild(stale)
+            db.session.commit()
+            logger.info(f"Rebuilt {len(stale)} person prototype(s) for user {user_id}")
+            protos = {p.person_id: p for p in query.all()}
+        return protos
+    def load_matcher(self, user_id: int) -> FaceMatcher:
+        """Build a FaceMatcher over every prototype of user_id (one centroid row plus the exemplar rows per person)."""
+        protos = self.current(user_id)
+        face_ids, person_ids, rows = [], [], []
+        for pid, proto in protos.items():
+            exemplars = proto.exemplar_matrix(self.dim)
+            if exemplars is None or not len(exemplars):
+                continue
+            # The centroid row carries the mean exemplar norm so Euclidean scores stay on the usual scale.
+            direction, _ = FaceMatcher.normalize(proto.centroid)
+            scale = float(np.linalg.norm(exemplars, axis=1).mean())
+            rows.append(direction * scale)
+            rows.append(exemplars)
+            face_ids   += [proto.exemplar_ids[0]] + list(proto.exemplar_ids)
+            person_ids += [pid] * (len(exemplars) + 1)
+        matrix = np.concatenate(rows) if rows else np.zeros((0, self.dim), dtype=np.float32)
+        return FaceMatcher(face_ids, person_ids, matrix)
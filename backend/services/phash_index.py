@@ -0,0 +1,145 @@
+"""
+Perceptual Hash Index
+=====================
+Per-user BK-trees over Photo.phash (64-bit dHash) for near-duplicate and
+burst-shot lookups. A BK-tree search for radius r only descends into
+children whose edge distance lies within r of the query's distance to the
+node, so lookups touch a small part of the library instead of every hash.
+Trees live in each process and are built lazily from the DB. Before every
+query the tree pulls in photos above its id watermark, so uploads handled
+by other processes are picked up; deleted photos are filtered out by the
+callers when they load the Photo rows.
+Face results are only reused from a sibling with the same pixel
+dimensions: dHash ignores scale, but stored boxes and landmarks do not.
+"""
+import logging
+import threading
+from models.database import db
+from models.photo import Photo
+logger = logging.getLogger(__name__)
+def _distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+class BKTree:
+    """BK-tree keyed by 64-bit integers; each node keeps every id sharing its hash."""
+    __slots__ = ("root", "size")
+    def __init__(self):
+        self.root = None   # [hash, [ids], {distance: child}]
+        self.size = 0
+    def add(self, value: int, item_id: int) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item_id], {}]
+            return
+        node = self.root
+        while True:
+            d = _distance(value, node[0])
+            if d == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item_id], {}]
+                return
+            node = child
+    def search(self, value: int, radius: int) -> list:
+        """Return (item_id, distance) for every id within radius bits of value."""
+        if self.root is None:
+            return []
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = _distance(value, node[0])
+            if d <= radius:
+                found.extend((item_id, d) for item_id in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
+class PhashIndex:
+    def __init__(self):
+        self._trees: dict = {}    # user_id -> (BKTree, last photo id seen)
+        self._lock = threading.Lock()
+    def _sync(self, user_id: int) -> BKTree:
+        with self._lock:
+            tree, last_id = self._trees.get(user_id, (None, 0))
+        rows = (
+            db.session.query(Photo.id, Photo.phash)
+            .filter(Photo.user_id == user_id, Photo.phash.isnot(None), Photo.id > last_id)
+            .order_by(Photo.id)
+            .all()
+        )
+        with self._lock:
+            tree, last_id = self._trees.get(user_id, (BKTree(), 0))
+            for photo_id, phash in rows:
+                if photo_id > last_id:
+                    tree.add(int(phash, 16), photo_id)
+                    last_id = photo_id
+            self._trees[user_id] = (tree, last_id)
+        if len(rows) > 1:
+            logger.debug(f"Perceptual hash index for user {user_id}: added {len(rows)} photo(s), {tree.size} total")
+        return tree
+    def add(self, photo) -> None:
+        """Insert a freshly committed photo (no-op without a phash; later photos sync from the DB anyway)."""
+        if photo.phash:
+            self._sync(photo.user_id)
+    def similar(self, user_id: int, phash: str, max_distance: int, exclude: int = None) -> list:
+        """(photo_id, distance) of the user's photos within max_distance bits, closest first."""
+        tree = self._sync(user_id)
+        with self._lock:
+            hits = tree.search(int(phash, 16), max_distance)
+        return sorted(((pid, d) for pid, d in hits if pid != exclude), key=lambda hit: (hit[1], hit[0]))
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._trees.pop(user_id, None)
+phash_index = PhashIndex()
+def image_size(path: str):
+    """(width, height) from the image header, or None when it cannot be read."""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None
+def reusable_sibling(photo, max_distance: int):
+    """
+    Closest other photo of the user within max_distance bits that has the
+    same dimensions and stored face results, or None.
+    """
+    from models.face import Face
+    if not photo.phash:
+        return None
+    hits = phash_index.similar(photo.user_id, photo.phash, max_distance, exclude=photo.id)
+    if not hits:
+        return None
+    with_faces = {
+        photo_id for (photo_id,) in
+        db.session.query(Face.photo_id).filter(Face.photo_id.in_([pid for pid, _ in hits])).distinct()
+    }
+    size = image_size(photo.filepath)
+    for photo_id, _ in hits:
+        if photo_id not in with_faces:
+            continue
+        sibling = db.session.get(Photo, photo_id)
+        if sibling and sibling.user_id == photo.user_id and size and image_size(sibling.filepath) == size:
+            return sibling
+    return None
+def group_near_duplicates(photos: list, max_distance: int, sizes: list = None) -> dict:
+    """
+    Group photos (in order) whose phash lies within max_distance of an
+    earlier photo's with the same size (sizes is parallel to photos).
+    Returns {representative photo id: [member photos]}; photos without a
+    phash or a known size represent only themselves.
+    """
+    trees, groups = {}, {}
+    sizes = sizes or [None] * len(photos)
+    for photo, size in zip(photos, sizes):
+        if photo.phash and size:
+            tree = trees.setdefault(size, BKTree())
+            hits = tree.search(int(photo.phash, 16), max_distance)
+            if hits:
+                rep = min(hits, key=lambda hit: (hit[1], hit[0]))[0]
+                groups[rep].append(photo)
+                continue
+            tree.add(int(photo.phash, 16), photo.id)
+        groups[photo.id] = []
+    return groups
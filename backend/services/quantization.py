@@ -0,0 +1,181 @@
+"""
+Gallery Quantization
+====================
+int8 scalar quantization of in-memory face galleries.
+Each unit-length row is stored as 512 int8 codes plus one float32 scale
+(≈ 0.52 KB instead of 2 KB per face). A query is scored against the codes
+block by block to shortlist the rescore_top most similar rows, which are
+then re-scored exactly against their float32 vectors – read from the
+mmapped embedding shards when available, otherwise fetched from the DB –
+so threshold decisions and reported scores come from exact similarities.
+"""
+import logging
+import numpy as np
+from services.face_matcher import FaceMatcher, _no_match
+logger = logging.getLogger(__name__)
+def quantize_int8(unit: np.ndarray) -> tuple:
+    """Symmetric per-row int8 codes: row ≈ codes * scale. Returns (codes, scales)."""
+    unit = np.asarray(unit, dtype=np.float32)
+    if not len(unit):
+        return np.zeros(unit.shape, dtype=np.int8), np.zeros(0, dtype=np.float32)
+    peak   = np.abs(unit).max(axis=1)
+    scales = (np.where(peak > 0, peak, 1.0) / 127.0).astype(np.float32)
+    codes  = np.rint(unit / scales[:, None]).clip(-127, 127).astype(np.int8)
+    return codes, scales
+class QuantizedMatcher(FaceMatcher):
+    """
+    FaceMatcher whose resident gallery is int8 codes. Exact vectors are
+    read on demand from exact (a row-aligned float32 array, typically an
+    mmap; exact_index maps matcher rows to its rows) or, failing that,
+    from fetch(face_ids) → unit float32 rows in the same order.
+    """
+    BLOCK_ROWS   = 65536
+    APPROX_SLACK = 0.02   # well above the int8 similarity error of unit vectors
+    def __init__(self, face_ids, person_ids, codes, scales, norms, fetch,
+                 exact=None, exact_index=None, rescore_top: int = 64):
+        self.codes       = np.ascontiguousarray(codes, dtype=np.int8)
+        self.scales      = np.asarray(scales, dtype=np.float32)
+        self.fetch       = fetch
+        self.exact       = exact
+        self.exact_index = exact_index
+        self.rescore_top = rescore_top
+        super().__init__(face_ids, person_ids, np.zeros((len(self.codes), 0), dtype=np.float32),
+                         norms=norms, normalized=True)
+    @classmethod
+    def from_unit(cls, face_ids, person_ids, unit, norms, fetch, exact=None, exact_index=None,
+                  rescore_top: int = 64) -> "QuantizedMatcher":
+        """Quantize unit-length rows; unit itself is not kept unless passed again as exact."""
+        codes, scales = quantize_int8(unit)
+        return cls(face_ids, person_ids, codes, scales, norms, fetch,
+                   exact=exact, exact_index=exact_index, rescore_top=rescore_top)
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+    @property
+    def nbytes(self) -> int:
+        return (self.codes.nbytes + self.scales.nbytes + self.norms.nbytes
+                + self.face_ids.nbytes + self.person_ids.nbytes + self._order.nbytes)
+    def vectors(self, rows=None) -> np.ndarray:
+        """Exact unit float32 rows (all rows when rows is None)."""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.exact is not None:
+            source_rows = self.exact_index[rows] if self.exact_index is not None else rows
+            return np.asarray(self.exact[source_rows], dtype=np.float32)
+        return np.asarray(self.fetch(self.face_ids[rows]), dtype=np.float32).reshape(len(rows), self.dim)
+    def approximate_similarities(self, q: np.ndarray) -> np.ndarray:
+        """Cosine similarities of unit queries q against the int8 codes, shape (Q, N)."""
+        out = np.empty((len(q), len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.BLOCK_ROWS):
+            block = slice(start, start + self.BLOCK_ROWS)
+            out[:, block] = (q @ self.codes[block].astype(np.float32).T) * self.scales[block]
+        return out
+    def similarities(self, queries) -> np.ndarray:
+        q, _ = self.normalize(queries)
+        return self.approximate_similarities(q)
+    def shortlist(self, q: np.ndarray, top_k: int = 5) -> list:
+        """
+        Rows worth re-scoring exactly for every unit query: the rescore_top
+        closest rows overall plus the closest row of each of the top_k
+        closest persons, so the candidate list keeps its runner-up persons.
+        """
+        approx = self.approximate_similarities(q)
+        k = min(self.rescore_top, len(self))
+        top = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+        person = self.person_similarities(approx)
+        p = min(top_k, person.shape[1])
+        shortlists = []
+        for qi in range(len(q)):
+            best_persons = np.argpartition(-person[qi], p - 1)[:p] if p else []
+            extra = [self._best_face_of_person(approx[qi], int(pi)) for pi in best_persons]
+            shortlists.append(np.union1d(top[qi], np.asarray(extra, dtype=np.int64)))
+        return shortlists
+    def match_candidates(self, queries, candidate_rows: list, threshold: float, top_k: int = 5) -> list:
+        """Exact re-ranking of per-query shortlists; the exact vectors of all shortlists are read in one go."""
+        rows_per_query = [np.asarray(rows, dtype=np.int64) for rows in candidate_rows]
+        union = np.unique(np.concatenate(rows_per_query)) if rows_per_query else np.zeros(0, dtype=np.int64)
+        rescorer = FaceMatcher(self.face_ids[union], self.person_ids[union], self.vectors(union),
+                               norms=self.norms[union], normalized=True)
+        local = [np.searchsorted(union, rows) for rows in rows_per_query]
+        return rescorer.match_candidates(queries, local, threshold, top_k=top_k)
+    def faces_within(self, queries, threshold: float) -> list:
+        """Rows within threshold by the int8 scores (plus APPROX_SLACK), confirmed with exact similarities."""
+        q, _ = self.normalize(queries)
+        if not len(self) or q.shape[1] != self.dim:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(len(q))]
+        approx = self.approximate_similarities(q)
+        candidates = [np.flatnonzero(1.0 - row < threshold + self.APPROX_SLACK) for row in approx]
+        union = np.unique(np.concatenate(candidates))
+        exact = self.vectors(union)
+        out = []
+        for qi, rows in enumerate(candidates):
+            sims = exact[np.searchsorted(union, rows)] @ q[qi]
+            keep = 1.0 - sims < threshold
+            out.append((rows[keep], sims[keep]))
+        return out
+    def match(self, queries, threshold: float, top_k: int = 5) -> list:
+        q, _ = self.normalize(queries)
+        if not len(self) or q.shape[1] != self.dim:
+            return [_no_match([]) for _ in range(len(q))]
+        return self.match_candidates(queries, self.shortlist(q, top_k), threshold, top_k=top_k)
+    def extended(self, face_ids, person_ids, embeddings) -> "QuantizedMatcher":
+        new_faces = FaceMatcher(face_ids, person_ids, embeddings)
+        if not len(new_faces):
+            return self
+        codes, scales = quantize_int8(new_faces.matrix)
+        # Exact vectors of the new rows are not in the shard copy, so fall back to fetch for everything.
+        return QuantizedMatcher(
+            np.concatenate([self.face_ids, new_faces.face_ids]),
+            np.concatenate([self.person_ids, new_faces.person_ids]),
+            np.concatenate([self.codes, codes]) if len(self) else codes,
+            np.concatenate([self.scales, scales]),
+            np.concatenate([self.norms, new_faces.norms]),
+            self.fetch,
+            rescore_top=self.rescore_top,
+        )
+def evaluate_quantization(face_ids, person_ids, unit: np.ndarray, threshold: float,
+                          sample: int = 200, rescore_top: int = 64, seed: int = 0) -> dict:
+    """
+    Hold out up to sample faces as queries and match them against the rest
+    of the gallery with the float32 matcher, the int8 codes alone, and the
+    int8 shortlist with exact re-scoring. Reports memory and how often the
+    quantized decisions (matched person, or no match, at threshold) agree
+    with the float32 ones.
+    """
+    face_ids   = np.asarray(face_ids, dtype=np.int64)
+    person_ids = np.asarray(person_ids, dtype=np.int64)
+    unit       = np.asarray(unit, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    held = np.zeros(len(face_ids), dtype=bool)
+    held[rng.choice(len(face_ids), size=min(sample, max(len(face_ids) - 1, 0)), replace=False)] = True
+    if not held.any():
+        return {"queries": 0}
+    queries = unit[held]
+    exact_matcher = FaceMatcher(face_ids[~held], person_ids[~held], unit[~held], normalized=True)
+    gallery = unit[~held]
+    quantized = QuantizedMatcher.from_unit(
+        face_ids[~held], person_ids[~held], gallery, exact_matcher.norms,
+        fetch=None, exact=gallery, rescore_top=rescore_top,
+    )
+    reference = exact_matcher.match(queries, threshold, top_k=1)
+    rescored  = quantized.match(queries, threshold, top_k=1)
+    approx    = quantized.approximate_similarities(queries)
+    approx_best = np.argmax(approx, axis=1)
+    approx_person = [
+        int(quantized.person_ids[row]) if 1.0 - approx[i, row] < threshold else None
+        for i, row in enumerate(approx_best)
+    ]
+    exact_sims = queries @ gallery.T
+    float_bytes = exact_matcher.matrix.nbytes
+    int8_bytes  = quantized.codes.nbytes + quantized.scales.nbytes
+    return {
+        "queries":                len(queries),
+        "gallery_size":           len(exact_matcher),
+        "float32_bytes":          int(float_bytes),
+        "int8_bytes":             int(int8_bytes),
+        "compression":            round(float_bytes / max(int8_bytes, 1), 2),
+        "max_similarity_error":   float(np.abs(approx - exact_sims).max()),
+        "int8_only_agreement":    float(np.mean([r["person_id"] == p for r, p in zip(reference, approx_person)])),
+        "rescored_agreement":     float(np.mean([r["person_id"] == s["person_id"] for r, s in zip(reference, rescored)])),
+        "rescored_same_face":     float(np.mean([r["face_id"] == s["face_id"] for r, s in zip(reference, rescored)])),
+        "rescore_top":            rescore_top,
+    }
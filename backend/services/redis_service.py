@@ -0,0 +1,37 @@
+"""
+Redis Service
+=============
+Shared Redis connection for caches and cross-process coordination state.
+Redis is treated as best-effort here: when it is unreachable callers fall
+back to process-local behaviour, and the client is not retried for a short
+back-off window so request paths do not stall on connection timeouts.
+"""
+import time
+import logging
+from config import Config
+logger = logging.getLogger(__name__)
+class RedisService:
+    RETRY_INTERVAL = 30
+    _client = None
+    _retry_at = 0.0
+    @classmethod
+    def get_client(cls):
+        """Return the shared client, or None while Redis is marked unavailable."""
+        if time.time() < cls._retry_at:
+            return None
+        if cls._client is None:
+            try:
+                import redis
+                cls._client = redis.Redis.from_url(
+                    Config.CACHE_REDIS_URL,
+                    socket_timeout=0.5,
+                    socket_connect_timeout=0.5,
+                )
+            except Exception as exc:
+                cls.mark_unavailable(exc)
+                return None
+        return cls._client
+    @classmethod
+    def mark_unavailable(cls, exc) -> None:
+        cls._retry_at = time.time() + cls.RETRY_INTERVAL
+        logger.warning(f"Redis unavailable ({exc}); retrying in {cls.RETRY_INTERVAL}s")
@@ -0,0 +1,123 @@
+"""
+Search Cache
+============
+Redis cache of the face analysis of search_by_face query images.
+Entries are keyed by the query image's sha256 and MODEL_VERSION, hold the
+detected faces' metadata plus their embeddings as raw float32 bytes, and
+expire after SEARCH_CACHE_TTL. An LRU index (sorted set of last-use
+times) keeps at most SEARCH_CACHE_MAX_ENTRIES entries. Hit and miss
+counters are kept in Redis so every web process reports the same totals.
+Without Redis the cache is simply bypassed.
+"""
+import json
+import time
+import logging
+import numpy as np
+from config import Config
+from services.redis_service import RedisService
+logger = logging.getLogger(__name__)
+class SearchEmbeddingCache:
+    PREFIX = "drishyamitra:search_emb:"
+    def __init__(self, model_version: str, dim: int, ttl: int, max_entries: int):
+        self.model_version = model_version
+        self.dim           = dim
+        self.ttl           = ttl
+        self.max_entries   = max_entries
+        self._lru_key      = f"{self.PREFIX}lru"
+    def _key(self, content_hash: str) -> str:
+        return f"{self.PREFIX}{self.model_version}:{content_hash}"
+    def _count(self, client, outcome: str) -> None:
+        try:
+            client.incr(f"{self.PREFIX}{outcome}")
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    def get(self, content_hash: str):
+        """Return the cached list of {facial_area, confidence, embedding} faces, or None."""
+        client = RedisService.get_client()
+        if client is None:
+            return None
+        key = self._key(content_hash)
+        try:
+            meta, vectors = client.hmget(key, "meta", "vectors")
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+            return None
+        if meta is None:
+            self._count(client, "misses")
+            return None
+        try:
+            pipe = client.pipeline()
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self._lru_key, {key: time.time()})
+            pipe.incr(f"{self.PREFIX}hits")
+            pipe.execute()
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+        faces = json.loads(meta)
+        matrix = np.frombuffer(vectors or b"", dtype="<f4").reshape(len(faces), -1) if faces else None
+        for i, face in enumerate(faces):
+            face["embedding"] = matrix[i].tolist() if face.pop("has_embedding") else None
+        return faces
+    def put(self, content_hash: str, faces: list) -> None:
+        """Store the analysed faces of one query image (crops are not cached)."""
+        client = RedisService.get_client()
+        if client is None:
+            return
+        meta = [
+            {
+                "facial_area":   face.get("facial_area"),
+                "confidence":    face.get("confidence"),
+                "landmarks":     face.get("landmarks"),
+                "has_embedding": face.get("embedding") is not None,
+            }
+            for face in faces
+        ]
+        vectors = np.asarray(
+            [face["embedding"] if face.get("embedding") is not None else np.zeros(self.dim)
+             for face in faces],
+            dtype="<f4",
+        )
+        key = self._key(content_hash)
+        try:
+            pipe = client.pipeline()
+            pipe.hset(key, mapping={"meta": json.dumps(meta), "vectors": vectors.tobytes()})
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self._lru_key, {key: time.time()})
+            pipe.zcard(self._lru_key)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                evicted = [k for k, _ in client.zpopmin(self._lru_key, size - self.max_entries)]
+                if evicted:
+                    client.delete(*evicted)
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    def stats(self) -> dict:
+        client = RedisService.get_client()
+        if client is None:
+            return {"available": False}
+        try:
+            hits, misses = client.mget(f"{self.PREFIX}hits", f"{self.PREFIX}misses")
+            entries = client.zcard(self._lru_key)
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+            return {"available": False}
+        hits, misses = int(hits or 0), int(misses or 0)
+        return {
+            "available": True,
+            "entries":   int(entries),
+            "hits":      hits,
+            "misses":    misses,
+            "hit_rate":  round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+_search_cache = None
+def get_search_cache() -> SearchEmbeddingCache:
+    global _search_cache
+    if _search_cache is None:
+        from services.face_recognition import FaceRecognitionService
+        _search_cache = SearchEmbeddingCache(
+            model_version=FaceRecognitionService.MODEL_VERSION,
+            dim=FaceRecognitionService.EMBEDDING_DIM,
+            ttl=Config.SEARCH_CACHE_TTL,
+            max_entries=Config.SEARCH_CACHE_MAX_ENTRIES,
+        )
+    return _search_cache
@@ -29,6 +29,14 @@ class SocketService:
             'message': f"Face recognition completed for photo #{photo_id}. Found {faces_count} faces."
         })
     @classmethod
+    def notify_bulk_processed(cls, user_id, photos_count, faces_count, failed_count=0):
+        cls.emit_to_user(user_id, 'bulk_processed', {
+            'photos_count': photos_count,
+            'faces_count': faces_count,
+            'failed_count': failed_count,
+            'message': f"Face recognition completed for {photos_count} uploaded photos. Found {faces_count} faces."
+        })
+    @classmethod
     def notify_upload_progress(cls, user_id, filename, progress):
         cls.emit_to_user(user_id, 'upload_progress', {
             'filename': filename,
@@ -1,11 +1,14 @@
 """
 Celery background task: process faces in an uploaded photo.
-Uses FaceRecognitionService (Facenet512 + RetinaFace + MTCNN pipeline).
+Uses FaceRecognitionService (single-pass RetinaFace + Facenet512 pipeline).
 """
 import logging
 import os
 import shutil
+from datetime import datetime
+from celery.signals import worker_process_init, worker_ready
 from celery_app import celery
+from config import Config
 logger = logging.getLogger(__name__)
 _flask_app = None
 def get_app():
@@ -19,6 +22,160 @@ def get_app():
         from app import create_app
         _flask_app = create_app()
     return _flask_app
+def _preload_face_models():
+    if not Config.FACE_PRELOAD_MODELS or not celery.conf.get("worker_face_models", True):
+        return
+    get_app()
+    from services.face_recognition import FaceRecognitionService
+    from services.inference_pool import configure_tf_threads, InferencePool
+    try:
+        if Config.FACE_INFERENCE_MODE == "process":
+            InferencePool.get()
+            return
+        configure_tf_threads(Config.TF_INTRA_OP_THREADS, Config.TF_INTER_OP_THREADS)
+        FaceRecognitionService.instance().warm_up()
+    except Exception as exc:
+        logger.error(f"Face model preload failed (pid={os.getpid()}): {exc}")
+@worker_process_init.connect
+def preload_in_pool_process(**kwargs):
+    """Prefork pool: load models once in every child process."""
+    _preload_face_models()
+@worker_ready.connect
+def preload_in_worker(sender=None, **kwargs):
+    """Solo/thread pools run tasks in the worker process itself, so warm it here."""
+    pool = getattr(sender, "pool", None)
+    if pool is not None and "prefork" not in type(pool).__module__:
+        _preload_face_models()
+def _store_photo_faces(app, photo, faces_data: list, service, finalize: bool = True) -> dict:
+    """
+    Match the analysed faces of one photo against the user's gallery, persist
+    them as Face rows and organise the photo into per-person folders.
+    Shared by the single-photo and batch tasks; the caller owns rollback.
+    With finalize=False the folder copy and the socket notification are left
+    to the caller (bulk uploads do both once in finish_bulk_upload).
+    """
+    from models.database import db
+    from models.face import Face
+    from services.face_recognition import FaceRecognitionService
+    from services.face_crops import store_crops
+    from services.face_service import FaceService
+    from services.socket_service import SocketService
+    photo_id = photo.id
+    abs_path = os.path.join(app.config["UPLOAD_FOLDER"], photo.filename)
+    if not faces_data:
+        logger.info(f"COMPLETED: No faces detected in photo {photo_id} ({abs_path})")
+        photo.faces_processed_at = datetime.utcnow()
+        db.session.commit()
+        _share_with_duplicates(photo, finalize)
+        return {"status": "success", "message": "No faces detected", "count": 0}
+    existing = Face.query.filter_by(photo_id=photo.id).all()
+    already_stored = {
+        j for _, j in service.pair_by_geometry(
+            [f.bounding_box for f in existing if f.bounding_box],
+            [[f["facial_area"].get(k, 0) for k in ("x", "y", "w", "h")] for f in faces_data],
+        )
+    }
+    if already_stored:
+        logger.info(f"{len(already_stored)} face(s) in photo {photo_id} already stored — skipping them")
+    logger.info(f"Detected {len(faces_data)} faces with landmarks. Stage 2: Matching faces...")
+    matched_names  = []
+    faces_stored   = 0
+    new_faces      = []
+    new_crops      = []
+    candidates = []
+    rejected   = []
+    for idx, face_info in enumerate(faces_data):
+        if idx in already_stored:
+            continue
+        if face_info.get("rejected"):
+            rejected.append(face_info)
+            continue
+        if not face_info.get("embedding"):
+            logger.warning(f"Skipping face #{idx} in photo {photo_id} — empty embedding")
+            continue
+        candidates.append((idx, face_info))
+    matches = service.match_photo_faces([f["embedding"] for _, f in candidates], photo.user_id)
+    unknown = iter(service.auto_create_persons(photo.user_id, sum(1 for p, _ in matches if p is None)))
+    for (idx, face_info), (matched_person, scores) in zip(candidates, matches):
+        embedding   = face_info.get("embedding")
+        facial_area = face_info.get("facial_area", {})
+        confidence  = face_info.get("face_confidence", face_info.get("confidence", 0.0))
+        landmarks   = face_info.get("landmarks", {})
+        bbox = [
+            facial_area.get("x", 0),
+            facial_area.get("y", 0),
+            facial_area.get("w", 0),
+            facial_area.get("h", 0),
+        ]
+        if matched_person is None:
+            matched_person = next(unknown)
+            logger.info(
+                f"Created new unknown person '{matched_person.name}' "
+                f"for user {photo.user_id}"
+            )
+        else:
+            matched_names.append(matched_person.name)
+            logger.info(
+                f"Matched face to '{matched_person.name}' "
+                f"(cos_dist={scores['cosine_distance']:.4f}, "
+                f"sim={scores['similarity']:.4f})"
+            )
+        new_face = Face(
+            photo_id      = photo.id,
+            person_id     = matched_person.id,
+            bounding_box  = bbox,
+            embedding     = embedding,
+            landmarks     = landmarks,
+            confidence    = float(confidence),
+            model_version = FaceRecognitionService.MODEL_VERSION,
+        )
+        db.session.add(new_face)
+        new_faces.append(new_face)
+        new_crops.append(face_info.get("face"))
+        faces_stored += 1
+    for face_info in rejected:
+        db.session.add(FaceService.rejected_face(photo.id, face_info))
+    photo.faces_processed_at = datetime.utcnow()
+    db.session.commit()
+    store_crops(new_faces, new_crops, photo.user_id)
+    service.cache_new_faces(photo.user_id, new_faces)
+    _share_with_duplicates(photo, finalize)
+    if matched_names and finalize:
+        organized_root = app.config.get(
+            "ORGANIZED_FOLDER",
+            os.path.join(app.config.get("UPLOAD_FOLDER", ""), "organized"),
+        )
+        user_dir = os.path.join(organized_root, f"user_{photo.user_id}")
+        for name in set(matched_names):
+            safe_name   = "".join(c for c in name if c.isalnum() or c in " -_").strip()
+            person_dir  = os.path.join(user_dir, safe_name)
+            os.makedirs(person_dir, exist_ok=True)
+            target      = os.path.join(person_dir, photo.filename)
+            if not os.path.exists(target):
+                shutil.copy2(abs_path, target)
+                logger.info(f"Organised photo → {target}")
+    logger.info(
+        f"Photo {photo_id} processed: "
+        f"{len(faces_data)} detected, {faces_stored} stored, "
+        f"{len(rejected)} skipped by the quality gate, matches={matched_names}"
+    )
+    if finalize:
+        SocketService.notify_face_processed(photo.user_id, photo.id, faces_stored)
+    return {
+        "status":         "success",
+        "faces_detected": len(faces_data),
+        "faces_stored":   faces_stored,
+        "faces_skipped":  len(rejected),
+        "matches":        matched_names,
+    }
+def _share_with_duplicates(photo, finalize: bool) -> None:
+    """Copy the results of a just-processed photo onto exact duplicates uploaded while it was pending."""
+    from services.face_service import FaceService
+    from services.socket_service import SocketService
+    for duplicate_id, copies in FaceService.copy_to_waiting_duplicates(photo).items():
+        logger.info(f"Photo {duplicate_id} took the faces of its original {photo.id}")
+        if finalize:
+            SocketService.notify_face_processed(photo.user_id, duplicate_id, len(copies))
 @celery.task(bind=True, name="services.tasks.process_photo_faces", max_retries=3)
 def process_photo_faces(self, photo_id: int):
     """
@@ -26,21 +183,21 @@ def process_photo_faces(self, photo_id: int):
     Pipeline
     --------
     1. Fetch Photo record and resolve absolute path.
-    2. Run FaceRecognitionService.detect_and_extract_faces (Facenet512 / RetinaFace).
-    3. Run .extract_faces_with_landmarks (MTCNN landmarks).
-    4. For each face — match against user's existing profiles (cosine similarity).
+    2. Run FaceRecognitionService.detect_and_extract_faces — one RetinaFace pass
+       yields boxes + landmarks, crops are aligned and embedded with Facenet512.
+    3. Skip detections that overlap faces already stored for this photo (re-runs).
+    4. Match all faces of the photo against the user's profiles in one batch (cosine similarity).
     5. Auto-create an unknown-person record if no match found.
-    6. Persist Face records (bbox, embedding, landmarks, confidence, model_version).
+    6. Persist Face records (bbox, embedding, landmarks, confidence, model_version)
+       and the aligned crop of each face.
     7. Optionally copy photo into a per-person organised folder.
     """
     app = get_app()
     with app.app_context():
         from models.database import db
         from models.photo import Photo
-        from models.face import Face
         from models.person import Person
         from services.face_recognition import FaceRecognitionService
-        from services.socket_service import SocketService
         try:
             photo = Photo.query.get(photo_id)
             if not photo:
@@ -51,98 +208,139 @@ def process_photo_faces(self, photo_id: int):
                 logger.error(f"process_photo_faces: Image missing at {abs_path}")
                 return {"status": "error", "message": "Image file missing"}
             logger.info(f"Starting face recognition pipeline for photo {photo_id} at {abs_path}")
-            
-            from PIL import Image
-            try:
-                with Image.open(abs_path) as img:
-                    width, height = img.size
-                    logger.info(f"Image {photo_id} dimensions: {width}x{height}")
-            except Exception as img_err:
-                logger.warning(f"Could not read image metadata for {photo_id}: {img_err}")
-
-            service = FaceRecognitionService()
-            logger.info("Stage 1: Detecting and extracting faces...")
-            faces_data = service.detect_and_extract_faces(abs_path)
-            if not faces_data:
-                logger.info(f"COMPLETED: No faces detected in photo {photo_id} ({abs_path})")
-                return {"status": "success", "message": "No faces detected", "count": 0}
-            logger.info(f"Detected {len(faces_data)} faces. Stage 2: Extracting landmarks...")
-            landmark_items = service.extract_faces_with_landmarks(abs_path)
-            landmark_map = {i: item.get("landmarks", {}) for i, item in enumerate(landmark_items)}
-            logger.info(f"Landmarks extracted for {len(landmark_map)} faces. Stage 3: Matching faces...")
-            matched_names  = []
-            faces_stored   = 0
-            for idx, face_info in enumerate(faces_data):
-                embedding   = face_info.get("embedding")
-                facial_area = face_info.get("facial_area", {})
-                confidence  = face_info.get("face_confidence", face_info.get("confidence", 0.0))
-                landmarks   = landmark_map.get(idx, {})
-                bbox = [
-                    facial_area.get("x", 0),
-                    facial_area.get("y", 0),
-                    facial_area.get("w", 0),
-                    facial_area.get("h", 0),
-                ]
-                if not embedding:
-                    logger.warning(f"Skipping face #{idx} in photo {photo_id} — empty embedding")
-                    continue
-                matched_person, scores = service.match_face(embedding, photo.user_id)
-                if matched_person is None:
-                    matched_person = service.auto_create_person(photo.user_id)
-                    logger.info(
-                        f"Created new unknown person '{matched_person.name}' "
-                        f"for user {photo.user_id}"
-                    )
-                else:
-                    matched_names.append(matched_person.name)
-                    logger.info(
-                        f"Matched face to '{matched_person.name}' "
-                        f"(cos_dist={scores['cosine_distance']:.4f}, "
-                        f"sim={scores['similarity']:.4f})"
-                    )
-                new_face = Face(
-                    photo_id      = photo.id,
-                    person_id     = matched_person.id,
-                    bounding_box  = bbox,
-                    embedding     = embedding,
-                    landmarks     = landmarks,
-                    confidence    = float(confidence),
-                    model_version = FaceRecognitionService.MODEL_VERSION,
-                )
-                db.session.add(new_face)
-                faces_stored += 1
-            db.session.commit()
-            service.invalidate_cache(photo.user_id)
-            if matched_names:
-                organized_root = app.config.get(
-                    "ORGANIZED_FOLDER",
-                    os.path.join(app.config.get("UPLOAD_FOLDER", ""), "organized"),
-                )
-                user_dir = os.path.join(organized_root, f"user_{photo.user_id}")
-                for name in set(matched_names):
-                    safe_name   = "".join(c for c in name if c.isalnum() or c in " -_").strip()
-                    person_dir  = os.path.join(user_dir, safe_name)
-                    os.makedirs(person_dir, exist_ok=True)
-                    target      = os.path.join(person_dir, photo.filename)
-                    if not os.path.exists(target):
-                        shutil.copy2(abs_path, target)
-                        logger.info(f"Organised photo → {target}")
+            from services.image_preprocessing import decode_image
+            decoded = decode_image(abs_path)
+            width, height = decoded.source_size
             logger.info(
-                f"Photo {photo_id} processed: "
-                f"{len(faces_data)} detected, {faces_stored} stored, "
-                f"matches={matched_names}"
+                f"Image {photo_id} dimensions: {width}x{height} "
+                f"(working {decoded.shape[1]}x{decoded.shape[0]})"
             )
-            SocketService.notify_face_processed(photo.user_id, photo.id, faces_stored)
-            return {
-                "status":         "success",
-                "faces_detected": len(faces_data),
-                "faces_stored":   faces_stored,
-                "matches":        matched_names,
-            }
+            service = FaceRecognitionService.instance()
+            if not FaceRecognitionService.is_ready():
+                logger.warning("Face models not preloaded in this process; first inference pays the cold start")
+            logger.info("Stage 1: Detecting and extracting faces...")
+            faces_data = service.analyze_batch([decoded])[0]
+            return _store_photo_faces(app, photo, faces_data, service)
         except Exception as exc:
             db.session.rollback()
             logger.error(f"process_photo_faces exception (photo {photo_id}): {exc}")
             raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+@celery.task(bind=True, name="services.tasks.process_photo_batch", max_retries=3, acks_late=True)
+def process_photo_batch(self, photo_ids: list, finalize: bool = True, user_id: int = None):
+    """
+    Celery task: process several photos through one batched inference pass.
+    Detection runs per image, then every aligned crop from every photo is
+    embedded by FaceRecognitionService.analyze_batch in shared tensor batches.
+    Matching and storage happen per photo, each in its own transaction.
+    finalize=False (chord members of a bulk upload) skips the per-photo
+    folder copies, notifications and clustering; finish_bulk_upload runs them once.
+    user_id, when set, frees the batch's fair-scheduling slot once the task
+    ends for good (not when it is only scheduled for a retry).
+    """
+    from celery.exceptions import Retry
+    release_slot = user_id is not None
+    try:
+        return _run_photo_batch(self, photo_ids, finalize)
+    except Retry:
+        release_slot = False
+        raise
+    finally:
+        if release_slot:
+            from services.fair_scheduling import release
+            release(user_id)
+def _run_photo_batch(task, photo_ids: list, finalize: bool) -> dict:
+    """Body of process_photo_batch; task is the bound task (for retries)."""
+    app = get_app()
+    with app.app_context():
+        from models.database import db
+        from models.photo import Photo
+        from services.face_recognition import FaceRecognitionService
+        try:
+            photos, paths = [], []
+            for photo_id in photo_ids:
+                photo = Photo.query.get(photo_id)
+                if not photo:
+                    logger.error(f"process_photo_batch: Photo {photo_id} not found")
+                    continue
+                abs_path = os.path.join(app.config["UPLOAD_FOLDER"], photo.filename)
+                if not os.path.exists(abs_path):
+                    logger.error(f"process_photo_batch: Image missing at {abs_path}")
+                    continue
+                photos.append(photo)
+                paths.append(abs_path)
+            groups = {photo.id: [] for photo in photos}
+            if app.config["PHASH_ENABLED"]:
+                from services.phash_index import group_near_duplicates, image_size
+                groups = group_near_duplicates(photos, app.config["PHASH_REUSE_DISTANCE"], [image_size(p) for p in paths])
+                paths = [path for photo, path in zip(photos, paths) if photo.id in groups]
+                photos = [photo for photo in photos if photo.id in groups]
+            service = FaceRecognitionService.instance()
+            analysed = service.analyze_batch(paths)
+        except Exception as exc:
+            logger.error(f"process_photo_batch exception (photos {photo_ids}): {exc}")
+            if task.request.retries >= task.max_retries:
+                # Out of retries: report the batch as failed so a bulk upload's chord callback still runs.
+                return {
+                    "status":    "error",
+                    "processed": 0,
+                    "message":   str(exc),
+                    "results":   {photo_id: {"status": "error", "message": str(exc)} for photo_id in photo_ids},
+                }
+            raise task.retry(exc=exc, countdown=2 ** task.request.retries)
+        from services.face_service import FaceService
+        from services.socket_service import SocketService
+        results = {}
+        for photo, faces_data in zip(photos, analysed):
+            try:
+                results[photo.id] = _store_photo_faces(app, photo, faces_data, service, finalize=finalize)
+            except Exception as exc:
+                db.session.rollback()
+                logger.error(f"process_photo_batch: storing faces for photo {photo.id} failed: {exc}")
+                results[photo.id] = {"status": "error", "message": str(exc)}
+                continue
+            # Near-identical frames of the same batch take the representative's results.
+            for member in groups[photo.id]:
+                try:
+                    copies = FaceService.copy_faces(photo, member)
+                    if finalize:
+                        SocketService.notify_face_processed(member.user_id, member.id, len(copies))
+                    results[member.id] = {"status": "success", "near_duplicate_of": photo.id, "faces_stored": len(copies)}
+                except Exception as exc:
+                    db.session.rollback()
+                    logger.error(f"process_photo_batch: reusing faces of photo {photo.id} for {member.id} failed: {exc}")
+                    results[member.id] = {"status": "error", "message": str(exc)}
+        if finalize:
+            for owner in {photo.user_id for photo in photos}:
+                schedule_face_clustering(owner)
+        return {"status": "success", "processed": len(results), "results": results}
+@celery.task(bind=True, name="services.tasks.finish_bulk_upload", max_retries=3)
+def finish_bulk_upload(self, batch_results: list, user_id: int, photo_ids: list):
+    """
+    Chord callback of a bulk upload, run once after every process_photo_batch
+    of the upload: copies the uploaded photos into their person folders,
+    schedules clustering of the new unknown faces and sends one notification.
+    photo_ids covers the whole upload, including photos that reused faces.
+    """
+    app = get_app()
+    with app.app_context():
+        from services.socket_service import SocketService
+        try:
+            organized = _organize_photos(app, user_id, photo_ids)
+        except Exception as exc:
+            logger.error(f"finish_bulk_upload exception (user {user_id}): {exc}")
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+        outcomes = [r for batch in batch_results or [] for r in (batch or {}).get("results", {}).values()]
+        faces_stored = sum(r.get("faces_stored", 0) for r in outcomes)
+        failed = sum(1 for r in outcomes if r.get("status") == "error")
+        if outcomes:
+            schedule_face_clustering(user_id)
+        SocketService.notify_bulk_processed(user_id, len(photo_ids), faces_stored, failed)
+        logger.info(
+            f"Bulk upload of user {user_id} finished: {len(photo_ids)} photo(s), "
+            f"{faces_stored} face(s) stored, {failed} failed, {organized} folder cop(ies)"
+        )
+        return {"status": "success", "photos": len(photo_ids), "faces_stored": faces_stored,
+                "failed": failed, "organized_count": organized}
 @celery.task(bind=True, name="services.tasks.send_whatsapp_photo_task", max_retries=3)
 def send_whatsapp_photo_task(self, log_id: int, user_id: int, photo_id: int, recipient: str, message: str):
     """
@@ -224,6 +422,11 @@ def cleanup_temp_storage(self):
     app = get_app()
     with app.app_context():
         import time
+        from datetime import datetime, timedelta
+        from services.chunked_uploads import expire_stale
+        expired = expire_stale(datetime.utcnow() - timedelta(days=1), app.config.get("UPLOAD_FOLDER", ""))
+        if expired:
+            logger.info(f"Expired {expired} abandoned chunked upload(s).")
         tmp_folder = os.path.join(app.config.get("UPLOAD_FOLDER", ""), "temp")
         if not os.path.exists(tmp_folder):
             return {"status": "success", "message": "No temp folder to clean"}
@@ -240,6 +443,251 @@ def cleanup_temp_storage(self):
                         logger.error(f"Error deleting temp file {filepath}: {e}")
         logger.info(f"Cleaned up {deleted_count} temporary files.")
         return {"status": "success", "deleted_count": deleted_count}
+@celery.task(bind=True, name="services.tasks.generate_derivatives", max_retries=3)
+def generate_derivatives(self, photo_ids: list):
+    """
+    Celery task: render the gallery derivatives (DERIVATIVE_SIZES) of the
+    given photos so the first gallery request does not have to.
+    """
+    app = get_app()
+    with app.app_context():
+        from models.photo import Photo
+        from services.derivatives import ensure_derivatives
+        rendered = 0
+        try:
+            for photo in Photo.query.filter(Photo.id.in_(photo_ids)).all():
+                abs_path = os.path.join(app.config["UPLOAD_FOLDER"], photo.filename)
+                if not os.path.exists(abs_path):
+                    logger.error(f"generate_derivatives: Image missing at {abs_path}")
+                    continue
+                rendered += len(ensure_derivatives(photo, abs_path))
+        except Exception as exc:
+            logger.error(f"generate_derivatives exception (photos {photo_ids}): {exc}")
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+        return {"status": "success", "photos": len(photo_ids), "derivatives": rendered}
+@celery.task(bind=True, name="services.tasks.compact_embedding_shards", max_retries=3)
+def compact_embedding_shards(self, user_id: int):
+    """
+    Maintenance task: merge a user's embedding shards into one file, drop
+    tombstoned rows and refresh person ids from the DB.
+    """
+    app = get_app()
+    with app.app_context():
+        from services.face_recognition import FaceRecognitionService, get_shard_store
+        shard_store = get_shard_store()
+        if shard_store is None:
+            return {"status": "skipped", "message": "Embedding shards are disabled"}
+        try:
+            service = FaceRecognitionService.instance()
+            face_ids, person_ids = service.live_faces(user_id)
+            kept = shard_store.compact(user_id, dict(zip(face_ids.tolist(), person_ids.tolist())))
+            service.invalidate_cache(user_id)
+            return {"status": "success", "rows": kept}
+        except Exception as exc:
+            logger.error(f"compact_embedding_shards exception (user {user_id}): {exc}")
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+def schedule_face_clustering(user_id: int) -> None:
+    """
+    Queue cluster_unknown_faces for user_id after FACE_CLUSTER_DELAY seconds.
+    Batches of one bulk upload that finish inside that window share one run.
+    """
+    from services.redis_service import RedisService
+    client = RedisService.get_client()
+    if client is not None:
+        try:
+            if not client.set(f"drishyamitra:cluster_pending:{user_id}", 1, nx=True, ex=Config.FACE_CLUSTER_DELAY):
+                return
+        except Exception as exc:
+            RedisService.mark_unavailable(exc)
+    cluster_unknown_faces.apply_async((user_id,), countdown=Config.FACE_CLUSTER_DELAY)
+@celery.task(bind=True, name="services.tasks.cluster_unknown_faces", max_retries=3)
+def cluster_unknown_faces(self, user_id: int):
+    """
+    Maintenance task: merge the singleton "Unknown Person" records created
+    since the last run into clusters, then re-organise the user's folders.
+    """
+    app = get_app()
+    with app.app_context():
+        from models.database import db
+        from services.face_recognition import FaceRecognitionService
+        from services.face_clustering import FaceClusterer, remove_person_folders
+        try:
+            clusterer = FaceClusterer(FaceRecognitionService.instance(), Config.FACE_CLUSTER_THRESHOLD)
+            result = clusterer.cluster_user(user_id)
+        except Exception as exc:
+            db.session.rollback()
+            logger.error(f"cluster_unknown_faces exception (user {user_id}): {exc}")
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+        if result.get("merged_persons"):
+            organized_root = app.config.get(
+                "ORGANIZED_FOLDER",
+                os.path.join(app.config.get("UPLOAD_FOLDER", ""), "organized"),
+            )
+            remove_person_folders(os.path.join(organized_root, f"user_{user_id}"), result.pop("removed_names", []), user_id)
+            organize_all_photos.delay(user_id)
+        result.pop("removed_names", None)
+        return {"status": "success", **result}
+def _reembed_lease(user_id: int, action: str) -> bool:
+    """
+    Guard that keeps one re-embedding chain per user: "acquire" (False when
+    a chain already holds it), "renew" after each chunk, "release" when done.
+    Without Redis every call succeeds.
+    """
+    from services.redis_service import RedisService
+    client = RedisService.get_client()
+    if client is None:
+        return True
+    key = f"drishyamitra:reembed:{user_id}"
+    try:
+        if action == "acquire":
+            return bool(client.set(key, 1, nx=True, ex=Config.REEMBED_LEASE))
+        if action == "renew":
+            client.expire(key, Config.REEMBED_LEASE)
+        else:
+            client.delete(key)
+    except Exception as exc:
+        RedisService.mark_unavailable(exc)
+    return True
+@celery.task(bind=True, name="services.tasks.reembed_outdated_faces")
+def reembed_outdated_faces(self, user_id: int = None):
+    """
+    Maintenance task: start (or resume from its checkpoint) the re-embedding
+    of every user, or only user_id, that still has faces from an older
+    MODEL_VERSION. Runs hourly, which also resumes chains lost to a worker restart.
+    """
+    app = get_app()
+    with app.app_context():
+        from services.face_recognition import FaceRecognitionService
+        from services.face_reembedding import EmbeddingMigrator
+        migrator = EmbeddingMigrator(FaceRecognitionService.instance(), app.config["UPLOAD_FOLDER"])
+        user_ids = [user_id] if user_id is not None else migrator.outdated_users()
+        queued = []
+        for uid in user_ids:
+            if _reembed_lease(uid, "acquire"):
+                reembed_user_faces.delay(uid)
+                queued.append(uid)
+        if queued:
+            logger.info(f"Re-embedding to {migrator.version} queued for user(s) {queued}")
+        return {"status": "success", "queued": queued}
+@celery.task(bind=True, name="services.tasks.reembed_user_faces", max_retries=3)
+def reembed_user_faces(self, user_id: int):
+    """
+    Maintenance task: stage new embeddings for the next chunk of the user's
+    outdated faces and queue the following chunk after REEMBED_CHUNK_DELAY
+    seconds. The last chunk swaps the staged embeddings in.
+    """
+    app = get_app()
+    with app.app_context():
+        from models.database import db
+        from services.face_recognition import FaceRecognitionService
+        from services.face_reembedding import EmbeddingMigrator
+        try:
+            migrator  = EmbeddingMigrator(FaceRecognitionService.instance(), app.config["UPLOAD_FOLDER"])
+            migration = migrator.start(user_id)
+            result    = migrator.run_chunk(migration, Config.REEMBED_BATCH_SIZE)
+            if not result["remaining"]:
+                result.update(migrator.complete(migration))
+        except Exception as exc:
+            db.session.rollback()
+            logger.error(f"reembed_user_faces exception (user {user_id}): {exc}")
+            if self.request.retries >= self.max_retries:
+                # Give the chain up; the hourly sweep resumes it from the checkpoint.
+                _reembed_lease(user_id, "release")
+                raise
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+        if result["remaining"]:
+            # Back off while photos keep failing; each is given up after REEMBED_MAX_DEFERRALS attempts.
+            _reembed_lease(user_id, "renew")
+            reembed_user_faces.apply_async((user_id,), countdown=Config.REEMBED_CHUNK_DELAY * 2 ** result["attempts"])
+        else:
+            _reembed_lease(user_id, "release")
+        return {"status": "success", **result}
+@celery.task(bind=True, name="services.tasks.backfill_photo_hashes")
+def backfill_photo_hashes(self, user_id: int = None, batch_size: int = 200):
+    """
+    Maintenance task: compute content (and, when enabled, perceptual) hashes
+    for photos uploaded before deduplication existed, in batches.
+    """
+    app = get_app()
+    with app.app_context():
+        import hashlib
+        from models.database import db
+        from models.photo import Photo
+        from utils.uploads import CHUNK_SIZE
+        from services.image_preprocessing import perceptual_hash
+        updated = 0
+        last_id = 0
+        while True:
+            query = Photo.query.filter(Photo.content_hash.is_(None), Photo.id > last_id)
+            if user_id is not None:
+                query = query.filter(Photo.user_id == user_id)
+            photos = query.order_by(Photo.id).limit(batch_size).all()
+            if not photos:
+                break
+            for photo in photos:
+                last_id = photo.id
+                if not os.path.exists(photo.filepath):
+                    continue
+                hasher = hashlib.sha256()
+                with open(photo.filepath, "rb") as fh:
+                    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                        hasher.update(chunk)
+                photo.content_hash = hasher.hexdigest()
+                if Config.PHASH_ENABLED and not photo.phash:
+                    try:
+                        photo.phash = perceptual_hash(photo.filepath)
+                    except Exception as exc:
+                        logger.warning(f"backfill_photo_hashes: no perceptual hash for photo {photo.id}: {exc}")
+                updated += 1
+            db.session.commit()
+        logger.info(f"Backfilled hashes for {updated} photo(s)")
+        return {"status": "success", "updated": updated}
+def _organize_photos(app, user_id: int, photo_ids: list = None) -> int:
+    """
+    Copy the user's photos (all, or only photo_ids) into one folder per
+    recognised person. Person names are read with one joined query.
+    Returns the number of copies made.
+    """
+    from models.database import db
+    from models.photo import Photo
+    from models.face import Face
+    from models.person import Person
+    query = (
+        db.session.query(Photo.id, Photo.filename, Person.name)
+        .join(Face, Face.photo_id == Photo.id)
+        .join(Person, Face.person_id == Person.id)
+        .filter(Photo.user_id == user_id)
+    )
+    if photo_ids is not None:
+        if not photo_ids:
+            return 0
+        query = query.filter(Photo.id.in_(photo_ids))
+    names = {}
+    for photo_id, filename, name in query.distinct():
+        if name:
+            names.setdefault(filename, set()).add(name)
+    organized_count = 0
+    organized_root = app.config.get(
+        "ORGANIZED_FOLDER",
+        os.path.join(app.config.get("UPLOAD_FOLDER", ""), "organized"),
+    )
+    user_dir = os.path.join(organized_root, f"user_{user_id}")
+    for filename, matched_names in names.items():
+        abs_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        if not os.path.exists(abs_path):
+            continue
+        for name in matched_names:
+            safe_name = "".join(c for c in name if c.isalnum() or c in " -_").strip()
+            person_dir = os.path.join(user_dir, safe_name)
+            os.makedirs(person_dir, exist_ok=True)
+            target = os.path.join(person_dir, filename)
+            if not os.path.exists(target):
+                try:
+                    shutil.copy2(abs_path, target)
+                    organized_count += 1
+                except Exception as exc:
+                    logger.error(f"Failed to organize photo {filename}: {exc}")
+    return organized_count
 @celery.task(bind=True, name="services.tasks.organize_all_photos")
 def organize_all_photos(self, user_id: int):
     """
@@ -248,37 +696,5 @@ def organize_all_photos(self, user_id: int):
     """
     app = get_app()
     with app.app_context():
-        from models.photo import Photo
-        from models.face import Face
-        from models.person import Person
-        photos = Photo.query.filter_by(user_id=user_id).all()
-        organized_count = 0
-        organized_root = app.config.get(
-            "ORGANIZED_FOLDER",
-            os.path.join(app.config.get("UPLOAD_FOLDER", ""), "organized"),
-        )
-        user_dir = os.path.join(organized_root, f"user_{user_id}")
-        for photo in photos:
-            faces = Face.query.filter_by(photo_id=photo.id).all()
-            if not faces:
-                continue
-            abs_path = os.path.join(app.config["UPLOAD_FOLDER"], photo.filename)
-            if not os.path.exists(abs_path):
-                continue
-            matched_names = set()
-            for face in faces:
-                person = Person.query.get(face.person_id)
-                if person and person.name:
-                    matched_names.add(person.name)
-            for name in matched_names:
-                safe_name = "".join(c for c in name if c.isalnum() or c in " -_").strip()
-                person_dir = os.path.join(user_dir, safe_name)
-                os.makedirs(person_dir, exist_ok=True)
-                target = os.path.join(person_dir, photo.filename)
-                if not os.path.exists(target):
-                    try:
-                        shutil.copy2(abs_path, target)
-                        organized_count += 1
-                    except Exception as exc:
-                        logger.error(f"Failed to organize photo {photo.filename}: {exc}")
+        organized_count = _organize_photos(app, user_id)
         return {"status": "success", "organized_count": organized_count, "user_id": user_id}
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Shared fixtures: a minimal Flask app on in-memory SQLite with every model
+registered, Redis treated as unavailable and file storage under tmp_path.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    from flask import Flask
+    from config import Config
+    from models.database import db, init_db
+    from services.redis_service import RedisService
+    monkeypatch.setattr(RedisService, "get_client", classmethod(lambda cls: None))
+    monkeypatch.setattr(Config, "FACE_CROPS_FOLDER", str(tmp_path / "face_crops"))
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(SQLALCHEMY_DATABASE_URI="sqlite:///:memory:", UPLOAD_FOLDER=str(tmp_path / "photos"))
+    os.makedirs(app.config["UPLOAD_FOLDER"])
+    init_db(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+@pytest.fixture
+def user(app):
+    from models.database import db
+    from models.user import User
+    user = User(username="tester", email="tester@example.com")
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    yield user
+    # Galleries are cached per user id, and every test's user gets the same one.
+    from services.embedding_cache import embedding_cache, prototype_cache
+    embedding_cache.forget(user_id)
+    prototype_cache.forget(user_id)
+def unit_vector(seed: int, dim: int = 512) -> np.ndarray:
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
@@ -0,0 +1,44 @@
+import celery
+import pytest
+from routes.photo_routes import _dispatch_bulk
+from services import fair_scheduling
+from services.face_service import FaceService
+@pytest.fixture
+def slots(monkeypatch):
+    """Record fair-share reservations and releases instead of touching Redis."""
+    calls = {"reserved": [], "released": []}
+    def reserve(user_id, count):
+        calls["reserved"].append((user_id, count))
+        return list(range(count))
+    monkeypatch.setattr(fair_scheduling, "reserve", reserve)
+    monkeypatch.setattr(fair_scheduling, "release", lambda user_id, count=1: calls["released"].append((user_id, count)))
+    return calls
+def _entries(photo_ids):
+    return [{"id": photo_id, "filename": f"user_7_{photo_id}.jpg"} for photo_id in photo_ids]
+def test_batches_go_out_as_one_chord(app, slots, monkeypatch):
+    app.config["BULK_PHOTOS_PER_TASK"] = 2
+    sent = []
+    monkeypatch.setattr(celery, "chord", lambda header: lambda body: sent.append((header, body)))
+    _dispatch_bulk(7, [1, 2, 3], [1, 2, 3, 4], _entries([1, 2, 3, 4]))
+    assert slots["reserved"] == [(7, 2)] and slots["released"] == []
+    (header, body), = sent
+    assert [batch.args for batch in header] == [([1, 2], False, 7), ([3], False, 7)]
+    assert [batch.options["priority"] for batch in header] == [0, 1]
+    assert body.task == "services.tasks.finish_bulk_upload" and body.args == (7, [1, 2, 3, 4])
+def test_broker_failure_releases_slots_and_falls_back_per_photo(app, slots, monkeypatch):
+    app.config["BULK_PHOTOS_PER_TASK"] = 2
+    def chord(header):
+        raise ConnectionError("broker unreachable")
+    monkeypatch.setattr(celery, "chord", chord)
+    queued = []
+    def process_photo_async(app, photo_id, image_path, user_id):
+        if photo_id == 3:
+            raise ConnectionError("broker unreachable")
+        queued.append((photo_id, image_path, user_id))
+    monkeypatch.setattr(FaceService, "process_photo_async", staticmethod(process_photo_async))
+    entries = _entries([1, 2, 3])
+    _dispatch_bulk(7, [1, 2, 3], [1, 2, 3], entries)
+    assert slots["released"] == [(7, 2)]
+    assert [photo_id for photo_id, _, _ in queued] == [1, 2]
+    assert queued[0][1].endswith("user_7_1.jpg")
+    assert [entry.get("processing_queued") for entry in entries] == [None, None, False]
@@ -0,0 +1,97 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from config import Config
+from models.database import db
+from models.face import Face
+from models.person import Person
+from models.photo import Photo
+from services.face_reembedding import EmbeddingMigrator
+from conftest import unit_vector
+class FakeService:
+    """Stands in for FaceRecognitionService: embeds by crop value, fails detection on demand."""
+    MODEL_VERSION = "test-v2"
+    def __init__(self):
+        self.failing = True
+        self.refreshed = []
+    def detect_and_align(self, decoded, gate=True):
+        if self.failing:
+            raise RuntimeError("detector crashed")
+        return []
+    def embed_faces(self, crops):
+        return np.asarray([np.full(512, float(crop[0, 0, 0]), dtype=np.float32) for crop in crops]).reshape(-1, 512)
+    def refresh_prototypes(self, person_ids):
+        self.refreshed.extend(person_ids)
+    def reset_gallery(self, user_id):
+        pass
+def _photo(app, user, name, write=True):
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    if write:
+        cv2.imwrite(path, np.full((64, 64, 3), 128, dtype=np.uint8))
+    photo = Photo(filename=name, filepath=path, user_id=user.id)
+    db.session.add(photo)
+    db.session.flush()
+    return photo
+def _face(photo, person, seed, crop_value=None):
+    face = Face(photo_id=photo.id, person_id=person.id, bounding_box=[0, 0, 32, 32],
+                embedding=unit_vector(seed), model_version="test-v1")
+    db.session.add(face)
+    db.session.flush()
+    if crop_value is not None:
+        face.crop_path = os.path.join(f"user_{photo.user_id}", f"{face.id}.jpg")
+        path = os.path.join(Config.FACE_CROPS_FOLDER, face.crop_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, np.full((40, 40, 3), crop_value, dtype=np.uint8))
+    return face
+@pytest.fixture
+def person(user):
+    person = Person(name="Asha", user_id=user.id)
+    db.session.add(person)
+    db.session.flush()
+    return person
+def test_checkpoint_stays_before_a_deferred_face_until_it_is_given_up(app, user, person, monkeypatch):
+    monkeypatch.setattr(Config, "REEMBED_MAX_DEFERRALS", 3)
+    broken = _face(_photo(app, user, "broken.jpg"), person, seed=1)
+    ok = _photo(app, user, "ok.jpg")
+    staged = [_face(ok, person, seed=2, crop_value=50), _face(ok, person, seed=3, crop_value=100)]
+    db.session.commit()
+    migrator = EmbeddingMigrator(FakeService(), app.config["UPLOAD_FOLDER"])
+    migration = migrator.start(user.id)
+    result = migrator.run_chunk(migration, batch_size=10)
+    assert result["staged"] == 2 and result["deferred"] == 1 and result["remaining"]
+    assert migration.last_face_id == broken.id - 1
+    assert all(db.session.get(Face, f.id).pending_model_version == "test-v2" for f in staged)
+    assert db.session.get(Face, broken.id).pending_model_version is None
+    result = migrator.run_chunk(migration, batch_size=10)
+    assert result["staged"] == 0 and result["deferred"] == 1 and result["attempts"] == 2
+    assert migration.last_face_id == broken.id - 1
+    result = migrator.run_chunk(migration, batch_size=10)
+    assert result["deferred"] == 0 and result["failed"] == 1 and not result["remaining"]
+    assert migration.last_face_id == broken.id
+    assert not migration.deferrals
+    assert db.session.get(Face, broken.id).pending_model_version == "test-v2"
+def test_complete_swaps_staged_embeddings_in(app, user, person):
+    ok = _photo(app, user, "ok.jpg")
+    faces = [_face(ok, person, seed=4, crop_value=50), _face(ok, person, seed=5, crop_value=100)]
+    lost = _face(_photo(app, user, "gone.jpg", write=False), person, seed=6)
+    db.session.commit()
+    service = FakeService()
+    migrator = EmbeddingMigrator(service, app.config["UPLOAD_FOLDER"])
+    migration = migrator.start(user.id)
+    result = migrator.run_chunk(migration, batch_size=10)
+    assert result == dict(result, staged=2, failed=1, deferred=0, remaining=False)
+    summary = migrator.complete(migration)
+    assert summary == {"swapped": 2, "dropped": 1}
+    assert migration.status == "completed"
+    db.session.expire_all()
+    for face in faces:
+        stored = db.session.get(Face, face.id)
+        assert stored.model_version == "test-v2"
+        assert stored.pending_embedding is None and stored.pending_model_version is None
+        crop = cv2.imread(os.path.join(Config.FACE_CROPS_FOLDER, stored.crop_path))
+        assert np.allclose(stored.embedding, float(crop[0, 0, 0]))
+    dropped = db.session.get(Face, lost.id)
+    assert dropped.embedding is None and dropped.person_id == person.id
+    assert person.id in service.refreshed
+    assert migrator._outdated().filter(Photo.user_id == user.id).count() == 0
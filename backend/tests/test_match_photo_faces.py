@@ -0,0 +1,57 @@
+import math
+import numpy as np
+import pytest
+from config import Config
+from models.database import db
+from models.face import Face
+from models.person import Person
+from models.photo import Photo
+from services.face_recognition import FaceRecognitionService
+from conftest import unit_vector
+@pytest.fixture
+def service(app, monkeypatch):
+    monkeypatch.setattr(Config, "FACE_PROTOTYPE_MATCHING", False)
+    monkeypatch.setattr(Config, "FACE_ANN_ENABLED", False)
+    monkeypatch.setattr(Config, "FACE_EMBEDDING_SHARDS", False)
+    monkeypatch.setattr(Config, "FACE_GALLERY_QUANTIZATION", "none")
+    return FaceRecognitionService()
+def _gallery(user, vectors: dict) -> dict:
+    """One person with one stored face per vector; returns {name: Person}."""
+    photo = Photo(filename="gallery.jpg", filepath="gallery.jpg", user_id=user.id)
+    db.session.add(photo)
+    db.session.flush()
+    persons = {}
+    for name, vector in vectors.items():
+        persons[name] = Person(name=name, user_id=user.id)
+        db.session.add(persons[name])
+        db.session.flush()
+        db.session.add(Face(photo_id=photo.id, person_id=persons[name].id, embedding=vector,
+                            model_version=FaceRecognitionService.MODEL_VERSION))
+    db.session.commit()
+    return persons
+def _mix(a, b, weight_a, weight_b):
+    vector = weight_a * a + weight_b * b
+    return (vector / np.linalg.norm(vector)).tolist()
+def test_two_faces_never_get_the_same_person(user, service):
+    asha, ravi = unit_vector(1), unit_vector(2)
+    ravi = ravi - (ravi @ asha) * asha
+    ravi /= np.linalg.norm(ravi)
+    persons = _gallery(user, {"Asha": asha, "Ravi": ravi})
+    # Both faces are closest to Asha; the second is also within the threshold of Ravi.
+    queries = [asha.tolist(), _mix(asha, ravi, 0.75, 0.66)]
+    assert [p.id for p, _ in service.match_faces(queries, user.id)] == [persons["Asha"].id] * 2
+    resolved = service.match_photo_faces(queries, user.id)
+    assert [p.id if p else None for p, _ in resolved] == [persons["Asha"].id, persons["Ravi"].id]
+    score = resolved[1][1]
+    assert score["candidates"][0]["person_id"] == persons["Ravi"].id
+    assert isinstance(score["euclidean"], float) and math.isfinite(score["euclidean"])
+    assert score["euclidean"] == pytest.approx(np.linalg.norm(np.asarray(queries[1]) - ravi), abs=1e-4)
+def test_a_face_without_a_free_person_stays_unmatched(user, service):
+    asha = unit_vector(3)
+    persons = _gallery(user, {"Asha": asha})
+    queries = [asha.tolist(), _mix(asha, unit_vector(4), 0.95, 0.05)]
+    resolved = service.match_photo_faces(queries, user.id)
+    assigned = [p.id for p, _ in resolved if p is not None]
+    assert assigned == [persons["Asha"].id]
+    unmatched = [score for p, score in resolved if p is None]
+    assert len(unmatched) == 1 and unmatched[0]["euclidean"] == float("inf")
@@ -0,0 +1,79 @@
+import os
+import hashlib
+CHUNK_SIZE = 1024 * 1024
+class UploadTooLarge(Exception):
+    """Raised by save_stream when the stream exceeds max_bytes; the partial file is removed."""
+def save_stream(stream, filepath, max_bytes=None, hasher=None):
+    """
+    Copy a file-like upload to filepath in CHUNK_SIZE pieces, hashing the
+    bytes as they are written so the file is never read back.
+    Returns (size_in_bytes, hasher); hasher defaults to a fresh sha256.
+    """
+    hasher = hasher or hashlib.sha256()
+    size = 0
+    try:
+        with open(filepath, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    return size, hasher
+def append_stream(stream, filepath, offset, max_bytes=None, hasher=None):
+    """
+    Write a chunk stream to filepath starting at offset, cutting off any
+    bytes past offset left by an interrupted earlier chunk. The hasher must
+    hold the state of the first offset bytes and is updated in place (pass a
+    copy to keep the old state); on UploadTooLarge or any error the file is
+    truncated back to offset.
+    Returns the new end offset.
+    """
+    end = offset
+    with open(filepath, 'r+b' if os.path.exists(filepath) else 'w+b') as out:
+        out.truncate(offset)
+        out.seek(offset)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if max_bytes is not None and end + len(chunk) > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                out.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                end += len(chunk)
+        except BaseException:
+            out.truncate(offset)
+            raise
+    return end
+def hash_file(filepath, length=None, hasher=None):
+    """Hash the first length bytes (all when None) of filepath; returns the hasher."""
+    hasher = hasher or hashlib.sha256()
+    remaining = length
+    with open(filepath, 'rb') as src:
+        while remaining is None or remaining > 0:
+            chunk = src.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+def link_or_keep(source_path, duplicate_path):
+    """Replace duplicate_path with a hard link to source_path when the filesystem allows it."""
+    try:
+        tmp = f"{duplicate_path}.link"
+        os.link(source_path, tmp)
+        os.replace(tmp, duplicate_path)
+        return True
+    except OSError:
+        return False
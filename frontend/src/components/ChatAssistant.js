@@ -60,7 +60,7 @@ export default function ChatAssistant({ messages, isOpen, onToggle, input, onInp
                     {data.photos.slice(0, 4).map((p, idx) => (
                         <div key={idx} className="relative aspect-square rounded-xl overflow-hidden border border-slate-600">
                             <img
-                                src={`http://localhost:5000/api/dashboard/media/${p.filename}`}
+                                src={`http://localhost:5000/api/dashboard/media/${p.filename}?size=256`}
                                 alt="Result"
                                 className="w-full h-full object-cover"
                             />
@@ -23,8 +23,17 @@ export default function FolderList({ folders, onFolderClick }) {
                     className="bg-slate-800/60 backdrop-blur-xl border border-slate-700 rounded-2xl md:rounded-3xl p-6 md:p-8 cursor-pointer shadow-lg hover:border-primary-500/50 hover:shadow-primary-500/20 transition-all group relative overflow-hidden"
                 >
                     <div className="absolute top-0 right-0 w-32 h-32 bg-primary-500/5 rounded-full blur-3xl group-hover:bg-primary-500/10 transition-colors" />
-                    <div className="bg-slate-700/50 w-16 h-16 md:w-20 md:h-20 rounded-2xl flex items-center justify-center mb-4 md:mb-6 group-hover:scale-110 transition-transform">
-                        <FolderHeart className="w-8 h-8 md:w-10 md:h-10 text-primary-400" />
+                    <div className="bg-slate-700/50 w-16 h-16 md:w-20 md:h-20 rounded-2xl flex items-center justify-center mb-4 md:mb-6 group-hover:scale-110 transition-transform overflow-hidden">
+                        {folder.avatar_token ? (
+                            <img
+                                src={`http://localhost:5000/api/dashboard/media/faces/${folder.avatar_token}`}
+                                alt={folder.name}
+                                loading="lazy"
+                                className="w-full h-full object-cover"
+                            />
+                        ) : (
+                            <FolderHeart className="w-8 h-8 md:w-10 md:h-10 text-primary-400" />
+                        )}
                     </div>
                     <h3 className="text-xl font-bold text-white mb-2 truncate">{folder.name}</h3>
                     <p className="text-sm text-slate-400 font-medium">
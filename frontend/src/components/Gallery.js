@@ -28,7 +28,7 @@ export default function Gallery({ photos, onWhatsAppShare, onEmailShare, onPhoto
                             onClick={() => onPhotoClick && onPhotoClick(p)}
                         >
                             <img
-                                src={`http://localhost:5000/api/dashboard/media/${p.filename}`}
+                                src={`http://localhost:5000/api/dashboard/media/${p.filename}?size=256`}
                                 alt={p.filename}
                                 loading="lazy"
                                 className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-700 ease-out"
@@ -26,7 +26,7 @@ export default function PhotoModal({ photo, onClose }) {
                 { }
                 <div className="w-full md:w-3/4 bg-slate-950 flex items-center justify-center relative p-2 md:p-4 group">
                     <img
-                        src={`http://localhost:5000/api/dashboard/media/${photo.filename}`}
+                        src={`http://localhost:5000/api/dashboard/media/${photo.filename}?size=1024`}
                         alt={photo.filename}
                         className="max-w-full max-h-[50vh] md:max-h-[85vh] object-contain shadow-2xl drop-shadow-2xl"
                     />